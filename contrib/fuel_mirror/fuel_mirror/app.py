@@ -85,6 +85,7 @@ class Application(app.App):
             connection_count=int(self.config.get('connection_count', 0)),
             connection_proxy=self.config.get('http_proxy'),
             connection_secure_proxy=self.config.get('https_proxy'),
+            package_store=self.config.get('package_store'),
         )
 
 
@@ -19,8 +19,10 @@ import warnings
 
 from packetary.library.context import Context
 from packetary.library.index import Index
+from packetary.library.journal import Journal
 from packetary.library.package import Relation
 from packetary.library.repository import Repository
+from packetary.library.scheduler import Scheduler
 
 
 def create_context(**kwargs):
@@ -40,6 +42,64 @@ def _get_set_of_packages(repository,
     :param bootstrap: the additional packages required for bootstrap
     :return: the set of packages
     """
+    origin_packages, master, unresolved = _load_indexes(
+        repository, origin, debs, bootstrap
+    )
+    return _resolve_packages(origin_packages, master, unresolved)
+
+
+def _resolve_packages(origin_packages, master, unresolved):
+    """Resolves the depends within loaded indexes.
+
+    :param origin_packages: the index of origin repository
+    :param master: the index of master repository or None
+    :param unresolved: the set of requirements
+    :return: the set of packages
+    """
+    if len(unresolved) > 0 or master is not None:
+        packages = origin_packages.resolve(unresolved, master)
+    else:
+        packages = origin_packages
+
+    _warn_unresolved(unresolved)
+    return packages
+
+
+def _get_bootstrap_closure(origin_packages, bootstrap):
+    """Gets the names of bootstrap packages and all of their depends.
+
+    :param origin_packages: the index of origin repository
+    :param bootstrap: the packages required for bootstrap
+    :return: the set of names
+    """
+    requires = set(Relation(r.split()) for r in bootstrap)
+    return frozenset(x.name for x in origin_packages.resolve(requires))
+
+
+def _iter_resolved_packages(repository,
+                            origin,
+                            debs=None,
+                            bootstrap=None):
+    """Yields the packages related to depends as soon as they are resolved.
+    :param repository: the repository manager
+    :param origin: the url(s) to origin repository
+    :param debs: the url(s) of repositories to get dependency
+    :param bootstrap: the additional packages required for bootstrap
+    :return: the iterator over packages
+    """
+    origin_packages, master, unresolved = _load_indexes(
+        repository, origin, debs, bootstrap
+    )
+    for package in origin_packages.iter_resolve(unresolved, master):
+        yield package
+    _warn_unresolved(unresolved)
+
+
+def _load_indexes(repository, origin, debs, bootstrap):
+    """Loads the indexes of origin and master repositories.
+
+    :return: tuple(origin index, master index or None, requirements)
+    """
     origin_packages = Index()
     repository.load_packages(origin, origin_packages.add)
     unresolved = set()
@@ -51,18 +111,42 @@ def _get_set_of_packages(repository,
         repository.load_packages(debs, master.add)
     else:
         master = None
+    return origin_packages, master, unresolved
 
-    if len(unresolved) > 0 or master is not None:
-        packages = origin_packages.resolve(unresolved, master)
-    else:
-        packages = origin_packages
 
+def _warn_unresolved(unresolved):
     if len(unresolved) > 0:
         warnings.warn(
             "The following depends is unresolved: {0}"
             .format(",".join((six.text_type(x) for x in unresolved)))
         )
-    return packages
+
+
+def _is_streaming(download_order):
+    """Checks that packages can be copied before all of them are known."""
+    return (download_order or Scheduler.DEFAULT_POLICY) == "index"
+
+
+def _get_planned_packages(repository, origin, destination, journal):
+    """Gets the packages, that were planned by interrupted run.
+
+    :param repository: the repository manager
+    :param origin: the url(s) to origin repository
+    :param destination: the destination folder
+    :param journal: the journal of interrupted run
+    :return: tuple(the index of origin repository, the list of packages)
+    """
+    origin_packages = Index()
+    packages = []
+
+    def consumer(package):
+        origin_packages.add(package)
+        path = repository.driver.get_path(destination, package)
+        if journal.is_planned(path):
+            packages.append(package)
+
+    repository.load_packages(origin, consumer)
+    return origin_packages, packages
 
 
 def createmirror(context,
@@ -72,7 +156,8 @@ def createmirror(context,
                  origin,
                  debs=None,
                  bootstrap=None,
-                 keep_existing=True):
+                 keep_existing=True,
+                 download_order=None):
     """Creates mirror of repository(es).
 
     :param context: the context
@@ -83,15 +168,57 @@ def createmirror(context,
     :param debs: the url(s) of repositories to get dependency
     :param bootstrap: the additional packages required for bootstrap
     :param keep_existing: Remove local packages that does not exist in repo.
+    :param download_order: the name of policy to order downloads
     :return: the number of copied packages
     """
 
     repository = Repository(context, kind, arch)
-    packages = _get_set_of_packages(
-        repository, origin, debs, bootstrap
-    )
-    repository.copy_packages(packages, destination, keep_existing)
-    return len(packages)
+    journal = Journal(destination, [kind, arch, origin, debs, bootstrap])
+    scheduler = Scheduler(download_order)
+    if journal.load():
+        origin_packages, packages = _get_planned_packages(
+            repository, origin, destination, journal
+        )
+    elif _is_streaming(download_order):
+        packages = None
+    else:
+        origin_packages, master, unresolved = _load_indexes(
+            repository, origin, debs, bootstrap
+        )
+        packages = _resolve_packages(origin_packages, master, unresolved)
+
+    if packages is not None and bootstrap:
+        # the mirror should be installable as early as possible,
+        # so the depends of bootstrap packages are copied first too
+        scheduler.prioritize(
+            _get_bootstrap_closure(origin_packages, bootstrap)
+        )
+
+    # the upstream indexes can be reused, if all packages are copied
+    passthrough = not debs and not bootstrap
+    if packages is not None:
+        repository.copy_packages(
+            packages, destination, keep_existing, scheduler, journal,
+            passthrough
+        )
+        count = len(packages)
+    else:
+        if debs or bootstrap:
+            # the packages are copied while depends are being resolved
+            producer = _iter_resolved_packages(
+                repository, origin, debs, bootstrap
+            )
+        else:
+            # the packages are copied while indexes are being loaded
+            producer = repository.iter_packages(origin)
+        count = repository.copy_packages_streaming(
+            producer, destination, keep_existing, scheduler, journal,
+            passthrough
+        )
+    journal.close()
+    if context.store is not None and not keep_existing:
+        context.store.collect_garbage()
+    return count
 
 
 def get_packages(context,
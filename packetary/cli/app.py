@@ -60,6 +60,99 @@ class Application(app.App):
             metavar="NUMBER",
             help="The number of simultaneous connections."
         )
+        parser.add_argument(
+            "--connection-host-limit",
+            default=0,
+            type=int,
+            metavar="NUMBER",
+            help="The number of simultaneous connections per host, "
+                 "idle connections are lent to hosts that reached it."
+        )
+        parser.add_argument(
+            "--connection-timeout",
+            default=60,
+            type=int,
+            metavar="SECONDS",
+            help="The timeout to connect and to wait data from server."
+        )
+        parser.add_argument(
+            "--min-throughput",
+            default=0,
+            type=int,
+            metavar="KBPS",
+            help="The transfer, that is slower than limit during "
+                 "30 seconds, is resumed via new connection, 0 - disabled."
+        )
+        parser.add_argument(
+            "--bandwidth-limit",
+            default=0,
+            type=int,
+            metavar="KBPS",
+            help="The overall bandwidth limit in KB/s."
+        )
+        parser.add_argument(
+            "--host-bandwidth-limit",
+            default=0,
+            type=int,
+            metavar="KBPS",
+            help="The bandwidth limit per host in KB/s."
+        )
+        parser.add_argument(
+            "--segment-threshold",
+            default=0,
+            type=int,
+            metavar="MB",
+            help="The files larger than threshold are downloaded "
+                 "by several connections simultaneously, 0 - disabled."
+        )
+        parser.add_argument(
+            "--segment-count",
+            default=4,
+            type=int,
+            metavar="NUMBER",
+            help="The number of segments of large file."
+        )
+        parser.add_argument(
+            "--durability",
+            choices=["file", "batch"],
+            default="file",
+            help="file - flush each downloaded file to disk, "
+                 "batch - flush file system once before index is updated."
+        )
+        parser.add_argument(
+            "--compression-level",
+            default=6,
+            type=int,
+            choices=range(1, 10),
+            metavar="LEVEL",
+            help="The compression level of generated indexes, "
+                 "1 - fastest, 9 - best."
+        )
+        parser.add_argument(
+            "--pdiff-history",
+            default=0,
+            type=int,
+            metavar="NUMBER",
+            help="The number of patches, that are kept for each generated "
+                 "deb index to update apt clients by changes only, "
+                 "0 - disabled."
+        )
+        parser.add_argument(
+            "--dry-run-clean",
+            dest="clean_dry_run",
+            action="store_true",
+            default=False,
+            help="Report the files, that are not listed in indexes, "
+                 "and the space they take, but do not remove them."
+        )
+        parser.add_argument(
+            "--package-store",
+            default=None,
+            metavar="DIRECTORY",
+            help="The storage of package files, that are shared between "
+                 "mirrors via hard links. It should be on the same "
+                 "file system as mirrors."
+        )
         parser.add_argument(
             "--connection-proxy",
             default=None,
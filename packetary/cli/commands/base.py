@@ -52,7 +52,8 @@ class BaseRepoCommand(command.Command):
             dest='origins',
             type=six.text_type,
             metavar='URL',
-            help='Space separated list of urls for origin repositories.')
+            help='Space separated list of urls for origin repositories, '
+                 'the equivalent mirrors are separated by "|".')
 
         origin_gr.add_argument(
             '-O', '--origin-file',
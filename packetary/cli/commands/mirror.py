@@ -17,6 +17,7 @@
 from packetary.api import createmirror
 from packetary.cli.commands.base import BaseRepoCommand
 from packetary.cli.commands.utils import read_lines_from_file
+from packetary.library.scheduler import Scheduler
 
 
 class CreateMirror(BaseRepoCommand):
@@ -35,6 +36,15 @@ class CreateMirror(BaseRepoCommand):
             default=True,
             help="Remove packages that does not exist in origin repo."
         )
+        parser.add_argument(
+            "--download-order",
+            choices=sorted(Scheduler.policies),
+            default=Scheduler.DEFAULT_POLICY,
+            metavar="POLICY",
+            help="The order of downloads: {0}.".format(
+                ", ".join(sorted(Scheduler.policies))
+            )
+        )
 
         bootstrap_group = parser.add_mutually_exclusive_group(required=False)
         bootstrap_group.add_argument(
@@ -78,7 +88,8 @@ class CreateMirror(BaseRepoCommand):
             parsed_args.origins,
             parsed_args.requires,
             parsed_args.bootstrap,
-            parsed_args.keep_existing
+            parsed_args.keep_existing,
+            parsed_args.download_order
         )
         self.app.stdout.write("Packages copied: %d.\n" % packages_count)
 
@@ -18,6 +18,9 @@ import functools
 import hashlib
 
 
+CHUNK_SIZE = 256 * 1024
+
+
 class _HashComposite(object):
     """Combines several hash methods."""
 
@@ -43,19 +46,30 @@ def _new_composite(methods):
 def _checksum(method):
     """Makes function to calculate checksum for stream."""
     @functools.wraps(method)
-    def calculate(stream, chunksize=16 * 1024):
+    def calculate(stream, chunksize=CHUNK_SIZE):
         """Calculates checksum for binary stream.
 
         :param stream: file-like object opened in binary mode.
+        :param chunksize: the number of bytes to read at once
         :return: the checksum of content in terms of method.
         """
 
         s = method()
+        if not hasattr(stream, "readinto"):
+            while True:
+                chunk = stream.read(chunksize)
+                if not chunk:
+                    break
+                s.update(chunk)
+            return s.hexdigest()
+
+        # the buffer is reused to avoid allocation for each chunk
+        view = memoryview(bytearray(chunksize))
         while True:
-            chunk = stream.read(chunksize)
-            if not chunk:
+            size = stream.readinto(view)
+            if not size:
                 break
-            s.update(chunk)
+            s.update(view[:size])
         return s.hexdigest()
     return calculate
 
@@ -72,3 +86,26 @@ def composite(*methods):
     return _checksum(_new_composite(
         [getattr(hashlib, x) for x in methods]
     ))
+
+
+_ALIASES = {
+    "sha": "sha1",
+    "md5sum": "md5",
+}
+
+
+def get(algorithm):
+    """Gets the function to calculate checksum by name of algorithm.
+
+    :param algorithm: the name of algorithm, like md5, sha1, sha256
+    :return: the checksum function
+    :raises ValueError: if algorithm is not supported
+    """
+    name = algorithm.lower()
+    name = _ALIASES.get(name, name)
+    try:
+        return _checksum(getattr(hashlib, name))
+    except AttributeError:
+        raise ValueError(
+            "Unsupported checksum algorithm: {0}".format(algorithm)
+        )
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""The compressors, that use several CPU cores.
+
+The data is split to blocks, that are compressed independently
+in the pool of native threads, and the results are written to stream
+in the same order. zlib and lzma release GIL while compressing.
+"""
+
+from collections import deque
+import multiprocessing
+import six
+import struct
+import zlib
+
+import eventlet
+from eventlet import tpool
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+
+DEFAULT_LEVEL = 6
+
+
+def _cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def _crc32(data, value=0):
+    return zlib.crc32(data, value) & 0xffffffff
+
+
+class _ParallelWriter(object):
+    """The base class for block-parallel compressors."""
+
+    BLOCK_SIZE = 256 * 1024
+
+    def __init__(self, stream, level=DEFAULT_LEVEL, workers=None,
+                 block_size=None):
+        """Initializes.
+
+        :param stream: file-like object opened in binary mode
+        :param level: the compression level, 1 - fast, 9 - best
+        :param workers: the number of blocks compressed simultaneously
+        :param block_size: the number of bytes in block
+        """
+        self.stream = stream
+        self.level = level
+        self.workers = workers or _cpu_count()
+        if block_size is not None:
+            self.BLOCK_SIZE = block_size
+        self.buffer = []
+        self.buffered = 0
+        self.pending = deque()
+        self.closed = False
+        self.stream.write(self._header())
+
+    def write(self, data):
+        self._update(data)
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered < self.BLOCK_SIZE:
+            return
+        data = b"".join(self.buffer)
+        offset = 0
+        while len(data) - offset >= self.BLOCK_SIZE:
+            self._submit(data[offset:offset + self.BLOCK_SIZE])
+            offset += self.BLOCK_SIZE
+        data = data[offset:]
+        self.buffer = [data]
+        self.buffered = len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Compresses the rest of data and writes the trailer."""
+        if self.closed:
+            return
+        self.closed = True
+        if self.buffered:
+            self._submit(b"".join(self.buffer))
+        self.buffer = []
+        while self.pending:
+            self._write_next()
+        self.stream.write(self._trailer())
+
+    def _submit(self, block):
+        if len(self.pending) >= self.workers:
+            self._write_next()
+        self.pending.append(
+            eventlet.spawn(tpool.execute, self._compress, block)
+        )
+
+    def _write_next(self):
+        self.stream.write(self._on_block(self.pending.popleft().wait()))
+
+    def _update(self, data):
+        """Updates the state by uncompressed data."""
+
+    def _on_block(self, result):
+        """Gets the bytes to write from the result of _compress."""
+        return result
+
+    def _header(self):
+        raise NotImplementedError
+
+    def _trailer(self):
+        raise NotImplementedError
+
+    def _compress(self, block):
+        raise NotImplementedError
+
+
+class ParallelGzipWriter(_ParallelWriter):
+    """Writes the gzip stream like pigz.
+
+    The blocks are compressed to raw deflate data and are terminated
+    by the sync flush, so the concatenation of them is the one deflate
+    stream. The result is single gzip member, that any gzip reader
+    can decompress.
+    """
+
+    def __init__(self, stream, level=DEFAULT_LEVEL, workers=None,
+                 block_size=None):
+        self.crc = 0
+        self.size = 0
+        super(ParallelGzipWriter, self).__init__(
+            stream, level, workers, block_size
+        )
+
+    def _header(self):
+        # magic, deflate, no flags, mtime 0, no extra flags, unknown OS
+        return b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+    def _update(self, data):
+        self.crc = _crc32(data, self.crc)
+        self.size += len(data)
+
+    def _compress(self, block):
+        compressor = zlib.compressobj(
+            self.level, zlib.DEFLATED, -zlib.MAX_WBITS
+        )
+        return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def _trailer(self):
+        # the empty final block ends the deflate stream
+        compressor = zlib.compressobj(
+            self.level, zlib.DEFLATED, -zlib.MAX_WBITS
+        )
+        return compressor.flush(zlib.Z_FINISH) + struct.pack(
+            "<II", self.crc, self.size & 0xffffffff
+        )
+
+
+# the xz stream flags: the check is CRC32
+_XZ_STREAM_FLAGS = b"\x00\x01"
+
+_XZ_HEADER_MAGIC = b"\xfd7zXZ\x00"
+
+_XZ_FOOTER_MAGIC = b"YZ"
+
+# the id of LZMA2 filter
+_XZ_FILTER_LZMA2 = 0x21
+
+
+def _xz_varint(value):
+    """Encodes the number as xz multibyte integer."""
+    result = bytearray()
+    while value >= 0x80:
+        result.append((value & 0x7f) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def _xz_padding(size):
+    return b"\x00" * (-size % 4)
+
+
+def _lzma2_dict_size(size):
+    """Gets the dictionary size enough for block and its encoding.
+
+    :return: tuple(dictionary size, the property byte of LZMA2 filter)
+    """
+    for prop in six.moves.range(41):
+        dict_size = (2 | (prop & 1)) << (prop // 2 + 11)
+        if dict_size >= size:
+            return dict_size, prop
+    return 0xffffffff, 40
+
+
+class ParallelXzWriter(_ParallelWriter):
+    """Writes the xz stream, that consists of several blocks.
+
+    Each block is compressed independently, as xz -T does,
+    so the result is the one xz stream, that any xz reader
+    can decompress.
+    """
+
+    BLOCK_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, stream, level=DEFAULT_LEVEL, workers=None,
+                 block_size=None):
+        if lzma is None:
+            raise RuntimeError("The lzma module is not available.")
+        self.records = []
+        super(ParallelXzWriter, self).__init__(
+            stream, level, workers, block_size
+        )
+        self.dict_size, prop = _lzma2_dict_size(self.BLOCK_SIZE)
+        # the size of header, that is set below, and no flags
+        header = bytearray(b"\x00\x00")
+        header += _xz_varint(_XZ_FILTER_LZMA2)
+        header += _xz_varint(1)
+        header.append(prop)
+        header += _xz_padding(len(header))
+        header[0] = (len(header) + 4) // 4 - 1
+        self.block_header = \
+            bytes(header) + struct.pack("<I", _crc32(bytes(header)))
+
+    def _header(self):
+        return b"".join((
+            _XZ_HEADER_MAGIC, _XZ_STREAM_FLAGS,
+            struct.pack("<I", _crc32(_XZ_STREAM_FLAGS))
+        ))
+
+    def _compress(self, block):
+        data = lzma.compress(block, format=lzma.FORMAT_RAW, filters=[{
+            "id": lzma.FILTER_LZMA2,
+            "preset": self.level,
+            "dict_size": self.dict_size
+        }])
+        return data, len(block), _crc32(block)
+
+    def _on_block(self, result):
+        data, size, crc = result
+        self.records.append((len(self.block_header) + len(data) + 4, size))
+        return b"".join((
+            self.block_header, data, _xz_padding(len(data)),
+            struct.pack("<I", crc)
+        ))
+
+    def _trailer(self):
+        index = bytearray(b"\x00")
+        index += _xz_varint(len(self.records))
+        for unpadded_size, size in self.records:
+            index += _xz_varint(unpadded_size)
+            index += _xz_varint(size)
+        index += _xz_padding(len(index))
+        index = bytes(index)
+        index += struct.pack("<I", _crc32(index))
+        footer = struct.pack("<I", len(index) // 4 - 1) + _XZ_STREAM_FLAGS
+        return b"".join((
+            index, struct.pack("<I", _crc32(footer)), footer,
+            _XZ_FOOTER_MAGIC
+        ))
@@ -14,15 +14,21 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from collections import defaultdict
+import functools
 import logging
 import os
+import random
 import six
 import six.moves.http_client as http_client
 import six.moves.urllib.request as urllib_request
 import six.moves.urllib_error as urllib_error
+import six.moves.urllib.parse as urlparse
+import threading
 import time
 
 from packetary.library.streams import StreamWrapper
+from packetary.library import utils
 
 
 logger = logging.getLogger(__package__)
@@ -30,15 +36,164 @@ logger = logging.getLogger(__package__)
 
 RETRYABLE_ERRORS = (http_client.HTTPException, IOError)
 
+# the suffix of file, that is being downloaded
+PART_SUFFIX = ".part"
+
+# the initial and the max delay between retries in seconds
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+
+# the period in seconds to measure the throughput of transfer
+STALL_WINDOW = 30
+
 
 class RangeError(urllib_error.URLError):
     pass
 
 
+class StalledError(IOError):
+    """The transfer is slower than the allowed minimum."""
+
+
+class CircuitOpenError(IOError):
+    """The host is not used for a while after series of failures."""
+
+
 class RetryableRequest(urllib_request.Request):
     offset = 0
+    end = None
     retries_left = 1
+    attempt = 0
     start_time = 0
+    timeout = None
+    throttle = None
+    min_speed = 0
+    breaker = None
+
+
+def backoff(attempt):
+    """Waits before retry.
+
+    The delay grows exponentially with number of attempt,
+    the random jitter spreads retries of concurrent transfers.
+
+    :param attempt: the number of failed attempts before, starts from 0
+    """
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+    time.sleep(random.uniform(0, delay))
+
+
+def get_local_path(url):
+    """Gets the path on local fs, None if url is remote."""
+    if url.startswith("/"):
+        return url
+    if url.startswith("file://"):
+        return urllib_request.url2pathname(urlparse.urlparse(url).path)
+    return None
+
+
+def get_host(url):
+    """Gets the host part of url, None for local files."""
+    if url is None or url.startswith("/"):
+        return None
+    return urlparse.urlparse(url).netloc or None
+
+
+class TokenBucket(object):
+    """Limits the rate of data transfer."""
+
+    def __init__(self, rate):
+        """Initialises.
+
+        :param rate: the number of bytes per second
+        """
+        self.rate = rate
+        self.tokens = rate
+        self.timestamp = time.time()
+
+    def consume(self, size):
+        """Takes size tokens from bucket, waits if there is not enough."""
+        now = time.time()
+        self.tokens = min(
+            self.rate, self.tokens + (now - self.timestamp) * self.rate
+        )
+        self.timestamp = now
+        self.tokens -= size
+        if self.tokens < 0:
+            time.sleep(-self.tokens / float(self.rate))
+
+
+class BandwidthLimit(object):
+    """Global and per-host bandwidth limits."""
+
+    def __init__(self, rate=0, host_rate=0):
+        """Initialises.
+
+        :param rate: the global limit in bytes per second, 0 - unlimited
+        :param host_rate: the limit for each host, 0 - unlimited
+        """
+        self.bucket = TokenBucket(rate) if rate > 0 else None
+        self.host_rate = host_rate
+        self.hosts = dict()
+
+    def consume(self, host, size):
+        """Accounts the transferred data."""
+        if self.host_rate > 0:
+            bucket = self.hosts.get(host)
+            if bucket is None:
+                bucket = self.hosts[host] = TokenBucket(self.host_rate)
+            bucket.consume(size)
+        if self.bucket is not None:
+            self.bucket.consume(size)
+
+
+class CircuitBreaker(object):
+    """Stops requests to host, that fails constantly.
+
+    After threshold of consecutive failures the host is disabled
+    for reset_timeout seconds, after that one probe request is allowed.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=60):
+        """Initialises.
+
+        :param threshold: the number of failures, 0 - never disable host
+        :param reset_timeout: the number of seconds to disable host
+        """
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = defaultdict(int)
+        self.opened = dict()
+
+    def check(self, host):
+        """Raises CircuitOpenError if requests to host are not allowed."""
+        opened = self.opened.get(host)
+        if opened is None:
+            return
+        if time.time() - opened < self.reset_timeout:
+            raise CircuitOpenError(
+                "Host {0} is disabled after {1} failures.".format(
+                    host, self.failures[host]
+                )
+            )
+        # allow one probe, the next failure disables host again
+        del self.opened[host]
+        self.failures[host] = self.threshold - 1
+
+    def on_success(self, host):
+        self.failures.pop(host, None)
+
+    def on_failure(self, host):
+        if host is None or self.threshold <= 0:
+            return
+        self.failures[host] += 1
+        if self.failures[host] >= self.threshold:
+            if host not in self.opened:
+                logger.warning(
+                    "host %s is disabled for %d seconds after %d failures.",
+                    host, self.reset_timeout, self.failures[host]
+                )
+            self.opened[host] = time.time()
 
 
 class ResumableResponse(StreamWrapper):
@@ -57,20 +212,81 @@ class ResumableResponse(StreamWrapper):
         super(ResumableResponse, self).__init__(response)
         self.request = request
         self.opener = opener
+        self.window_start = time.time()
+        self.window_size = 0
 
     def read_chunk(self, chunksize):
         """Overrides super class method."""
         while 1:
             try:
+                if self.stream is None:
+                    self._reopen()
+                self._check_throughput()
                 chunk = self.stream.read(chunksize)
-                self.request.offset += len(chunk)
-                return chunk
+            except (RangeError, CircuitOpenError, urllib_error.HTTPError):
+                raise
             except RETRYABLE_ERRORS as e:
-                response = self.opener.error(
-                    self.request.get_type(), self.request,
-                    self.stream, 502, six.text_type(e), self.stream.info()
-                )
-                self.stream = response.stream
+                self._on_error(e)
+                continue
+
+            self.request.offset += len(chunk)
+            self.window_size += len(chunk)
+            if self.request.throttle is not None:
+                started = time.time()
+                self.request.throttle(len(chunk))
+                # the waiting for bandwidth is not a stall of transfer
+                self.window_start += time.time() - started
+            return chunk
+
+    def _check_throughput(self):
+        """Raises StalledError if transfer is too slow."""
+        if self.request.min_speed <= 0:
+            return
+        now = time.time()
+        elapsed = now - self.window_start
+        if elapsed < STALL_WINDOW:
+            return
+        speed = self.window_size / elapsed
+        self.window_start = now
+        self.window_size = 0
+        if speed < self.request.min_speed:
+            raise StalledError(
+                "The transfer is stalled: {0} bytes/s.".format(int(speed))
+            )
+
+    def _on_error(self, error):
+        """Drops the broken stream, if retry is allowed."""
+        request = self.request
+        if request.breaker is not None:
+            request.breaker.on_failure(get_host(request.get_full_url()))
+        if request.retries_left <= 0:
+            raise error
+        request.retries_left -= 1
+        logger.warning(
+            "Failed to read %s: %s. resume from %d, retries left - %d.",
+            request.get_full_url(), six.text_type(error),
+            request.offset, request.retries_left
+        )
+        try:
+            self.stream.close()
+        except Exception:
+            pass
+        self.stream = None
+        backoff(request.attempt)
+        request.attempt += 1
+
+    def _reopen(self):
+        """Resumes the transfer via new connection."""
+        request = self.request
+        host = get_host(request.get_full_url())
+        if request.breaker is not None:
+            request.breaker.check(host)
+        response = self.opener.open(request, timeout=request.timeout)
+        if request.breaker is not None:
+            request.breaker.on_success(host)
+        self.stream = response.stream
+        self.window_start = time.time()
+        self.window_size = 0
 
 
 class RetryHandler(urllib_request.BaseHandler):
@@ -80,7 +296,11 @@ class RetryHandler(urllib_request.BaseHandler):
     def http_request(request):
         """Initialises http request."""
         logger.debug("start request: %s", request.get_full_url())
-        if request.offset > 0:
+        if request.end is not None:
+            request.add_header(
+                'Range', 'bytes=%d-%d' % (request.offset, request.end)
+            )
+        elif request.offset > 0:
             request.add_header('Range', 'bytes=%d-' % request.offset)
         request.start_time = time.time()
         return request
@@ -96,7 +316,8 @@ class RetryHandler(urllib_request.BaseHandler):
             request.get_full_url(), response.getcode(), response.msg,
             int((time.time() - request.start_time) * 1000)
         )
-        if request.offset > 0 and response.getcode() != 206:
+        is_partial = request.offset > 0 or request.end is not None
+        if is_partial and response.getcode() != 206:
             raise RangeError("Server does not support ranges.")
         return ResumableResponse(request, response, self.parent)
 
@@ -117,20 +338,37 @@ class RetryHandler(urllib_request.BaseHandler):
 class Connection(object):
     """Helper class to deal with streams."""
 
-    def __init__(self, opener, retries_num):
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, opener, retries_num, bandwidth=None, sync_files=True,
+                 timeout=None, min_speed=0, breaker=None):
         """Initializes.
 
         :param opener: the instance of urllib.OpenerDirector
         :param retries_num: the number of allowed retries
+        :param bandwidth: the instance of BandwidthLimit
+        :param sync_files: if True, each downloaded file is flushed
+            to disk, otherwise the caller should sync file system.
+        :param timeout: the timeout in seconds to connect and to read
+            data from socket, None - infinity waiting
+        :param min_speed: the min throughput in bytes per second,
+            the slower transfer is resumed via new connection
+        :param breaker: the instance of CircuitBreaker
         """
         self.opener = opener
         self.retries_num = retries_num
+        self.bandwidth = bandwidth
+        self.sync_files = sync_files
+        self.timeout = timeout
+        self.min_speed = min_speed
+        self.breaker = breaker
 
-    def make_request(self, url, offset=0):
+    def make_request(self, url, offset=0, end=None):
         """Makes new http request.
 
         :param url: the remote file`s url
         :param offset: the number of bytes from begin, that will be skipped
+        :param end: the position of last byte to read, None - till end
         :return: The new http request
         """
 
@@ -140,22 +378,36 @@ class Connection(object):
         request = RetryableRequest(url)
         request.retries_left = self.retries_num
         request.offset = offset
+        request.end = end
+        request.timeout = self.timeout
+        request.min_speed = self.min_speed
+        request.breaker = self.breaker
+        if self.bandwidth is not None:
+            request.throttle = functools.partial(
+                self.bandwidth.consume, get_host(url)
+            )
         return request
 
-    def open_stream(self, url, offset=0):
+    def open_stream(self, url, offset=0, end=None):
         """Opens remote file for streaming.
 
         :param url: the remote file`s url
         :param offset: the number of bytes from begin, that will be skipped
+        :param end: the position of last byte to read, None - till end
         """
 
-        request = self.make_request(url, offset)
+        request = self.make_request(url, offset, end)
+        host = get_host(url)
         while 1:
+            if self.breaker is not None:
+                self.breaker.check(host)
             try:
-                return self.opener.open(request)
+                response = self.opener.open(request, timeout=self.timeout)
             except (RangeError, urllib_error.HTTPError):
                 raise
             except RETRYABLE_ERRORS as e:
+                if self.breaker is not None:
+                    self.breaker.on_failure(host)
                 if request.retries_left <= 0:
                     raise
                 request.retries_left -= 1
@@ -163,29 +415,83 @@ class Connection(object):
                     "Failed to open url - %s: %s. retries left - %d.",
                     url, six.text_type(e), request.retries_left
                 )
-
-    def retrieve(self, url, filename, offset=0):
+                backoff(request.attempt)
+                request.attempt += 1
+            else:
+                if self.breaker is not None:
+                    self.breaker.on_success(host)
+                return response
+
+    def retrieve(self, url, filename, offset=0, size=None):
         """Downloads remote file.
 
+        The data is written to the temporary file with PART_SUFFIX,
+        that is renamed to filename when download is completed.
+
         :param url: the remote file`s url
         :param filename: the file`s name, that includes path on local fs
         :param offset: the number of bytes from begin, that will be skipped
+        :param size: the expected size of file, if it is known
         """
 
-        self._ensure_dir_exists(filename)
-        fd = os.open(filename, os.O_CREAT | os.O_WRONLY)
+        tmp = filename + PART_SUFFIX
+        local_path = get_local_path(url)
+        if local_path is not None and offset == 0:
+            if self._link_local(local_path, tmp):
+                os.rename(tmp, filename)
+                return
+
+        fd = self.open_file(tmp)
         try:
-            self._copy_stream(fd, url, offset)
-        except RangeError:
-            if offset == 0:
-                raise
-            logger.warning(
-                "Failed to resume download, starts from begin: %s", url
-            )
-            self._copy_stream(fd, url, 0)
+            if local_path is not None:
+                self._copy_local(local_path, fd, offset)
+            else:
+                self._copy_remote(fd, url, offset, size)
         finally:
-            os.fsync(fd)
+            if self.sync_files:
+                os.fsync(fd)
             os.close(fd)
+        os.rename(tmp, filename)
+
+    def retrieve_range(self, url, fd, start, end, stream=None):
+        """Downloads the range of remote file.
+
+        The data is written to the same position of local file,
+        so several ranges can be downloaded simultaneously.
+
+        :param url: the remote file`s url
+        :param fd: the file`s descriptor
+        :param start: the position of first byte
+        :param end: the position of last byte
+        :param stream: the stream opened for this range, if any
+        """
+        if stream is None:
+            stream = self.open_stream(url, start, end)
+        size = end - start + 1
+        while size > 0:
+            chunk = stream.read(min(self.CHUNK_SIZE, size))
+            if not chunk:
+                raise IOError(
+                    "Unexpected end of stream: {0}, {1} bytes left."
+                    .format(url, size)
+                )
+            _pwrite(fd, chunk, start)
+            start += len(chunk)
+            size -= len(chunk)
+
+    @classmethod
+    def open_file(cls, filename, size=None):
+        """Opens local file for writing.
+
+        :param filename: the file`s name, that includes path on local fs
+        :param size: the size of file, if it should be preallocated
+        :return: the file`s descriptor
+        """
+        cls._ensure_dir_exists(filename)
+        fd = os.open(filename, os.O_CREAT | os.O_WRONLY)
+        if size is not None:
+            os.ftruncate(fd, size)
+        return fd
 
     @staticmethod
     def _ensure_dir_exists(dst):
@@ -197,23 +503,86 @@ class Connection(object):
             if e.errno != 17:
                 raise
 
-    def _copy_stream(self, fd, url, offset):
+    def _copy_remote(self, fd, url, offset, size):
+        try:
+            self._copy_stream(fd, url, offset, size)
+        except RangeError:
+            if offset == 0:
+                raise
+            logger.warning(
+                "Failed to resume download, starts from begin: %s", url
+            )
+            self._copy_stream(fd, url, 0, size)
+
+    def _link_local(self, src, dst):
+        """Makes the hard link to local file.
+
+        :return: True if link is created, otherwise False
+        """
+        self._ensure_dir_exists(dst)
+        try:
+            if os.path.lexists(dst):
+                os.remove(dst)
+            os.link(src, dst)
+        except OSError as e:
+            logger.debug("Failed to link %s: %s", src, six.text_type(e))
+            return False
+        logger.debug("file %s is linked to %s.", src, dst)
+        return True
+
+    @staticmethod
+    def _copy_local(src, fd, offset):
+        """Copies local file within kernel.
+
+        :param src: the path of source file
+        :param fd: the destination file`s descriptor
+        :param offset: the number of bytes from begin, that will be skipped
+        """
+        src_fd = os.open(src, os.O_RDONLY)
+        try:
+            size = os.fstat(src_fd).st_size
+            os.ftruncate(fd, offset)
+            if offset == 0 and utils.reflink(src_fd, fd):
+                return
+            utils.preallocate(fd, offset, size - offset)
+            utils.copy_range(src_fd, fd, offset, size - offset)
+        finally:
+            os.close(src_fd)
+
+    def _copy_stream(self, fd, url, offset, size=None):
         """Copies remote file to local.
 
         :param fd: the file`s descriptor
         :param url: the remote file`s url
         :param offset: the number of bytes from begin, that will be skipped
+        :param size: the expected size of file, if it is known
         """
 
         source = self.open_stream(url, offset)
         os.ftruncate(fd, offset)
+        if size is not None:
+            utils.preallocate(fd, offset, size - offset)
         os.lseek(fd, offset, os.SEEK_SET)
-        chunk_size = 16 * 1024
+        # the buffer is reused to avoid allocation for each chunk
+        view = memoryview(bytearray(self.CHUNK_SIZE))
         while 1:
-            chunk = source.read(chunk_size)
-            if not chunk:
+            size = source.readinto(view)
+            if not size:
                 break
-            os.write(fd, chunk)
+            utils.write_all(fd, view[:size])
+
+
+def _pwrite(fd, data, offset):
+    """Writes data to file at specified position."""
+    if hasattr(os, "pwrite"):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+    else:
+        # there is no switch between greenthreads within lseek and write
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, data)
 
 
 class ConnectionContext(object):
@@ -234,13 +603,25 @@ class ConnectionsPool(object):
 
     MIN_CONNECTIONS_COUNT = 1
 
-    def __init__(self, count=0, proxy=None, secure_proxy=None, retries_num=0):
+    # the number of idle connections, that are not lent to host,
+    # which has reached the limit, so other hosts are not starved
+    LEND_RESERVE = 1
+
+    def __init__(self, count=0, proxy=None, secure_proxy=None, retries_num=0,
+                 host_limit=0, bandwidth=0, host_bandwidth=0,
+                 sync_files=True, timeout=None, min_speed=0):
         """Initialises.
 
         :param count: the number of allowed simultaneously connections
         :param proxy: the url of proxy for http-connections
         :param secure_proxy: the url of proxy for https-connections
         :param retries_num: the number of allowed retries
+        :param host_limit: the number of connections per host, 0 - unlimited
+        :param bandwidth: the bandwidth limit in bytes per second
+        :param host_bandwidth: the bandwidth limit per host
+        :param sync_files: flush each downloaded file to disk
+        :param timeout: the timeout of socket operations in seconds
+        :param min_speed: the min throughput of transfer in bytes per second
         """
         if proxy:
             proxies = {
@@ -255,26 +636,87 @@ class ConnectionsPool(object):
             urllib_request.ProxyHandler(proxies)
         )
 
+        if bandwidth > 0 or host_bandwidth > 0:
+            bandwidth = BandwidthLimit(bandwidth, host_bandwidth)
+        else:
+            bandwidth = None
+
+        breaker = CircuitBreaker()
         limit = max(count, self.MIN_CONNECTIONS_COUNT)
         connections = six.moves.queue.Queue()
         while limit > 0:
-            connections.put(Connection(opener, retries_num))
+            connections.put(Connection(
+                opener, retries_num, bandwidth, sync_files,
+                timeout, min_speed, breaker
+            ))
             limit -= 1
 
         self.free = connections
+        self.host_limit = host_limit
+        self.active = defaultdict(int)
+        self.pending = 0
+        self.condition = threading.Condition()
 
-    def get(self, timeout=None):
+    def get(self, timeout=None, url=None):
         """Gets the free connection.
 
         Blocks in case if there is no free connections.
 
         :param timeout: the timeout in seconds to wait.
             by default infinity waiting.
+        :param url: the url, that will be opened via connection,
+            it is used to apply the limit of connections per host.
         """
+        host = get_host(url)
+        self._acquire_host(host, timeout)
+        try:
+            connection = self.free.get(timeout=timeout)
+        except Exception:
+            self._release_host(host)
+            raise
+        finally:
+            with self.condition:
+                self.pending -= 1
+
         return ConnectionContext(
-            self.free.get(timeout=timeout), self._release
+            connection, functools.partial(self._release, host)
         )
 
-    def _release(self, connection):
+    def _is_allowed(self, host):
+        """Checks that one more connection to host is allowed."""
+        if host is None or self.host_limit <= 0:
+            return True
+        if self.active[host] < self.host_limit:
+            return True
+        # the idle connections are lent to host, that has reached
+        # the limit, but the host cannot borrow more than own limit
+        # and some connections are kept for other hosts
+        if self.active[host] >= 2 * self.host_limit:
+            return False
+        return self.free.qsize() - self.pending > self.LEND_RESERVE
+
+    def _acquire_host(self, host, timeout):
+        """Waits until connection to host will be allowed."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while not self._is_allowed(host):
+                if deadline is None:
+                    self.condition.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise six.moves.queue.Empty()
+                self.condition.wait(remaining)
+            self.active[host] += 1
+            self.pending += 1
+
+    def _release_host(self, host):
+        """Decreases the number of active connections to host."""
+        with self.condition:
+            self.active[host] -= 1
+            self.condition.notify_all()
+
+    def _release(self, host, connection):
         """Puts back connection to free connections."""
         self.free.put(connection)
+        self._release_host(host)
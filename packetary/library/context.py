@@ -16,19 +16,44 @@
 
 from packetary.library.connections import ConnectionsPool
 from packetary.library.executor import AsynchronousSection
+from packetary.library.mirrors import MirrorsRegistry
+from packetary.library.store import PackageStore
 
 
 class Context(object):
 
     DEFAULT_THREADS_COUNT = 1
     DEFAULT_BACKLOG_SIZE = 100
+    DEFAULT_SEGMENTS_COUNT = 4
+    DEFAULT_COMPRESSION_LEVEL = 6
 
     def __init__(self, **kwargs):
         self.connections = ConnectionsPool(
             count=kwargs.get("connection_count", 0),
             retries_num=kwargs.get("retry_count", 0),
             proxy=kwargs.get("connection_proxy"),
-            secure_proxy=kwargs.get("connection_secure_proxy")
+            secure_proxy=kwargs.get("connection_secure_proxy"),
+            host_limit=kwargs.get("connection_host_limit", 0),
+            bandwidth=kwargs.get("bandwidth_limit", 0) * 1024,
+            host_bandwidth=kwargs.get("host_bandwidth_limit", 0) * 1024,
+            sync_files=kwargs.get("durability", "file") == "file",
+            timeout=kwargs.get("connection_timeout"),
+            min_speed=kwargs.get("min_throughput", 0) * 1024
+        )
+        self.durability = kwargs.get("durability", "file")
+        self.compression_level = kwargs.get(
+            "compression_level", self.DEFAULT_COMPRESSION_LEVEL
+        )
+        self.pdiff_history = kwargs.get("pdiff_history", 0)
+        self.clean_dry_run = kwargs.get("clean_dry_run", False)
+        self.mirrors = MirrorsRegistry()
+        if kwargs.get("package_store"):
+            self.store = PackageStore(kwargs["package_store"])
+        else:
+            self.store = None
+        self.segment_threshold = kwargs.get("segment_threshold", 0) << 20
+        self.segment_count = kwargs.get(
+            "segment_count", self.DEFAULT_SEGMENTS_COUNT
         )
         self.ignore_errors_num = kwargs.get('ignore_error_count', 0)
         self.thread_count = kwargs.get(
@@ -16,7 +16,22 @@
 
 
 import abc
+import errno
+import logging
+import os
 import six
+import six.moves.urllib_error as urllib_error
+import time
+
+from packetary.library.connections import PART_SUFFIX
+from packetary.library.connections import RETRYABLE_ERRORS
+
+
+logger = logging.getLogger(__package__)
+
+
+# the suffix of upstream index file, that is not published yet
+STAGED_SUFFIX = ".upstream"
 
 
 @six.add_metaclass(abc.ABCMeta)
@@ -37,8 +52,13 @@ class RepoDriver(object):
     """The driver to access the repository."""
 
     @abc.abstractmethod
-    def create_index(self, destination):
-        """Creates the index writer."""
+    def create_index(self, destination, passthrough=False):
+        """Creates the index writer.
+
+        :param destination: the destination folder
+        :param passthrough: if True, the upstream indexes are published
+            as is, if it is possible, instead of generating new ones.
+        """
 
     @abc.abstractmethod
     def load(self, baseurl, reponame, consumer):
@@ -54,3 +74,70 @@ class RepoDriver(object):
 
         :return: The sequence of url.
         """
+
+    def with_mirrors(self, baseurl, func, *args):
+        """Calls function with the best of equivalent mirrors.
+
+        If the call fails, it is repeated with the next mirror.
+
+        :param baseurl: the url, that identifies group of mirrors
+        :param func: the function, that takes the url of mirror
+                     as the first argument
+        :return: the result of function
+        """
+        candidates = self.mirrors.candidates(baseurl)
+        for idx, mirror in enumerate(candidates, start=1):
+            start_time = time.time()
+            try:
+                result = func(mirror, *args)
+            except RETRYABLE_ERRORS as e:
+                self.mirrors.on_failure(mirror)
+                if idx == len(candidates):
+                    raise
+                logger.warning(
+                    "failed to fetch from %s: %s, try next mirror.",
+                    mirror, six.text_type(e)
+                )
+            else:
+                self.mirrors.on_success(
+                    mirror, None, time.time() - start_time
+                )
+                return result
+
+    def fetch_from_mirrors(self, baseurl, name, path, optional=False):
+        """Downloads the file from the best of equivalent mirrors.
+
+        :param baseurl: the url, that identifies group of mirrors
+        :param name: the path of file relative to baseurl
+        :param path: the local path
+        :param optional: if True, missing file is not an error
+        :return: True if file is downloaded, False if it does not exist
+        """
+        return self.with_mirrors(
+            baseurl,
+            lambda url: self.fetch("/".join((url, name)), path, optional)
+        )
+
+    def fetch(self, url, path, optional=False):
+        """Downloads the file as is.
+
+        :param url: the url of file
+        :param path: the local path
+        :param optional: if True, missing file is not an error
+        :return: True if file is downloaded, False if it does not exist
+        """
+        with self.connections.get(url=url) as connection:
+            try:
+                connection.retrieve(url, path)
+            except urllib_error.HTTPError as e:
+                if not optional or e.code != 404:
+                    raise
+            except EnvironmentError as e:
+                if not optional or e.errno != errno.ENOENT:
+                    raise
+            else:
+                return True
+        logger.info("the optional file %s does not exist.", url)
+        if os.path.exists(path + PART_SUFFIX):
+            os.remove(path + PART_SUFFIX)
+        return False
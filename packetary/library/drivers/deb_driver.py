@@ -17,17 +17,33 @@ from collections import defaultdict
 from contextlib import closing
 from datetime import datetime
 from debian import deb822
+from debian import debian_support
+import errno
 import fcntl
-import gzip
+import json
 import logging
 import os
+import shutil
 import six
+import time
 
+from packetary.library import checksum as checksum_
+from packetary.library import compression
+from packetary.library import inventory
 from packetary.library.checksum import composite as checksum_composite
+from packetary.library.connections import RETRYABLE_ERRORS
 from packetary.library.driver import IndexWriter
 from packetary.library.driver import RepoDriver
+from packetary.library.driver import STAGED_SUFFIX
 from packetary.library.drivers.deb_package import DebPackage
+from packetary.library.drivers.deb_pdiff import INDEX as PDIFF_INDEX
+from packetary.library.drivers.deb_pdiff import PDiffs
+from packetary.library.executor import AsynchronousSection
+from packetary.library.manifest import Manifest
+from packetary.library.manifest import ManifestEntry
+from packetary.library.package import Package
 from packetary.library.streams import GzipDecompress
+from packetary.library.streams import HashingWriter
 
 
 logger = logging.getLogger(__package__)
@@ -42,6 +58,8 @@ _INDEX_FILES_ORDER = {
     "Packages": 1,
     "Release": 2,
     "Packages.gz": 3,
+    "Packages.xz": 4,
+    PDIFF_INDEX: 5,
 }
 
 _DEFAULT_ORIGIN = "Unknown"
@@ -50,7 +68,183 @@ _SIZE_ALIGNMENT = 16
 
 _CHECKSUM_METHOD_NAMES = ['MD5Sum', 'SHA1', 'SHA256']
 
-_checksum_collector = checksum_composite('md5', 'sha1', 'sha256')
+_CHECKSUM_ALGORITHMS = ['md5', 'sha1', 'sha256']
+
+_SHA256_INDEX = _CHECKSUM_ALGORITHMS.index('sha256')
+
+# the size of serialized paragraphs, that are written to files at once
+_INDEX_BUFFER_SIZE = 256 * 1024
+
+# the checksums of files in Release from the most to the least reliable
+_RELEASE_CHECKSUMS = [
+    ("SHA256", "sha256"), ("SHA1", "sha1"), ("MD5Sum", "md5")
+]
+
+# the signed variants of Release, that are published if upstream has them
+_RELEASE_SIGNATURES = ["InRelease", "Release.gpg"]
+
+_checksum_collector = checksum_composite(*_CHECKSUM_ALGORITHMS)
+
+# the digests of index files, that are listed in Release of suite
+_DIGESTS_CACHE = ".packetary-digests"
+
+# the lock of suite, that is held while Release is being generated
+_SUITE_LOCK = ".packetary-lock"
+
+# the folder of index files, that are addressed by checksum
+_BY_HASH_DIR = os.path.join("by-hash", "SHA256")
+
+# the time in seconds to keep the replaced index files in by-hash folder,
+# the clients, that have got previous Release, still can download them
+_BY_HASH_GRACE_PERIOD = 24 * 60 * 60
+
+_TMP_SUFFIX = ".tmp"
+
+# the folder of patches, that transform previous Packages to current one
+_PDIFF_DIR = "Packages.diff"
+
+# the files of component, that are generated instead of upstream ones
+_GENERATED_FILES = (
+    "Packages", "Packages.gz", "Packages.xz", "Release", Manifest.FILENAME
+)
+
+# the files in pool, that are removed by garbage collector
+_PACKAGE_SUFFIXES = (".deb", ".udeb")
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno == errno.EEXIST:
+            return
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copyfile(src, dst + _TMP_SUFFIX)
+        os.rename(dst + _TMP_SUFFIX, dst)
+
+
+def _get_sha256(filepath):
+    """Gets the SHA256 of file, None if file does not exist."""
+    try:
+        stream = open(filepath, "rb")
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+    with closing(stream):
+        return checksum_.get("sha256")(stream)
+
+
+def _replace_file(tmp, filepath, digest=None):
+    """Replaces the index file atomically.
+
+    If digest is specified, the new file is published by checksum
+    as well. The previous file is kept in by-hash folder and
+    its modification time is set to the time, when it was replaced,
+    to count the grace period.
+
+    :param tmp: the path of new file
+    :param filepath: the path of index file
+    :param digest: the SHA256 of new file
+    """
+    if digest is None:
+        os.rename(tmp, filepath)
+        return
+
+    by_hash = os.path.join(os.path.dirname(filepath), _BY_HASH_DIR)
+    if not os.path.exists(by_hash):
+        os.makedirs(by_hash)
+    target = os.path.join(by_hash, digest)
+    if os.path.exists(target):
+        os.utime(target, None)
+    else:
+        _link_or_copy(tmp, target)
+    # the replaced file is found by checksum, because it may be
+    # a copy of by-hash entry or may not have such entry at all
+    replaced = _get_sha256(filepath)
+    if replaced is not None and replaced != digest:
+        entry = os.path.join(by_hash, replaced)
+        if not os.path.exists(entry):
+            _link_or_copy(filepath, entry)
+    os.rename(tmp, filepath)
+    if replaced is not None and replaced != digest:
+        os.utime(entry, None)
+
+
+def _expire_by_hash(path, digests, grace_period=_BY_HASH_GRACE_PERIOD):
+    """Removes the replaced index files after grace period.
+
+    :param path: the folder of index files
+    :param digests: the SHA256 of current index files
+    :param grace_period: the time in seconds to keep replaced files
+    """
+    by_hash = os.path.join(path, _BY_HASH_DIR)
+    if not os.path.exists(by_hash):
+        return
+    expired = time.time() - grace_period
+    for name in os.listdir(by_hash):
+        entry = os.path.join(by_hash, name)
+        if name not in digests and os.stat(entry).st_mtime < expired:
+            os.remove(entry)
+            logger.info("the expired index %s was removed.", entry)
+
+
+def _get_signature(stats):
+    """Gets the signature of file, that changes when file is modified."""
+    return [
+        stats.st_size, getattr(stats, "st_mtime_ns", stats.st_mtime),
+        stats.st_ino
+    ]
+
+
+def _read_filenames(path, files):
+    """Reads the filenames of packages from index without parsing it.
+
+    :param path: the folder of index
+    :param files: the names of files in folder
+    :return: the list of filenames
+    """
+    if "Packages" in files:
+        stream = open(os.path.join(path, "Packages"), "rb")
+    elif "Packages.gz" in files:
+        stream = GzipDecompress(open(os.path.join(path, "Packages.gz"), "rb"))
+    elif "Packages.xz" in files and compression.lzma is not None:
+        stream = compression.lzma.LZMAFile(
+            os.path.join(path, "Packages.xz"), "rb"
+        )
+    else:
+        raise ValueError("There is no readable index in {0}.".format(path))
+    with closing(stream):
+        return [
+            line[9:].strip().decode("utf-8")
+            for line in stream if line.startswith(b"Filename:")
+        ]
+
+
+def _get_listed_indexes(release):
+    """Gets the indexes of packages, that are listed in Release.
+
+    :param release: the path of Release of suite
+    :return: the dict(relative folder -> set of names of index files)
+    """
+    checksum_fields = set(x[0] for x in _RELEASE_CHECKSUMS)
+    listed = defaultdict(set)
+    field = None
+    # the file is parsed line by line, because the records of files
+    # are not indented in Release, that is written by this driver
+    with closing(open(release, "r")) as stream:
+        for line in stream:
+            if line[:1].strip() and ":" in line:
+                field = line.partition(":")[0]
+                continue
+            record = line.split()
+            if field not in checksum_fields or len(record) != 3:
+                continue
+            path, name = os.path.split(record[2])
+            if name in ("Packages", "Packages.gz", "Packages.xz"):
+                listed[path].add(name)
+    return listed
 
 
 def _format_size(size):
@@ -58,25 +252,466 @@ def _format_size(size):
     return (" " * (_SIZE_ALIGNMENT - len(size))) + size
 
 
+def _strip_dists(baseurl):
+    if baseurl.endswith("/dists/"):
+        return baseurl[:-7]
+    elif baseurl.endswith("/dists"):
+        return baseurl[:-6]
+    elif baseurl.endswith("/"):
+        return baseurl[:-1]
+    return baseurl
+
+
+class _PublishedPackage(Package):
+    """The package from the existing index, that is described by manifest.
+
+    The record of package is read from the existing index as is,
+    so it is not parsed.
+    """
+
+    def __init__(self, entry, index):
+        """Initialises.
+
+        :param entry: the ManifestEntry
+        :param index: the existing index opened in binary mode
+        """
+        self.entry = entry
+        self.index = index
+        self._version = debian_support.Version(entry.version)
+
+    @property
+    def dpkg(self):
+        return self
+
+    def dump(self, fd):
+        self.index.seek(self.entry.offset)
+        fd.write(self.index.read(self.entry.length))
+
+    @property
+    def name(self):
+        return self.entry.name
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def size(self):
+        return self.entry.size
+
+    @property
+    def filename(self):
+        return self.entry.filename
+
+    @property
+    def baseurl(self):
+        return None
+
+    @property
+    def checksum(self):
+        return self.entry.checksum
+
+    @property
+    def requires(self):
+        return []
+
+    @property
+    def provides(self):
+        return []
+
+    @property
+    def obsoletes(self):
+        return []
+
+
+class _IndexFiles(object):
+    """Writes the index to the plain and compressed files at once.
+
+    The size and checksums of each file are calculated while writing,
+    so files are not read again to generate Release.
+    """
+
+    def __init__(self, path, level):
+        self.path = path
+        self.files = []
+        try:
+            self._open(os.path.join(path, "Packages"), None)
+            self._open(
+                os.path.join(path, "Packages.gz"),
+                lambda f: compression.ParallelGzipWriter(f, level)
+            )
+            if compression.lzma is not None:
+                self._open(
+                    os.path.join(path, "Packages.xz"),
+                    lambda f: compression.ParallelXzWriter(f, level)
+                )
+        except Exception:
+            self.close()
+            raise
+
+    def _open(self, filepath, compressor):
+        stream = open(filepath + _TMP_SUFFIX, "wb")
+        writer = HashingWriter(stream, _CHECKSUM_ALGORITHMS)
+        if compressor is None:
+            sink = writer
+        else:
+            sink = compressor(writer)
+        self.files.append((filepath, stream, writer, sink))
+
+    def write(self, data):
+        for _, _, _, sink in self.files:
+            sink.write(data)
+
+    def close(self):
+        for _, stream, writer, sink in self.files:
+            try:
+                if sink is not writer:
+                    # flushes the tail of compressed data
+                    sink.close()
+            finally:
+                stream.close()
+
+    def discard(self):
+        """Removes the new files."""
+        self.close()
+        for filepath, _, _, _ in self.files:
+            if os.path.exists(filepath + _TMP_SUFFIX):
+                os.remove(filepath + _TMP_SUFFIX)
+
+    def publish(self):
+        """Replaces the index files by the new ones.
+
+        The files are published by checksum as well
+        and the expired files are removed from by-hash folder.
+        """
+        digests = set()
+        for filepath, _, writer, _ in self.files:
+            digest = writer.hexdigest()[_SHA256_INDEX]
+            _replace_file(filepath + _TMP_SUFFIX, filepath, digest)
+            digests.add(digest)
+        _expire_by_hash(self.path, digests)
+
+    def digests(self):
+        """Gets the size and checksums of files.
+
+        :return: the dict(path -> tuple(size, checksums))
+        """
+        return dict(
+            (filepath, (writer.size, writer.hexdigest()))
+            for filepath, _, writer, _ in self.files
+        )
+
+
 class DebIndexWriter(IndexWriter):
-    def __init__(self, driver, destination):
+    def __init__(self, driver, destination, passthrough=False):
         self.driver = driver
         self.destination = os.path.abspath(destination)
         self.index = defaultdict(FastRBTree)
         self.origin = None
+        self.passthrough = passthrough
+        self.upstreams = defaultdict(set)
+        # the size and checksums of files, that have been written
+        self.digests = dict()
 
     def add(self, p):
         self.index[(p.suite, p.comp)][p] = None
         if self.origin is None:
             self.origin = p.dpkg.get('origin')
+        if self.passthrough:
+            self.upstreams[p.suite].add(p.baseurl)
 
     def commit(self, keep_existing=True):
+        if self.passthrough and self._publish_upstream(keep_existing):
+            if not keep_existing:
+                self._collect_garbage()
+            return
+
         suites = set()
         self.origin = self.origin or _DEFAULT_ORIGIN
-        for repo, packages in six.iteritems(self.index):
-            self._rebuild_index(repo, packages, keep_existing)
-            suites.add(repo[0])
+        # the components are independent, the compression of one
+        # is running in native threads while others are serialized
+        section = AsynchronousSection(len(self.index))
+        try:
+            with section:
+                for repo, packages in six.iteritems(self.index):
+                    section.execute(
+                        self._rebuild_index, repo, packages, keep_existing
+                    )
+                    suites.add(repo[0])
+        except RuntimeError:
+            if section.failure is None:
+                raise
+            # the original error is more informative than generic one
+            six.reraise(*section.failure)
         self._updates_global_releases(suites)
+        if not keep_existing:
+            self._collect_garbage()
+
+    def _publish_upstream(self, keep_existing):
+        """Publishes the upstream indexes without changes.
+
+        The indexes are published only if all packages listed in them
+        have been copied, otherwise the indexes should be regenerated.
+
+        :return: True if indexes are published, otherwise False
+        """
+        staged = []
+        # the SHA256 of staged index files to publish them by checksum
+        digests = dict()
+        try:
+            for suite, baseurls in six.iteritems(self.upstreams):
+                if len(baseurls) != 1:
+                    logger.warning(
+                        "the suite %s is merged from several origins.", suite
+                    )
+                    return False
+                if not self._stage_upstream(
+                        next(iter(baseurls)), suite, staged, digests):
+                    return False
+
+            if keep_existing and self._has_dropped_packages():
+                return False
+
+            for tmp, path in staged:
+                _replace_file(tmp, path, digests.get(path))
+            self._remove_stale_files(set(path for _, path in staged))
+            staged = []
+            for dirpath in set(os.path.dirname(x) for x in digests):
+                _expire_by_hash(dirpath, set(
+                    v for k, v in six.iteritems(digests)
+                    if os.path.dirname(k) == dirpath
+                ))
+        except RETRYABLE_ERRORS as e:
+            logger.warning("failed to fetch upstream index: %s", e)
+            return False
+        finally:
+            for tmp, _ in staged:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+        logger.info("the upstream indexes have been published as is.")
+        return True
+
+    def _remove_stale_files(self, published):
+        """Removes the generated files, that are not in upstream.
+
+        The files generated by previous run do not match the upstream
+        Release, so they should not be left near the upstream indexes.
+
+        :param published: the set of paths of published upstream files
+        """
+        for suite, comp in self.index:
+            path = os.path.join(
+                self.destination, "dists", suite, comp,
+                "binary-" + self.driver.arch
+            )
+            for name in _GENERATED_FILES:
+                filepath = os.path.join(path, name)
+                if filepath not in published and os.path.exists(filepath):
+                    os.remove(filepath)
+                    logger.info("the stale file %s was removed.", filepath)
+            pdiff_dir = os.path.join(path, _PDIFF_DIR)
+            if os.path.join(pdiff_dir, PDIFF_INDEX) not in published and \
+                    os.path.exists(pdiff_dir):
+                shutil.rmtree(pdiff_dir)
+                logger.info("the stale folder %s was removed.", pdiff_dir)
+
+    def _stage_upstream(self, baseurl, suite, staged, digests):
+        """Downloads the upstream indexes of suite.
+
+        :param baseurl: the url of upstream repository
+        :param suite: the name of suite
+        :param staged: the list of tuples(staged path, path) to fill
+        :param digests: the dict(path -> SHA256) to fill
+        :return: True if indexes can be published as is, otherwise False
+        """
+        suite_dir = os.path.join(self.destination, "dists", suite)
+        suite_path = "/".join(("dists", suite))
+        release = os.path.join(suite_dir, "Release")
+        self.driver.fetch_from_mirrors(
+            baseurl, suite_path + "/Release", release + STAGED_SUFFIX
+        )
+        staged.append((release + STAGED_SUFFIX, release))
+        with closing(open(release + STAGED_SUFFIX, "rb")) as stream:
+            meta = deb822.Release(stream)
+
+        prefixes = tuple(
+            "{0}/binary-{1}/".format(comp, self.driver.arch)
+            for s, comp in self.index if s == suite
+        )
+        for field, algorithm in _RELEASE_CHECKSUMS:
+            if field in meta:
+                break
+        else:
+            logger.warning(
+                "there is no checksums in %s/%s.", baseurl, suite_path
+            )
+            return False
+
+        for entry in meta[field]:
+            name = entry["name"]
+            if not name.startswith(prefixes):
+                continue
+            path = os.path.join(suite_dir, name)
+            tmp = path + STAGED_SUFFIX
+            if not self.driver.fetch_from_mirrors(
+                    baseurl, suite_path + "/" + name, tmp, True):
+                # the uncompressed index is usually listed, but absent
+                continue
+            staged.insert(0, (tmp, path))
+            with closing(open(tmp, "rb")) as stream:
+                if checksum_.get(algorithm)(stream) != entry[field.lower()]:
+                    logger.warning("the checksum of %s mismatch.", name)
+                    return False
+            if algorithm == "sha256":
+                digests[path] = entry["sha256"]
+
+        if not self._is_complete(staged, suite_dir, len(prefixes)):
+            return False
+
+        for name in _RELEASE_SIGNATURES:
+            path = os.path.join(suite_dir, name)
+            tmp = path + STAGED_SUFFIX
+            if self.driver.fetch_from_mirrors(
+                    baseurl, suite_path + "/" + name, tmp, True):
+                staged.append((tmp, path))
+        return True
+
+    def _is_complete(self, staged, suite_dir, count):
+        """Checks that all packages from staged indexes are copied.
+
+        :param staged: the list of tuples(staged path, path)
+        :param suite_dir: the folder of suite
+        :param count: the number of expected Packages.gz
+        """
+        for tmp, path in staged:
+            if os.path.basename(path) != "Packages.gz" or \
+                    not path.startswith(suite_dir + os.sep):
+                continue
+            count -= 1
+            with closing(GzipDecompress(open(tmp, "rb"))) as stream:
+                for line in stream:
+                    if not line.startswith(b"Filename:"):
+                        continue
+                    filename = line[9:].strip().decode("utf-8")
+                    if not os.path.exists(
+                            os.path.join(self.destination, filename)):
+                        logger.warning(
+                            "the file %s from upstream index is missing.",
+                            filename
+                        )
+                        return False
+        if count > 0:
+            logger.warning("there is no Packages.gz in upstream.")
+            return False
+        return True
+
+    def _has_dropped_packages(self):
+        """Checks that published indexes list packages, that are not new.
+
+        :return: True if existing packages should be kept
+                 in regenerated index, otherwise False
+        """
+        for repo, packages in six.iteritems(self.index):
+            path = os.path.join(
+                self.destination, "dists", repo[0], repo[1],
+                "binary-" + self.driver.arch
+            )
+            published = set()
+            manifest = Manifest(path, os.path.join(path, "Packages")).load()
+            if manifest is not None:
+                published.update(x.filename for x in manifest)
+            elif os.path.exists(os.path.join(path, "Packages.gz")):
+                self.driver.load(
+                    self.destination, repo,
+                    lambda x: published.add(x.filename)
+                )
+            published.difference_update(p.filename for p in packages.keys())
+            if published:
+                return True
+        return False
+
+    def _collect_garbage(self):
+        """Removes the files from pool, that are not listed in indexes.
+
+        The indexes of all suites in destination are taken into
+        account, so the files shared between suites are kept.
+
+        :return: tuple(the number of removed files, the size of them)
+        """
+        references = self._get_references()
+        if references is None:
+            logger.warning(
+                "the garbage collection in %s is skipped.", self.destination
+            )
+            return 0, 0
+        existing = inventory.scan(
+            os.path.join(self.destination, "pool"),
+            self.driver.async_section()
+        )
+        garbage = dict(
+            (path, info) for path, info in six.iteritems(existing.files)
+            if path.endswith(_PACKAGE_SUFFIXES) and path not in references
+        )
+        return inventory.remove(
+            garbage, self.driver.async_section(), self.driver.clean_dry_run
+        )
+
+    def _get_references(self):
+        """Gets the files, that are listed in published indexes.
+
+        Only the indexes, that are listed in Release of suite,
+        are taken into account. The manifest is used, if the plain
+        index is listed, the index is read only if its manifest
+        is out of date.
+
+        :return: the set of paths or None, if some index cannot be read
+        """
+        references = set()
+        for root, dirs, files in os.walk(
+                os.path.join(self.destination, "dists")):
+            for d in ("by-hash", _PDIFF_DIR):
+                if d in dirs:
+                    dirs.remove(d)
+            if "Release" not in files:
+                continue
+            try:
+                listed = _get_listed_indexes(os.path.join(root, "Release"))
+                for path, names in six.iteritems(listed):
+                    references.update(
+                        os.path.normpath(os.path.join(self.destination, x))
+                        for x in self._get_filenames(
+                            os.path.join(root, path), names
+                        )
+                    )
+            except (EnvironmentError, ValueError) as e:
+                logger.warning("failed to read indexes of %s: %s", root, e)
+                return None
+        logger.info(
+            "%d files are listed in indexes of %s.",
+            len(references), self.destination
+        )
+        return references
+
+    @staticmethod
+    def _get_filenames(path, names):
+        """Gets the filenames of packages from the published index.
+
+        :param path: the folder of index
+        :param names: the names of index files, that are listed in Release
+        :return: the list of filenames, empty if the folder is absent
+        """
+        if not os.path.isdir(path):
+            # the upstream Release lists the indexes of all architectures,
+            # but only the indexes of mirrored ones are present
+            logger.debug("the indexes in %s are not mirrored.", path)
+            return []
+        names = [x for x in names if os.path.exists(os.path.join(path, x))]
+        if "Packages" in names:
+            published = Manifest(path, os.path.join(path, "Packages")).load()
+            if published is not None:
+                return [x.filename for x in published]
+        return _read_filenames(path, names)
 
     def _rebuild_index(self, repo, packages, keep_existing):
         """Saves the index file in local file system."""
@@ -87,34 +722,67 @@ class DebIndexWriter(IndexWriter):
 
         index_file = os.path.join(path, "Packages")
         index_gz = os.path.join(path, "Packages.gz")
+        index_xz = os.path.join(path, "Packages.xz")
         logger.info("the index file: %s.", index_file)
-        dirty_files = set()
-        if keep_existing:
-            on_existing_package = lambda x: packages.insert(x, None)
-            handler = lambda x: None
-        else:
-            on_existing_package = lambda x: dirty_files.add(x.filename)
-            handler = lambda x: dirty_files.discard(x.filename)
+        on_existing_package = lambda x: packages.insert(x, None)
 
-        if os.path.exists(index_gz):
+        manifest = Manifest(path, index_file)
+        old_index = None
+        # the files, that are not listed in new indexes, are removed
+        # by garbage collector, when all indexes are updated
+        published = manifest.load() if keep_existing else None
+        if published is not None:
+            logger.info("process manifest of existing index: %s", index_file)
+            # the records of existing packages are copied as is
+            old_index = open(index_file, "rb")
+            for entry in published:
+                on_existing_package(_PublishedPackage(entry, old_index))
+        elif keep_existing and os.path.exists(index_gz):
             logger.info("process existing index: %s", index_gz)
             self.driver.load(self.destination, repo, on_existing_package)
 
         if not os.path.exists(path):
             os.makedirs(path)
 
-        with closing(open(index_file, "wb")) as index:
-            with closing(gzip.open(index_gz, "wb")) as index_gz:
-                for p in packages.keys():
-                    p.dpkg.dump(fd=index)
-                    p.dpkg.dump(fd=index_gz)
-                    index.write(b"\n")
-                    index_gz.write(b"\n")
-                    handler(p)
+        if compression.lzma is None and os.path.exists(index_xz):
+            # the outdated file should not be listed in Release
+            os.remove(index_xz)
 
-        for f in dirty_files:
-            os.remove(os.path.join(self.destination, f))
-            logger.info("File %s was removed.", f)
+        # each paragraph is serialized once and the buffer is written
+        # to all files, when it is full
+        buf = six.BytesIO()
+        entries = []
+        written = 0
+        try:
+            index = _IndexFiles(path, self.driver.compression_level)
+            try:
+                for p in packages.keys():
+                    offset = buf.tell()
+                    p.dpkg.dump(fd=buf)
+                    entries.append(ManifestEntry.from_package(
+                        p, written + offset, buf.tell() - offset
+                    ))
+                    buf.write(b"\n")
+                    if buf.tell() >= _INDEX_BUFFER_SIZE:
+                        index.write(buf.getvalue())
+                        written += buf.tell()
+                        buf.seek(0)
+                        buf.truncate()
+                index.write(buf.getvalue())
+                index.close()
+            except Exception:
+                index.discard()
+                raise
+        finally:
+            if old_index is not None:
+                old_index.close()
+        pdiff_index = self._update_pdiffs(path, index_file)
+        # the old index is replaced only when new one is complete
+        index.publish()
+        self.digests.update(index.digests())
+        if pdiff_index is not None:
+            self._publish_pdiff_index(path, pdiff_index)
+        manifest.save(entries)
 
         self._generate_component_release(path, *repo)
 
@@ -122,17 +790,52 @@ class DebIndexWriter(IndexWriter):
             "the index %s has been updated successfully.", index_file
         )
 
+    def _update_pdiffs(self, path, index_file):
+        """Adds the patch from the published index to the new one.
+
+        :return: the content of new Index of patches or None,
+                 if it should not be changed
+        """
+        pdiff_dir = os.path.join(path, _PDIFF_DIR)
+        if not self.driver.pdiff_history:
+            if os.path.exists(pdiff_dir):
+                shutil.rmtree(pdiff_dir)
+            return None
+        return PDiffs(pdiff_dir, self.driver.pdiff_history).update(
+            index_file, index_file + _TMP_SUFFIX
+        )
+
+    def _publish_pdiff_index(self, path, content):
+        """Publishes the Index of patches after the new Packages."""
+        filepath = os.path.join(path, _PDIFF_DIR, PDIFF_INDEX)
+        data = content.encode("utf-8")
+        with closing(open(filepath + _TMP_SUFFIX, "wb")) as stream:
+            stream.write(data)
+        self.digests[filepath] = digests = \
+            (len(data), _checksum_collector(six.BytesIO(data)))
+        digest = digests[1][_SHA256_INDEX]
+        _replace_file(filepath + _TMP_SUFFIX, filepath, digest)
+        _expire_by_hash(os.path.dirname(filepath), {digest})
+
     def _generate_component_release(self, path, suite, component):
         """Generates the release meta information."""
         meta_filename = os.path.join(path, "Release")
-        with closing(open(meta_filename, "w")) as meta:
-            self._dump_meta(meta, [
-                ("Archive", suite),
-                ("Component", component),
-                ("Origin", self.origin),
-                ("Label", self.origin),
-                ("Architecture", self.driver.arch)
-            ])
+        content = six.StringIO()
+        self._dump_meta(content, [
+            ("Archive", suite),
+            ("Component", component),
+            ("Origin", self.origin),
+            ("Label", self.origin),
+            ("Architecture", self.driver.arch)
+        ])
+        content = content.getvalue()
+        with closing(open(meta_filename + _TMP_SUFFIX, "w")) as meta:
+            meta.write(content)
+        _replace_file(meta_filename + _TMP_SUFFIX, meta_filename)
+        data = content.encode("utf-8")
+        self.digests[meta_filename] = (
+            len(data), _checksum_collector(six.BytesIO(data))
+        )
 
     def _updates_global_releases(self, suites):
         """Generates the overall meta information."""
@@ -145,50 +848,84 @@ class DebIndexWriter(IndexWriter):
                 if os.path.isdir(os.path.join(suite_dir, d))
             ]
             release_file = os.path.join(suite_dir, "Release")
-            with closing(open(release_file, "w")) as meta:
-                fcntl.flock(meta.fileno(), fcntl.LOCK_EX)
+            lock_file = os.path.join(suite_dir, _SUITE_LOCK)
+            with closing(open(lock_file, "w")) as lock:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
                 try:
-                    self._dump_meta(meta, [
-                        ("Origin", self.origin),
-                        ("Label", self.origin),
-                        ("Suite", suite),
-                        ("Codename", suite),
-                        ("Architecture", self.driver.arch),
-                        ("Components", " ".join(components)),
-                        ("Date", date_str),
-                        ("Description", "{0} {1} Partial".format(
-                            self.origin, suite
-                        )),
-                    ])
-                    self._dump_files(meta, suite_dir, components)
+                    with closing(open(release_file + _TMP_SUFFIX, "w")) \
+                            as meta:
+                        self._dump_meta(meta, [
+                            ("Origin", self.origin),
+                            ("Label", self.origin),
+                            ("Suite", suite),
+                            ("Codename", suite),
+                            ("Architecture", self.driver.arch),
+                            ("Components", " ".join(components)),
+                            ("Date", date_str),
+                            ("Description", "{0} {1} Partial".format(
+                                self.origin, suite
+                            )),
+                            ("Acquire-By-Hash", "yes"),
+                        ])
+                        cache = self._load_digests_cache(suite_dir)
+                        cache = self._dump_files(
+                            meta, suite_dir, components, cache
+                        )
+                    # the clients get either old or new Release
+                    _replace_file(release_file + _TMP_SUFFIX, release_file)
+                    self._save_digests_cache(suite_dir, cache)
+                    self._remove_signatures(suite_dir)
                 finally:
-                    fcntl.flock(meta.fileno(), fcntl.LOCK_UN)
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
 
     @staticmethod
-    def _dump_files(meta, suite_dir, components):
-        """Dumps files meta information."""
+    def _remove_signatures(suite_dir):
+        """Removes the signatures, that do not match the new Release."""
+        for name in _RELEASE_SIGNATURES:
+            filepath = os.path.join(suite_dir, name)
+            if os.path.exists(filepath):
+                os.remove(filepath)
+                logger.info("the outdated signature %s was removed.",
+                            filepath)
+
+    def _dump_files(self, meta, suite_dir, components, cache=None):
+        """Dumps files meta information.
+
+        The size and checksums of files, that have been written
+        by this writer, are known. The digests of other files are
+        taken from cache, if files have not been changed since
+        the digests were calculated, otherwise files are read.
+
+        :param cache: the dict(relative path -> digests) of previous run
+        :return: the dict(relative path -> digests) of listed files
+        """
+        cache = cache or {}
+        new_cache = dict()
         index = defaultdict(list)
         for d in components:
             comp_path = os.path.join(suite_dir, d)
             for root, dirs, files in os.walk(comp_path):
+                if "by-hash" in dirs:
+                    dirs.remove("by-hash")
                 files = six.moves.filter(
                     _INDEX_FILES_ORDER.__contains__, files
                 )
                 for f in files:
                     filepath = os.path.join(root, f)
-                    with closing(open(filepath, "rb")) as stream:
-                        size = os.fstat(stream.fileno()).st_size
-                        checksum = six.moves.zip(
-                            _CHECKSUM_METHOD_NAMES,
-                            _checksum_collector(stream)
-                        )
-                        for n, h in checksum:
-                            index[n].append((
-                                h,
-                                _format_size(size),
-                                filepath[len(suite_dir) + 1:],
-                                (root, _INDEX_FILES_ORDER[f])
-                            ))
+                    relpath = filepath[len(suite_dir) + 1:]
+                    new_cache[relpath] = digests = \
+                        self._get_digests(filepath, cache.get(relpath))
+                    size, checksums = digests[1:]
+                    checksum = six.moves.zip(
+                        _CHECKSUM_METHOD_NAMES, checksums
+                    )
+                    for n, h in checksum:
+                        index[n].append((
+                            h,
+                            _format_size(size),
+                            relpath,
+                            (root, _INDEX_FILES_ORDER[f])
+                        ))
 
         index = sorted(six.iteritems(index), key=lambda x: x[0])
         for algo_name, files in index:
@@ -197,6 +934,50 @@ class DebIndexWriter(IndexWriter):
             for checksum, size, filepath, _ in files:
                 meta.write(" ".join((checksum, size, filepath)))
                 meta.write("\n")
+        return new_cache
+
+    def _get_digests(self, filepath, cached=None):
+        """Gets the size and checksums of file.
+
+        :param filepath: the path of file
+        :param cached: the digests from cache if any
+        :return: tuple(stat signature, size, checksums)
+        """
+        digests = self.digests.get(filepath)
+        if digests is not None:
+            return (_get_signature(os.stat(filepath)),) + tuple(digests)
+        if cached is not None:
+            if list(cached[0]) == _get_signature(os.stat(filepath)):
+                return cached
+        with closing(open(filepath, "rb")) as stream:
+            stats = os.fstat(stream.fileno())
+            return (
+                _get_signature(stats), stats.st_size,
+                _checksum_collector(stream)
+            )
+
+    @staticmethod
+    def _load_digests_cache(suite_dir):
+        """Loads the digests of index files from previous run."""
+        try:
+            with closing(open(
+                    os.path.join(suite_dir, _DIGESTS_CACHE), "r")) as stream:
+                return json.load(stream)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        except ValueError:
+            logger.warning("the cache of digests in %s is malformed.",
+                           suite_dir)
+        return {}
+
+    @staticmethod
+    def _save_digests_cache(suite_dir, cache):
+        """Saves the digests of index files for next run."""
+        path = os.path.join(suite_dir, _DIGESTS_CACHE)
+        with closing(open(path + ".tmp", "w")) as stream:
+            json.dump(cache, stream)
+        os.rename(path + ".tmp", path)
 
     @staticmethod
     def _dump_meta(stream, meta):
@@ -209,10 +990,15 @@ class Driver(RepoDriver):
 
     def __init__(self, context, arch):
         self.connections = context.connections
+        self.mirrors = context.mirrors
         self.arch = _ARCH_MAPPING[arch]
+        self.compression_level = context.compression_level
+        self.pdiff_history = context.pdiff_history
+        self.clean_dry_run = context.clean_dry_run
+        self.async_section = context.async_section
 
-    def create_index(self, destination):
-        return DebIndexWriter(self, destination)
+    def create_index(self, destination, passthrough=False):
+        return DebIndexWriter(self, destination, passthrough)
 
     def parse_urls(self, urls):
         for url in urls:
@@ -225,13 +1011,9 @@ class Driver(RepoDriver):
                     .format(url)
                 )
 
-            if baseurl.endswith("/dists/"):
-                baseurl = baseurl[:-7]
-            elif baseurl.endswith("/dists"):
-                baseurl = baseurl[:-6]
-            elif baseurl.endswith("/"):
-                baseurl = baseurl[:-1]
-
+            baseurl = self.mirrors.register([
+                _strip_dists(x) for x in self.mirrors.split(baseurl)
+            ])
             for comp in comps.split(" "):
                 yield baseurl, (suite, comp)
 
@@ -241,12 +1023,22 @@ class Driver(RepoDriver):
 
     def load(self, baseurl, repo, consumer):
         """Loads from Packages.gz."""
+        self.with_mirrors(baseurl, self._load, baseurl, repo, consumer)
+
+    def _load(self, url, baseurl, repo, consumer):
+        """Loads from Packages.gz of the mirror.
+
+        :param url: the url of mirror
+        :param baseurl: the url, that identifies group of mirrors
+        :param repo: the tuple(suite, component)
+        :param consumer: the callback to accept packages
+        """
         suite, comp = repo
         index_file = "{0}/dists/{1}/{2}/binary-{3}/Packages.gz".format(
-            baseurl, suite, comp, self.arch
+            url, suite, comp, self.arch
         )
         logger.info("loading packages from: %s", index_file)
-        with self.connections.get() as connection:
+        with self.connections.get(url=index_file) as connection:
             stream = GzipDecompress(connection.open_stream(index_file))
             pkg_iter = deb822.Packages.iter_paragraphs(stream)
             for dpkg in pkg_iter:
@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""The PDiffs of deb index, that allow apt to download changes only.
+
+The history of index is kept in the folder Packages.diff: the file Index
+lists the checksums of previous versions of index and the ed scripts,
+each of them transforms one version of index to the next one.
+"""
+
+import collections
+from contextlib import closing
+import difflib
+import errno
+import gzip
+import logging
+import os
+import six
+import time
+
+from packetary.library.checksum import composite as checksum_composite
+
+
+logger = logging.getLogger(__package__)
+
+
+INDEX = "Index"
+
+_CHECKSUM_ALGORITHMS = ["sha1", "sha256"]
+
+_CHECKSUM_FIELD_PREFIXES = ["SHA1", "SHA256"]
+
+_checksum_collector = checksum_composite(*_CHECKSUM_ALGORITHMS)
+
+# the lines are compared only inside of changed blocks, that are smaller,
+# larger blocks are replaced entirely
+_REFINE_LIMIT = 1000
+
+_PATCH_SUFFIX = ".gz"
+
+
+_Patch = collections.namedtuple(
+    "_Patch", ("name", "history", "patch", "download")
+)
+
+
+def _get_digest(data):
+    """Gets the size and checksums of data."""
+    return len(data), _checksum_collector(six.BytesIO(data))
+
+
+def _split_lines(data):
+    """Splits data to lines, that keep the line separator."""
+    lines = data.split(b"\n")
+    tail = lines.pop()
+    lines = [x + b"\n" for x in lines]
+    if tail:
+        lines.append(tail)
+    return lines
+
+
+def _split_paragraphs(lines):
+    """Groups the lines of index by paragraphs.
+
+    :return: tuple(list of paragraphs, the numbers of lines,
+             where paragraphs start, including end of the last one)
+    """
+    paragraphs = []
+    offsets = [0]
+    start = 0
+    for i, line in enumerate(lines):
+        if line == b"\n":
+            paragraphs.append(b"".join(lines[start:i + 1]))
+            start = i + 1
+            offsets.append(start)
+    if start < len(lines):
+        paragraphs.append(b"".join(lines[start:]))
+        offsets.append(len(lines))
+    return paragraphs, offsets
+
+
+def _get_changes(old, new):
+    """Finds the blocks of changed lines.
+
+    The paragraphs are compared at first, because the lines like
+    "Architecture: amd64" repeat through the whole index and
+    the line by line comparison of large index is too slow.
+
+    :return: the list of tuples(start, end, new start, new end)
+    """
+    a, a_offsets = _split_paragraphs(old)
+    b, b_offsets = _split_paragraphs(new)
+    changes = []
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        a1, a2 = a_offsets[i1], a_offsets[i2]
+        b1, b2 = b_offsets[j1], b_offsets[j2]
+        if tag != "replace" or max(a2 - a1, b2 - b1) > _REFINE_LIMIT:
+            changes.append((a1, a2, b1, b2))
+            continue
+        matcher = difflib.SequenceMatcher(
+            None, old[a1:a2], new[b1:b2], autojunk=False
+        )
+        for tag, k1, k2, l1, l2 in matcher.get_opcodes():
+            if tag != "equal":
+                changes.append((a1 + k1, a1 + k2, b1 + l1, b1 + l2))
+    return changes
+
+
+def ed_diff(old, new):
+    """Generates the ed script, that transforms old lines to new ones.
+
+    The commands are ordered from the end of file, as diff --ed does,
+    so the line numbers are not shifted by previous commands.
+
+    :param old: the list of lines of previous index
+    :param new: the list of lines of new index
+    :return: the script as bytes
+    :raises ValueError: if lines cannot be written to ed script
+    """
+    script = []
+    for a1, a2, b1, b2 in reversed(_get_changes(old, new)):
+        if a1 == a2:
+            script.append(("%da\n" % a1).encode("ascii"))
+        else:
+            if a2 - a1 > 1:
+                address = "%d,%d" % (a1 + 1, a2)
+            else:
+                address = "%d" % a2
+            if b1 == b2:
+                script.append((address + "d\n").encode("ascii"))
+                continue
+            script.append((address + "c\n").encode("ascii"))
+        for line in new[b1:b2]:
+            if line == b".\n" or not line.endswith(b"\n"):
+                raise ValueError(
+                    "The line {0!r} cannot be written to ed script."
+                    .format(line)
+                )
+            script.append(line)
+        script.append(b".\n")
+    return b"".join(script)
+
+
+def _read(filepath):
+    """Reads the whole file, returns None if file does not exist."""
+    try:
+        stream = open(filepath, "rb")
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+    with closing(stream):
+        return stream.read()
+
+
+def _parse_fields(stream):
+    """Parses the fields of Index.
+
+    :return: the dict(field name -> list of records)
+    """
+    fields = dict()
+    records = None
+    for line in stream:
+        if not line.strip():
+            continue
+        if line[0].isspace():
+            records.append(line.split())
+        else:
+            name, _, value = line.partition(":")
+            value = value.split()
+            fields[name] = records = [value] if value else []
+    return fields
+
+
+def _get_digests(fields, name):
+    """Gets the digests, that are listed in the field of Index.
+
+    :return: the dict(file name -> tuple(size, checksums)),
+             the file name is None for the current index
+    """
+    digests = dict()
+    for i, prefix in enumerate(_CHECKSUM_FIELD_PREFIXES):
+        for record in fields["-".join((prefix, name))]:
+            key = record[2] if len(record) > 2 else None
+            size, checksums = digests.setdefault(
+                key, (int(record[1]), [None] * len(_CHECKSUM_ALGORITHMS))
+            )
+            if size != int(record[1]):
+                raise ValueError("The size of {0} mismatch.".format(key))
+            checksums[i] = record[0]
+    for key, (_, checksums) in six.iteritems(digests):
+        if None in checksums:
+            raise ValueError("The checksum of {0} is missing.".format(key))
+    return digests
+
+
+class PDiffs(object):
+    """The history of index in terms of PDiffs."""
+
+    def __init__(self, path, depth):
+        """Initialises.
+
+        :param path: the folder of patches
+        :param depth: the number of patches to keep
+        """
+        self.path = path
+        self.depth = depth
+
+    def update(self, old_file, new_file):
+        """Adds the patch, that transforms previous index to new one.
+
+        If the previous index is not described by the history,
+        the history is started again.
+
+        :param old_file: the path of published index
+        :param new_file: the path of new index
+        :return: the content of new Index or None,
+                 if the Index should not be changed
+        """
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        new_data = _read(new_file)
+        current = _get_digest(new_data)
+        old_data = _read(old_file)
+        history = self._load()
+        if old_data is None:
+            patches = []
+        else:
+            previous = _get_digest(old_data)
+            if history is not None and history[0] == previous:
+                if previous == current:
+                    return None
+                patches = history[1]
+            else:
+                patches = []
+            if previous != current:
+                try:
+                    patches.append(self._write_patch(
+                        self._get_patch_name(patches), previous,
+                        ed_diff(_split_lines(old_data), _split_lines(new_data))
+                    ))
+                except ValueError as e:
+                    logger.warning(
+                        "the history of %s is started again: %s",
+                        self.path, e
+                    )
+                    patches = []
+
+        patches = patches[-self.depth:]
+        self._remove_outdated(patches)
+        return self._format(current, patches)
+
+    def _load(self):
+        """Loads the Index.
+
+        :return: tuple(current digest, list of patches) or None,
+                 if the Index does not exist, is malformed
+                 or some of listed patches is missing
+        """
+        try:
+            stream = open(os.path.join(self.path, INDEX), "r")
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+
+        with closing(stream):
+            try:
+                fields = _parse_fields(stream)
+                current = _get_digests(fields, "Current")[None]
+                history = _get_digests(fields, "History")
+                patches = _get_digests(fields, "Patches")
+                downloads = _get_digests(fields, "Download")
+                names = [
+                    x[2] for x in fields[
+                        _CHECKSUM_FIELD_PREFIXES[-1] + "-History"
+                    ]
+                ]
+                patches = [
+                    _Patch(
+                        x, history[x], patches[x], downloads[x + _PATCH_SUFFIX]
+                    )
+                    for x in names
+                ]
+            except (KeyError, ValueError, IndexError, AttributeError):
+                logger.warning("the Index of %s is malformed.", self.path)
+                return None
+
+        # apt applies the patches one by one, so the history
+        # with a gap is useless and it should be started again
+        for patch in patches:
+            if not os.path.exists(
+                    os.path.join(self.path, patch.name + _PATCH_SUFFIX)):
+                logger.warning(
+                    "the patch %s of %s is missing.", patch.name, self.path
+                )
+                return None
+        return current, patches
+
+    @staticmethod
+    def _get_patch_name(patches):
+        name = time.strftime("%Y-%m-%d-%H%M.%S", time.gmtime())
+        names = set(x.name for x in patches)
+        candidate = name
+        number = 0
+        while candidate in names:
+            number += 1
+            candidate = "{0}.{1}".format(name, number)
+        return candidate
+
+    def _write_patch(self, name, previous, script):
+        """Writes the compressed patch.
+
+        :return: the _Patch
+        """
+        data = six.BytesIO()
+        with closing(gzip.GzipFile(fileobj=data, mode="wb", mtime=0)) as gz:
+            gz.write(script)
+        data = data.getvalue()
+        filepath = os.path.join(self.path, name + _PATCH_SUFFIX)
+        with closing(open(filepath + ".tmp", "wb")) as stream:
+            stream.write(data)
+        os.rename(filepath + ".tmp", filepath)
+        logger.info("the patch %s was written.", filepath)
+        return _Patch(name, previous, _get_digest(script), _get_digest(data))
+
+    def _remove_outdated(self, patches):
+        """Removes the patches, that are not listed in history."""
+        names = set(x.name + _PATCH_SUFFIX for x in patches)
+        for name in os.listdir(self.path):
+            if name.endswith(_PATCH_SUFFIX) and name not in names:
+                os.remove(os.path.join(self.path, name))
+                logger.info("the outdated patch %s was removed.", name)
+
+    @staticmethod
+    def _format(current, patches):
+        lines = []
+        for i, prefix in enumerate(_CHECKSUM_FIELD_PREFIXES):
+            lines.append("{0}-Current: {1} {2}".format(
+                prefix, current[1][i], current[0]
+            ))
+        for i, prefix in enumerate(_CHECKSUM_FIELD_PREFIXES):
+            for field, attr, suffix in (("History", "history", ""),
+                                        ("Patches", "patch", ""),
+                                        ("Download", "download",
+                                         _PATCH_SUFFIX)):
+                lines.append("{0}-{1}:".format(prefix, field))
+                for patch in patches:
+                    size, checksums = getattr(patch, attr)
+                    lines.append(" {0} {1:>8} {2}{3}".format(
+                        checksums[i], size, patch.name, suffix
+                    ))
+        lines.append("")
+        return "\n".join(lines)
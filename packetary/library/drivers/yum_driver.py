@@ -18,79 +18,228 @@ import lxml.etree as etree
 import os
 import six
 import six.moves.urllib.parse as urlparse
-import subprocess
 
+from packetary.library import checksum
+from packetary.library import inventory
+from packetary.library.connections import RETRYABLE_ERRORS
 from packetary.library.driver import IndexWriter
 from packetary.library.driver import RepoDriver
+from packetary.library.driver import STAGED_SUFFIX
 from packetary.library.drivers.yum_package import YumPackage
+from packetary.library.drivers.yum_repodata import RepodataWriter
+from packetary.library.manifest import Manifest
+from packetary.library.manifest import ManifestEntry
 from packetary.library.streams import GzipDecompress
 
 
 logger = logging.getLogger(__package__)
 
 
+_PACKAGE_SUFFIX = ".rpm"
+
 _namespaces = {
     "main": "http://linux.duke.edu/metadata/common",
     "md": "http://linux.duke.edu/metadata/repo"
 }
 
 
-def _find_createrepo():
-    """Finds the createrepo executable"""
-    paths = os.environ['PATH'].split(os.pathsep)
-    executable = os.environ.get("CREATEREPO_PATH", "createrepo")
-    if not os.path.isfile(executable):
-        for p in paths:
-            f = os.path.join(p, executable)
-            if os.path.isfile(f):
-                return f
-        return None
-    else:
-        return executable
-
-
-createrepo = _find_createrepo()
-
-
 class YumIndexWriter(IndexWriter):
-    def __init__(self, driver, destination):
+    def __init__(self, driver, destination, passthrough=False):
         self.destination = os.path.abspath(destination)
         self.driver = driver
-        self.repos = defaultdict(set)
+        self.repos = defaultdict(dict)
+        self.passthrough = passthrough
+        self.upstreams = defaultdict(set)
 
     def add(self, p):
-        self.repos[p.reponame].add(p.filename)
+        self.repos[p.reponame][p.filename] = p
+        if self.passthrough:
+            self.upstreams[p.reponame].add(p.baseurl)
 
     def commit(self, keep_existing=False):
-        if createrepo is None:
-            six.print_(
-                "Please install createrepo utility and run the following "
-                "commands manually:"
-            )
-            command = lambda x: six.print_("\t", subprocess.list2cmdline(x))
-            executable = "createrepo"
-        else:
-            command = subprocess.check_call
-            executable = createrepo
-
-        for reponame, files in six.iteritems(self.repos):
+        for reponame, packages in six.iteritems(self.repos):
+            if self.passthrough and \
+                    self._publish_upstream(reponame, keep_existing):
+                continue
             path = os.path.join(self.destination, reponame, self.driver.arch)
-            if os.path.exists(os.path.join(path, "repodata", "repomd.xml")):
-                if not keep_existing:
-                    self.driver.load(
-                        self.destination, reponame,
-                        lambda x: self._remove_dirty_package(x, files)
-                    )
-                cmd = [executable, path, "--update"]
+            repomd = os.path.join(path, "repodata", "repomd.xml")
+            if not keep_existing:
+                self._remove_files(self._scan_dirty_files(path, packages))
+                published = []
+            elif os.path.exists(repomd):
+                published = self._load_published(reponame, path, repomd)
             else:
-                cmd = [executable, path]
-            command(cmd)
+                published = []
+            entries = RepodataWriter(
+                self.driver, path, reponame, self.driver.compression_level
+            ).write(
+                six.itervalues(packages),
+                [x for x in published if x.filename not in packages]
+            )
+            Manifest(path, repomd).save(entries)
+
+    def _publish_upstream(self, reponame, keep_existing):
+        """Publishes the upstream metadata without changes.
+
+        The metadata is published only if all packages listed in it
+        have been copied, otherwise it should be regenerated.
+
+        :return: True if metadata is published, otherwise False
+        """
+        baseurls = self.upstreams[reponame]
+        if len(baseurls) != 1:
+            logger.warning(
+                "the repository %s is merged from several origins.", reponame
+            )
+            return False
+
+        path = os.path.join(self.destination, reponame, self.driver.arch)
+        baseurl = next(iter(baseurls))
+        repo_path = "/".join((reponame, self.driver.arch))
+        repodata = os.path.join(path, "repodata")
+        repomd = os.path.join(repodata, "repomd.xml")
+        staged = []
+        try:
+            self.driver.fetch_from_mirrors(
+                baseurl, repo_path + "/repodata/repomd.xml",
+                repomd + STAGED_SUFFIX
+            )
+            staged.append((repomd + STAGED_SUFFIX, repomd))
+            primary = None
+            tree = etree.parse(repomd + STAGED_SUFFIX)
+            for node in tree.iterfind("./md:data", _namespaces):
+                href = node.find("./md:location", _namespaces).attrib["href"]
+                dst = os.path.join(path, href)
+                tmp = dst + STAGED_SUFFIX
+                self.driver.fetch_from_mirrors(
+                    baseurl, repo_path + "/" + href, tmp
+                )
+                # the repomd.xml should be published last
+                staged.insert(0, (tmp, dst))
+                if not self._verify(tmp, node):
+                    return False
+                if node.attrib.get("type") == "primary":
+                    primary = tmp
+
+            if primary is None or not self._is_complete(primary, path):
+                return False
+            dirty_files = self._get_dirty_files(reponame, keep_existing)
+            if dirty_files is None:
+                return False
+
+            outdated = set(
+                os.path.join(repodata, x) for x in os.listdir(repodata)
+                if not x.endswith(STAGED_SUFFIX)
+            )
+            for tmp, dst in staged:
+                os.rename(tmp, dst)
+                outdated.discard(dst)
+            staged = []
+        except RETRYABLE_ERRORS as e:
+            logger.warning("failed to fetch upstream metadata: %s", e)
+            return False
+        finally:
+            for tmp, _ in staged:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+        for f in outdated:
+            os.remove(f)
+        self._remove_files(dirty_files)
+        logger.info("the upstream metadata of %s is published as is.", path)
+        return True
+
+    @staticmethod
+    def _verify(path, node):
+        """Checks the file against checksum from repomd.xml."""
+        expected = node.find("./md:checksum", _namespaces)
+        try:
+            calculate = checksum.get(expected.attrib["type"])
+        except ValueError as e:
+            logger.warning("%s: %s", path, e)
+            return False
+        with open(path, "rb") as stream:
+            if calculate(stream) != expected.text:
+                logger.warning("the checksum of %s mismatch.", path)
+                return False
+        return True
+
+    @staticmethod
+    def _is_complete(primary, path):
+        """Checks that all packages from primary metadata are copied."""
+        if not primary.endswith(".gz" + STAGED_SUFFIX):
+            logger.warning("unsupported compression of %s.", primary)
+            return False
+        with open(primary, "rb") as stream:
+            tree = etree.parse(GzipDecompress(stream))
+        for node in tree.iterfind(
+                "./main:package/main:location", _namespaces):
+            href = node.attrib["href"]
+            if not os.path.exists(os.path.join(path, href)):
+                logger.warning(
+                    "the file %s from upstream metadata is missing.", href
+                )
+                return False
+        return True
+
+    def _get_dirty_files(self, reponame, keep_existing):
+        """Gets the files, that are not listed in new metadata.
+
+        :return: the dict(path -> FileInfo) of files to remove or None,
+                 if existing packages should be kept in new metadata
+        """
+        path = os.path.join(self.destination, reponame, self.driver.arch)
+        packages = self.repos[reponame]
+        if not keep_existing:
+            return self._scan_dirty_files(path, packages)
+
+        repomd = os.path.join(path, "repodata", "repomd.xml")
+        if os.path.exists(repomd):
+            published = self._load_published(reponame, path, repomd)
+            if any(x.filename not in packages for x in published):
+                return None
+        return {}
+
+    def _scan_dirty_files(self, path, packages):
+        """Finds the packages, that are not selected, in repository.
 
-    def _remove_dirty_package(self, p, known_files):
-        filename = p.filename
-        if filename not in known_files:
-            os.remove(self.driver.get_path(None, p))
-            logger.info("File %s was removed.", p.filename)
+        The files are compared with the selected ones, so
+        the existing metadata is not required.
+
+        :param path: the folder of repository
+        :param packages: the dict(filename -> package) of new packages
+        :return: the dict(path -> FileInfo) of files to remove
+        """
+        selected = set(
+            os.path.normpath(os.path.join(path, x)) for x in packages
+        )
+        existing = inventory.scan(path, self.driver.async_section())
+        return dict(
+            (filepath, info) for filepath, info in
+            six.iteritems(existing.files)
+            if filepath.endswith(_PACKAGE_SUFFIX) and filepath not in selected
+        )
+
+    def _remove_files(self, files):
+        inventory.remove(
+            files, self.driver.async_section(), self.driver.clean_dry_run
+        )
+
+    def _load_published(self, reponame, path, repomd):
+        """Gets the packages from the existing metadata.
+
+        The metadata is parsed only if manifest is out of date.
+
+        :return: the list of ManifestEntry
+        """
+        published = Manifest(path, repomd).load()
+        if published is None:
+            published = []
+            self.driver.load(
+                self.destination, reponame,
+                lambda x: published.append(ManifestEntry.from_package(x))
+            )
+        return published
 
 
 class Driver(RepoDriver):
@@ -98,16 +247,32 @@ class Driver(RepoDriver):
 
     def __init__(self, context, arch):
         self.connections = context.connections
+        self.mirrors = context.mirrors
+        self.compression_level = context.compression_level
+        self.clean_dry_run = context.clean_dry_run
+        self.async_section = context.async_section
         self.arch = arch
 
-    def create_index(self, destination):
-        return YumIndexWriter(self, destination)
+    def create_index(self, destination, passthrough=False):
+        return YumIndexWriter(self, destination, passthrough)
 
     def parse_urls(self, urls):
         for url in urls:
-            if url.endswith("/"):
-                url = url[:-1]
-            yield url.rsplit("/", 1)
+            baseurls = []
+            reponames = set()
+            for mirror in self.mirrors.split(url):
+                if mirror.endswith("/"):
+                    mirror = mirror[:-1]
+                baseurl, reponame = mirror.rsplit("/", 1)
+                baseurls.append(baseurl)
+                reponames.add(reponame)
+            if len(reponames) != 1:
+                raise ValueError(
+                    "Invalid url: {0}\n"
+                    "Expected: the urls of same repository separated by {1}"
+                    .format(url, self.mirrors.SEPARATOR)
+                )
+            yield [self.mirrors.register(baseurls), reponames.pop()]
 
     def get_path(self, base, package):
         baseurl = base or package.baseurl
@@ -117,12 +282,22 @@ class Driver(RepoDriver):
 
     def load(self, baseurl, reponame, consumer):
         """Reads packages from metdata."""
-        current_url = "/".join((baseurl, reponame, self.arch, ""))
+        self.with_mirrors(baseurl, self._load, baseurl, reponame, consumer)
+
+    def _load(self, url, baseurl, reponame, consumer):
+        """Reads packages from metadata of the mirror.
+
+        :param url: the url of mirror
+        :param baseurl: the url, that identifies group of mirrors
+        :param reponame: the name of repository
+        :param consumer: the callback to accept packages
+        """
+        current_url = "/".join((url, reponame, self.arch, ""))
         repomd = current_url + "repodata/repomd.xml"
         logger.info("repomd: %s", repomd)
 
         nodes = None
-        with self.connections.get() as connection:
+        with self.connections.get(url=repomd) as connection:
             repomd_tree = etree.parse(connection.open_stream(repomd))
 
             node = repomd_tree.find("./md:data[@type='primary']", _namespaces)
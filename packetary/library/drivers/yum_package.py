@@ -15,6 +15,7 @@
 #    under the License.
 
 from collections import namedtuple
+import lxml.etree as etree
 
 from packetary.library.package import Package
 from packetary.library.package import Relation
@@ -98,6 +99,8 @@ class YumPackage(Package):
         self._requires = _get_relations(pkg_tag, "requires")
         self._provides = _get_relations(pkg_tag, "provides")
         self._obsoletes = _get_relations(pkg_tag, "obsoletes")
+        # the record is published as is, when metadata is regenerated
+        self._record = etree.tostring(pkg_tag, with_tail=False) + b"\n"
 
     @property
     def name(self):
@@ -123,6 +126,11 @@ class YumPackage(Package):
     def baseurl(self):
         return self._baseurl
 
+    @property
+    def record(self):
+        """The record of package in primary metadata."""
+        return self._record
+
     @property
     def requires(self):
         return self._requires
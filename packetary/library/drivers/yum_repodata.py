@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""The writer of yum repodata, that does not read RPM files.
+
+The records of packages are copied from the metadata of repositories,
+where packages were found, so the checksums, sizes and relations
+are not calculated again, as createrepo does.
+"""
+
+import bz2
+from collections import defaultdict
+from contextlib import closing
+import logging
+import lxml.etree as etree
+import os
+import six
+import time
+
+from packetary.library import compression
+from packetary.library.connections import RETRYABLE_ERRORS
+from packetary.library.driver import STAGED_SUFFIX
+from packetary.library.manifest import ManifestEntry
+from packetary.library.streams import GzipDecompress
+from packetary.library.streams import HashingWriter
+
+
+logger = logging.getLogger(__package__)
+
+
+_namespaces = {
+    "main": "http://linux.duke.edu/metadata/common",
+    "filelists": "http://linux.duke.edu/metadata/filelists",
+    "other": "http://linux.duke.edu/metadata/other",
+    "md": "http://linux.duke.edu/metadata/repo",
+    "rpm": "http://linux.duke.edu/metadata/rpm",
+}
+
+# the kind of metadata, the root element and its namespace
+_METADATA = [
+    ("primary", "metadata", "main"),
+    ("filelists", "filelists", "filelists"),
+    ("other", "otherdata", "other"),
+]
+
+_CHECKSUM_ALGORITHM = "sha256"
+
+_TMP_SUFFIX = ".tmp"
+
+
+def _iterparse(stream, tag):
+    """Iterates over records without building the whole tree."""
+    for _, elem in etree.iterparse(stream, events=("end",), tag=tag):
+        yield elem
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
+def _open_metadata(filepath, href):
+    """Opens the metadata file for reading.
+
+    :param filepath: the local path of file
+    :param href: the location of file, that defines compression
+    :raises ValueError: if the compression is not supported
+    """
+    if href.endswith(".gz"):
+        return GzipDecompress(open(filepath, "rb"))
+    if href.endswith(".bz2"):
+        return bz2.BZ2File(filepath, "rb")
+    if href.endswith(".xz") and compression.lzma is not None:
+        return compression.lzma.LZMAFile(filepath, "rb")
+    if href.endswith(".xml"):
+        return open(filepath, "rb")
+    raise ValueError("Unsupported compression of {0}.".format(href))
+
+
+def _get_locations(repomd):
+    """Gets the locations of metadata files.
+
+    :param repomd: the path of repomd.xml
+    :return: the dict(kind of metadata -> location)
+    """
+    tree = etree.parse(repomd)
+    return dict(
+        (node.attrib["type"],
+         node.find("./md:location", _namespaces).attrib["href"])
+        for node in tree.iterfind("./md:data", _namespaces)
+    )
+
+
+def _tostring(elem):
+    return etree.tostring(elem, with_tail=False) + b"\n"
+
+
+def _make_record(kind, pkgid, primary):
+    """Makes the record of filelists or other metadata from primary.
+
+    The list of files in primary metadata is not complete,
+    but it is better than nothing, if the record is not found.
+    """
+    primary = etree.fromstring(primary)
+    namespace = _namespaces[kind]
+    record = etree.Element(
+        "{%s}package" % namespace, nsmap={None: namespace},
+        pkgid=pkgid,
+        name=primary.findtext("./main:name", namespaces=_namespaces),
+        arch=primary.findtext("./main:arch", namespaces=_namespaces)
+    )
+    etree.SubElement(
+        record, "{%s}version" % namespace,
+        dict(primary.find("./main:version", _namespaces).attrib)
+    )
+    if kind == "filelists":
+        for node in primary.iterfind("./main:format/main:file", _namespaces):
+            etree.SubElement(
+                record, "{%s}file" % namespace, dict(node.attrib)
+            ).text = node.text
+    return _tostring(record)
+
+
+class _MetadataFile(object):
+    """Writes the compressed metadata and calculates its checksums."""
+
+    def __init__(self, repodata, kind, root, namespace, count, level):
+        self.repodata = repodata
+        self.kind = kind
+        self.root = root
+        self.tmp = os.path.join(repodata, kind + ".xml.gz" + _TMP_SUFFIX)
+        self.stream = open(self.tmp, "wb")
+        self.compressed = HashingWriter(self.stream, [_CHECKSUM_ALGORITHM])
+        self.plain = HashingWriter(
+            compression.ParallelGzipWriter(self.compressed, level),
+            [_CHECKSUM_ALGORITHM]
+        )
+        header = '<{0} xmlns="{1}"'.format(root, _namespaces[namespace])
+        if kind == "primary":
+            header += ' xmlns:rpm="{0}"'.format(_namespaces["rpm"])
+        header += ' packages="{0}">\n'.format(count)
+        self.plain.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+        self.plain.write(header.encode("utf-8"))
+
+    def write(self, record):
+        self.plain.write(record)
+
+    def close(self):
+        try:
+            self.plain.write("</{0}>\n".format(self.root).encode("utf-8"))
+            self.plain.stream.close()
+        finally:
+            self.stream.close()
+
+    def discard(self):
+        self.stream.close()
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+    def publish(self):
+        """Renames the file by its checksum.
+
+        :return: the data element of repomd.xml
+        """
+        digest = self.compressed.hexdigest()[0]
+        href = "repodata/{0}-{1}.xml.gz".format(digest, self.kind)
+        filepath = os.path.join(os.path.dirname(self.repodata), href)
+        os.rename(self.tmp, filepath)
+
+        data = etree.Element("{%s}data" % _namespaces["md"], type=self.kind)
+        for name, value in (
+                ("checksum", digest),
+                ("open-checksum", self.plain.hexdigest()[0])):
+            etree.SubElement(
+                data, "{%s}%s" % (_namespaces["md"], name),
+                type=_CHECKSUM_ALGORITHM
+            ).text = value
+        etree.SubElement(
+            data, "{%s}location" % _namespaces["md"], href=href
+        )
+        for name, value in (
+                ("timestamp", int(os.stat(filepath).st_mtime)),
+                ("size", self.compressed.size),
+                ("open-size", self.plain.size)):
+            etree.SubElement(
+                data, "{%s}%s" % (_namespaces["md"], name)
+            ).text = six.text_type(value)
+        return data
+
+
+class RepodataWriter(object):
+    """Writes the primary, filelists and other metadata and repomd.xml.
+
+    The records of primary metadata are taken from packages.
+    The records of filelists and other metadata are copied from
+    the published metadata at first and from the metadata of
+    repositories, where packages were found, if they are missing.
+    """
+
+    def __init__(self, driver, path, reponame,
+                 level=compression.DEFAULT_LEVEL):
+        """Initialises.
+
+        :param driver: the driver of yum repositories
+        :param path: the folder of repository
+        :param reponame: the name of repository
+        :param level: the compression level of metadata
+        """
+        self.driver = driver
+        self.path = path
+        self.reponame = reponame
+        self.level = level
+        self.repodata = os.path.join(path, "repodata")
+        self.repomd = os.path.join(self.repodata, "repomd.xml")
+        # the locations of metadata in the origin repositories
+        self.locations = dict()
+
+    def write(self, packages, published=None):
+        """Writes the metadata and replaces repomd.xml.
+
+        :param packages: the new packages
+        :param published: the ManifestEntry of published packages,
+                          that should be kept
+        :return: the list of ManifestEntry of packages in new metadata
+        """
+        records = dict()
+        entries = dict()
+        origins = defaultdict(set)
+        for p in packages:
+            pkgid = p.checksum[1]
+            records[pkgid] = p.record
+            entries[pkgid] = ManifestEntry.from_package(p)
+            origins[p.baseurl].add(pkgid)
+
+        kept = dict(
+            (x.checksum[1], x) for x in published or ()
+            if x.checksum[1] not in records
+        )
+        if kept:
+            self._load_records(kept, records, entries)
+
+        if not os.path.exists(self.repodata):
+            os.makedirs(self.repodata)
+        order = sorted(records, key=lambda x: entries[x].filename)
+        files = []
+        try:
+            for kind, root, namespace in _METADATA:
+                files.append(_MetadataFile(
+                    self.repodata, kind, root, namespace, len(order),
+                    self.level
+                ))
+                if kind == "primary":
+                    for pkgid in order:
+                        files[-1].write(records[pkgid])
+                else:
+                    self._copy_records(files[-1], order, records, origins)
+                files[-1].close()
+        except Exception:
+            for f in files:
+                f.discard()
+            raise
+
+        self._write_repomd([f.publish() for f in files])
+        logger.info("the metadata of %s has been updated.", self.path)
+        return [entries[x] for x in order]
+
+    def _load_records(self, kept, records, entries):
+        """Loads the records of kept packages from published metadata."""
+        tag = "{%s}package" % _namespaces["main"]
+        try:
+            href = _get_locations(self.repomd)["primary"]
+            stream = _open_metadata(os.path.join(self.path, href), href)
+            with closing(stream):
+                for elem in _iterparse(stream, tag):
+                    pkgid = elem.findtext("./main:checksum",
+                                          namespaces=_namespaces)
+                    entry = kept.pop(pkgid, None)
+                    if entry is not None:
+                        records[pkgid] = _tostring(elem)
+                        entries[pkgid] = entry
+        except (EnvironmentError, KeyError, ValueError,
+                etree.XMLSyntaxError) as e:
+            logger.warning("failed to load the metadata of %s: %s",
+                           self.path, e)
+
+        for entry in six.itervalues(kept):
+            logger.warning(
+                "the package %s is not found in published metadata.",
+                entry.filename
+            )
+
+    def _copy_records(self, output, order, records, origins):
+        """Copies the records of filelists or other metadata."""
+        written = set()
+        tag = "{%s}package" % _namespaces[output.kind]
+        # the published metadata is read at first, because it is local
+        sources = [(None, set(records))]
+        sources.extend(six.iteritems(origins))
+        for baseurl, pkgids in sources:
+            pkgids = pkgids - written
+            if not pkgids:
+                continue
+            try:
+                stream = self._open_source(baseurl, output.kind)
+                if stream is None:
+                    continue
+                with closing(stream):
+                    for elem in _iterparse(stream, tag):
+                        pkgid = elem.get("pkgid")
+                        if pkgid in pkgids and pkgid not in written:
+                            output.write(_tostring(elem))
+                            written.add(pkgid)
+            except RETRYABLE_ERRORS + (KeyError, ValueError,
+                                       etree.XMLSyntaxError) as e:
+                logger.warning(
+                    "failed to copy %s metadata from %s: %s",
+                    output.kind, baseurl or self.path, e
+                )
+
+        for pkgid in order:
+            if pkgid not in written:
+                output.write(_make_record(output.kind, pkgid, records[pkgid]))
+
+    def _open_source(self, baseurl, kind):
+        """Opens the metadata of repository.
+
+        The metadata of origin repository is downloaded
+        to the temporary file, that is removed on close.
+
+        :param baseurl: the url of origin repository,
+                        None - the published metadata
+        :param kind: the kind of metadata
+        :return: the stream or None, if metadata does not exist
+        """
+        if baseurl is None:
+            if not os.path.exists(self.repomd):
+                return None
+            href = _get_locations(self.repomd).get(kind)
+            if href is None:
+                return None
+            return _open_metadata(os.path.join(self.path, href), href)
+
+        return self.driver.with_mirrors(baseurl, self._fetch_source, kind)
+
+    def _fetch_source(self, url, kind):
+        """Downloads the metadata of repository from the mirror.
+
+        :param url: the url of mirror
+        :param kind: the kind of metadata
+        :return: the stream or None, if metadata does not exist
+        """
+        repo_url = "/".join((url, self.reponame, self.driver.arch))
+        if url not in self.locations:
+            tmp = self.repomd + STAGED_SUFFIX
+            try:
+                self.driver.fetch(repo_url + "/repodata/repomd.xml", tmp)
+                self.locations[url] = _get_locations(tmp)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        href = self.locations[url].get(kind)
+        if href is None:
+            return None
+        tmp = os.path.join(
+            self.repodata, os.path.basename(href) + STAGED_SUFFIX
+        )
+        try:
+            self.driver.fetch(repo_url + "/" + href, tmp)
+            stream = _open_metadata(tmp, href)
+        finally:
+            # the opened file is readable after removing
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return stream
+
+    def _write_repomd(self, data):
+        """Replaces repomd.xml and removes outdated metadata.
+
+        :param data: the list of data elements
+        """
+        root = etree.Element(
+            "{%s}repomd" % _namespaces["md"],
+            nsmap={None: _namespaces["md"], "rpm": _namespaces["rpm"]}
+        )
+        etree.SubElement(
+            root, "{%s}revision" % _namespaces["md"]
+        ).text = six.text_type(int(time.time()))
+        root.extend(data)
+        with closing(open(self.repomd + _TMP_SUFFIX, "wb")) as stream:
+            etree.ElementTree(root).write(
+                stream, encoding="UTF-8", xml_declaration=True,
+                pretty_print=True
+            )
+        os.rename(self.repomd + _TMP_SUFFIX, self.repomd)
+
+        actual = set(
+            os.path.basename(x.find("./md:location", _namespaces)
+                             .attrib["href"])
+            for x in data
+        )
+        actual.add(os.path.basename(self.repomd))
+        for name in os.listdir(self.repodata):
+            if name not in actual and not name.endswith(STAGED_SUFFIX):
+                os.remove(os.path.join(self.repodata, name))
+                logger.info("the outdated metadata %s was removed.", name)
@@ -18,6 +18,7 @@ from __future__ import with_statement
 
 import logging
 import six
+import sys
 
 from eventlet.greenpool import GreenPool
 
@@ -41,10 +42,13 @@ class AsynchronousSection(object):
         self.executor = GreenPool(max(size, self.MIN_POOL_SIZE))
         self.ignore_errors_num = ignore_errors_num
         self.errors = 0
+        # the exc_info of the first failed task
+        self.failure = None
         self.tasks = set()
 
     def __enter__(self):
         self.errors = 0
+        self.failure = None
         return self
 
     def __exit__(self, etype, *_):
@@ -66,6 +70,8 @@ class AsynchronousSection(object):
             gt.wait()
         except Exception as e:
             self.errors += 1
+            if self.failure is None:
+                self.failure = sys.exc_info()
             logger.exception("Task failed: %s", six.text_type(e))
         finally:
             self.tasks.discard(gt)
@@ -168,6 +168,20 @@ class Index(object):
         :param master: packages from master is skipped
         :return: The set of resolved depends.
         """
+        return set(self.iter_resolve(requires, master))
+
+    def iter_resolve(self, requires, master=None):
+        """Resolves requirements lazily.
+
+        Each package is yielded as soon as it is resolved,
+        so the caller can process it while resolution continues.
+
+        :param requires: the set of requirements.
+            Note. This parameter will be updated,
+            when all packages are yielded.
+        :param master: packages from master is skipped
+        :return: The iterator over resolved depends.
+        """
 
         unresolved = set()
         resolved = set()
@@ -183,7 +197,11 @@ class Index(object):
 
         while len(stack) > 0:
             pkg, required = stack.pop()
+            if pkg in resolved:
+                continue
             resolved.add(pkg)
+            if pkg is not None:
+                yield pkg
             required = six.moves.filterfalse(unresolved.__contains__, required)
             for require in required:
                 rel = require
@@ -200,9 +218,7 @@ class Index(object):
                 if rel is None:
                     unresolved.add(require)
 
-        resolved.remove(None)
         requires.update(unresolved)
-        return resolved
 
     def _resolve_relation(self, relations, version):
         """Resolve relation according to relations map."""
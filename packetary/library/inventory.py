@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from collections import namedtuple
+import errno
+import logging
+import os
+import six
+import stat
+
+from eventlet import tpool
+
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
+
+logger = logging.getLogger(__package__)
+
+
+FileInfo = namedtuple("FileInfo", ("size", "mtime"))
+
+# the number of files, that are removed in one native thread
+REMOVE_BATCH_SIZE = 256
+
+
+def _listdir(path):
+    """Lists directory, yields tuples (name, path, is_dir, stat)."""
+    if _scandir is not None:
+        for entry in _scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                yield entry.name, entry.path, True, None
+            elif entry.is_file(follow_symlinks=False):
+                yield entry.name, entry.path, False, entry.stat()
+        return
+
+    for name in os.listdir(path):
+        filepath = os.path.join(path, name)
+        stats = os.lstat(filepath)
+        if stat.S_ISDIR(stats.st_mode):
+            yield name, filepath, True, None
+        elif stat.S_ISREG(stats.st_mode):
+            yield name, filepath, False, stats
+
+
+def _scan_tree(root):
+    """Collects information about all files in tree."""
+    files = dict()
+    dirs = [root]
+    while dirs:
+        path = dirs.pop()
+        try:
+            entries = list(_listdir(path))
+        except OSError as e:
+            if e.errno != 2:
+                raise
+            continue
+
+        for _, filepath, is_dir, stats in entries:
+            if is_dir:
+                dirs.append(filepath)
+            else:
+                files[os.path.normpath(filepath)] = FileInfo(
+                    stats.st_size, stats.st_mtime
+                )
+    return files
+
+
+class Inventory(object):
+    """The snapshot of files in local directory."""
+
+    def __init__(self, files=None):
+        self.files = files or dict()
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, path):
+        return os.path.normpath(path) in self.files
+
+    def get(self, path):
+        """Gets the information about file.
+
+        :param path: the full path of file
+        :return: FileInfo if file exists, otherwise None
+        """
+        return self.files.get(os.path.normpath(path))
+
+    def update(self, files):
+        self.files.update(files)
+
+
+def scan(root, scope):
+    """Builds the inventory of files in directory.
+
+    Each top-level directory is scanned in the separate thread,
+    so slow file systems (like NFS) are processed in parallel.
+
+    :param root: the path to directory
+    :param scope: the asynchronous section to execute tasks
+    :return: the Inventory object
+    """
+    inventory = Inventory()
+    try:
+        entries = list(_listdir(root))
+    except OSError as e:
+        if e.errno != 2:
+            raise
+        return inventory
+
+    logger.info("scan directory: %s", root)
+    with scope:
+        for _, path, is_dir, stats in entries:
+            if is_dir:
+                scope.execute(
+                    lambda x: inventory.update(tpool.execute(_scan_tree, x)),
+                    path
+                )
+            else:
+                inventory.update({
+                    os.path.normpath(path): FileInfo(
+                        stats.st_size, stats.st_mtime
+                    )
+                })
+    logger.info("found %d files in %s.", len(inventory), root)
+    return inventory
+
+
+def _remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+def remove(files, scope, dry_run=False):
+    """Removes files in batches.
+
+    Each batch is removed in the separate thread, so slow file systems
+    (like NFS) process several batches in parallel.
+
+    :param files: the dict(path -> FileInfo) of files to remove
+    :param scope: the asynchronous section to execute tasks
+    :param dry_run: if True, the files are reported, but not removed
+    :return: tuple(the number of files, the size of them)
+    """
+    paths = sorted(files)
+    size = sum(x.size for x in six.itervalues(files))
+    if dry_run:
+        for path in paths:
+            logger.info("File %s would be removed.", path)
+        logger.info(
+            "%d files (%d bytes) would be removed.", len(paths), size
+        )
+        return len(paths), size
+
+    with scope:
+        for i in six.moves.range(0, len(paths), REMOVE_BATCH_SIZE):
+            scope.execute(
+                lambda x: tpool.execute(_remove_files, x),
+                paths[i:i + REMOVE_BATCH_SIZE]
+            )
+    logger.info("%d files (%d bytes) were removed.", len(paths), size)
+    return len(paths), size
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import logging
+import os
+
+
+logger = logging.getLogger(__package__)
+
+
+class Journal(object):
+    """The log of mirror run, that allows to resume it after crash.
+
+    The journal is a file with one json record per line:
+    the header with the key of run, the planned files
+    and the started and completed transfers.
+    """
+
+    FILENAME = ".packetary-journal"
+
+    def __init__(self, destination, key):
+        """Initialises.
+
+        :param destination: the destination folder
+        :param key: the json-serializable arguments of run,
+            the journal is resumed only for the same arguments.
+        """
+        self.path = os.path.join(destination, self.FILENAME)
+        self.key = json.loads(json.dumps(key))
+        self.planned = dict()
+        self.started = set()
+        self.completed = set()
+        self.stream = None
+
+    def load(self):
+        """Loads the journal of interrupted run.
+
+        :return: True if there is the plan to resume, otherwise False
+        """
+        try:
+            stream = open(self.path, "r")
+        except IOError as e:
+            if e.errno != 2:
+                raise
+            return False
+
+        with stream:
+            records = self._read_records(stream)
+            header = next(records, None)
+            if header is None or header.get("key") != self.key:
+                logger.info("journal %s is out of date.", self.path)
+                return False
+            for record in records:
+                op = record["op"]
+                if op == "plan":
+                    self.planned[record["path"]] = record["size"]
+                elif op == "start":
+                    self.started.add(record["path"])
+                elif op == "done":
+                    self.completed.add(record["path"])
+
+        logger.info(
+            "resume from journal: %d files planned, %d completed.",
+            len(self.planned), len(self.completed)
+        )
+        return len(self.planned) > 0
+
+    def plan(self, files):
+        """Records the planned files.
+
+        Does nothing but opens journal for appending,
+        if the plan has been loaded already. The plan is appended
+        to the transfers of run, that was started without plan.
+
+        :param files: the sequence of tuples(path, size, checksum)
+        """
+        if self.planned:
+            self.stream = open(self.path, "a")
+            return
+
+        if self.started:
+            self.stream = open(self.path, "a")
+        else:
+            directory = os.path.dirname(self.path)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            self.stream = open(self.path, "w")
+            self._write({"key": self.key})
+        for path, size, checksum in files:
+            self.planned[path] = size
+            self._write({
+                "op": "plan", "path": path, "size": size,
+                "checksum": list(checksum)
+            })
+
+    def is_planned(self, path):
+        return path in self.planned
+
+    def is_completed(self, path):
+        return path in self.completed
+
+    def is_interrupted(self, path):
+        """Checks that transfer was started, but was not completed."""
+        return path in self.started and path not in self.completed
+
+    def start(self, path):
+        """Records that the transfer is started."""
+        self.started.add(path)
+        self._write({"op": "start", "path": path})
+
+    def done(self, path):
+        """Records that the transfer is completed."""
+        self.completed.add(path)
+        self._write({"op": "done", "path": path})
+
+    def close(self):
+        """Removes the journal, when run completed successfully."""
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _write(self, record):
+        if self.stream is not None:
+            self.stream.write(json.dumps(record))
+            self.stream.write("\n")
+            self.stream.flush()
+
+    @staticmethod
+    def _read_records(stream):
+        for line in stream:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # the last record may be incomplete after crash
+                logger.warning("skip malformed record in journal: %s", line)
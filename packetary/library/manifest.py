@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import errno
+import json
+import logging
+import os
+import six
+
+
+logger = logging.getLogger(__package__)
+
+
+_ManifestEntryBase = collections.namedtuple(
+    "ManifestEntry",
+    ("name", "version", "filename", "size", "checksum", "offset", "length")
+)
+
+
+class ManifestEntry(_ManifestEntryBase):
+    """The package, that is published in the mirror.
+
+    The offset and length are the position of package`s record
+    in the uncompressed index, if the index is the text file.
+    """
+
+    @classmethod
+    def from_package(cls, package, offset=None, length=None):
+        return cls(
+            package.name, six.text_type(package.version), package.filename,
+            package.size, tuple(package.checksum), offset, length
+        )
+
+
+class Manifest(object):
+    """The list of packages, that are published in the mirror.
+
+    The manifest is kept near index and describes it, so the index
+    writer does not need to parse own index on next run. The manifest
+    is valid only while the index file is not changed by someone else.
+    """
+
+    FILENAME = ".packetary-manifest"
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, path, index):
+        """Initialises.
+
+        :param path: the folder to keep the manifest
+        :param index: the path of index file, that is described
+        """
+        self.path = os.path.join(path, self.FILENAME)
+        self.index = index
+
+    def load(self):
+        """Loads the manifest.
+
+        :return: the list of ManifestEntry or None,
+                 if manifest does not exist or is out of date
+        """
+        try:
+            stream = open(self.path, "r")
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+
+        with stream:
+            try:
+                header = json.loads(stream.readline())
+                current = self._get_header()
+                if current is None or header != current:
+                    logger.info("manifest %s is out of date.", self.path)
+                    return None
+                entries = []
+                for line in stream:
+                    record = json.loads(line)
+                    record[4] = tuple(record[4])
+                    entries.append(ManifestEntry(*record))
+            except (ValueError, TypeError, IndexError):
+                logger.warning("manifest %s is malformed.", self.path)
+                return None
+        return entries
+
+    def save(self, entries):
+        """Saves the manifest for the current state of index.
+
+        :param entries: the sequence of ManifestEntry
+        """
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as stream:
+            stream.write(json.dumps(self._get_header()))
+            stream.write("\n")
+            for entry in entries:
+                stream.write(json.dumps(list(entry)))
+                stream.write("\n")
+        os.rename(tmp, self.path)
+
+    def _get_header(self):
+        try:
+            stats = os.stat(self.index)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        return {
+            "version": self.FORMAT_VERSION,
+            "size": stats.st_size,
+            "mtime": stats.st_mtime,
+        }
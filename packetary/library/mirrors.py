@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import logging
+
+
+logger = logging.getLogger(__package__)
+
+
+class Mirror(object):
+    """The statistics of mirror."""
+
+    # the weight of last measurement in average throughput
+    SMOOTHING = 0.3
+
+    def __init__(self, url):
+        self.url = url
+        self.throughput = None
+        self.failures = 0
+
+    @property
+    def score(self):
+        """The higher score is better.
+
+        The mirror that was not used yet has the highest score,
+        so each mirror is probed by the first downloads.
+        """
+        if self.throughput is None:
+            return float("inf")
+        return self.throughput / (1 + self.failures)
+
+    def on_success(self, size, duration):
+        """Updates statistics, when the download succeeded.
+
+        :param size: the number of bytes, None if it is unknown
+        :param duration: the duration of download in seconds
+        """
+        if size is None:
+            self.failures = 0
+            return
+        throughput = size / max(duration, 0.001)
+        if self.throughput is None:
+            self.throughput = throughput
+        else:
+            self.throughput += self.SMOOTHING * (throughput - self.throughput)
+        self.failures = 0
+
+    def on_failure(self):
+        """Updates statistics, when the download failed."""
+        self.failures += 1
+        if self.throughput is None:
+            self.throughput = 0.0
+
+
+class MirrorsRegistry(object):
+    """Tracks the groups of equivalent mirrors."""
+
+    SEPARATOR = "|"
+
+    def __init__(self):
+        self.groups = dict()
+        self.mirrors = dict()
+
+    def split(self, url):
+        """Splits url to the list of equivalent urls."""
+        return [x.strip() for x in url.split(self.SEPARATOR) if x.strip()]
+
+    def register(self, urls):
+        """Registers the group of equivalent mirrors.
+
+        :param urls: the list of base urls
+        :return: the first url, that is used to identify group
+        """
+        canonical = urls[0]
+        group = self.groups.setdefault(canonical, [])
+        for url in urls:
+            if url not in self.mirrors:
+                self.mirrors[url] = Mirror(url)
+            if url not in group:
+                group.append(url)
+        return canonical
+
+    def candidates(self, baseurl):
+        """Gets the mirrors ordered from the best to the worst.
+
+        :param baseurl: the url, that identifies group of mirrors
+        :return: the list of base urls
+        """
+        group = self.groups.get(baseurl)
+        if not group:
+            return [baseurl]
+        return sorted(group, key=lambda x: self.mirrors[x].score, reverse=True)
+
+    def on_success(self, url, size, duration):
+        """Notifies that download from mirror succeeded."""
+        mirror = self.mirrors.get(url)
+        if mirror is not None:
+            mirror.on_success(size, duration)
+
+    def on_failure(self, url):
+        """Notifies that download from mirror failed."""
+        mirror = self.mirrors.get(url)
+        if mirror is not None:
+            mirror.on_failure()
+            logger.warning(
+                "mirror %s failed %d time(s).", url, mirror.failures
+            )
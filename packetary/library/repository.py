@@ -14,16 +14,40 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import eventlet
 import logging
 import os
+import six
+import time
 
+from packetary.library import checksum
+from packetary.library.connections import get_local_path
+from packetary.library.connections import PART_SUFFIX
+from packetary.library.connections import RangeError
+from packetary.library.connections import RETRYABLE_ERRORS
 from packetary.library import drivers as _drivers
+from packetary.library import inventory
+from packetary.library.scheduler import Scheduler
+from packetary.library import utils
 
 
 logger = logging.getLogger(__package__)
 
 
+def _get_file_size(path):
+    """Gets the size of file, 0 if file does not exist."""
+    try:
+        return os.path.getsize(path)
+    except OSError as e:
+        if e.errno != 2:
+            raise
+    return 0
+
+
 class Repository(object):
+    # the max number of loaded packages, that are waiting for copying
+    STREAM_QUEUE_SIZE = 1000
+
     def __init__(self, context, kind, arch, drivers=_drivers):
         self.context = context
         try:
@@ -42,37 +66,355 @@ class Repository(object):
             for url, repo in self.driver.parse_urls(urls):
                 scope.execute(self.driver.load, url, repo, consumer)
 
-    def copy_packages(self, producer, destination, keep_existing):
-        """Copies packages to specified directory."""
+    def iter_packages(self, urls):
+        """Loads packages in background and yields them as they are parsed.
+
+        The loading is paused if consumer does not keep up with it.
+        """
+        queue = eventlet.queue.Queue(self.STREAM_QUEUE_SIZE)
+        eof = object()
+
+        def load():
+            try:
+                self.load_packages(urls, queue.put)
+            finally:
+                queue.put(eof)
+
+        loader = eventlet.spawn(load)
+        try:
+            while 1:
+                package = queue.get()
+                if package is eof:
+                    break
+                yield package
+            # raises the error of loader if any
+            loader.wait()
+        finally:
+            loader.kill()
+
+    def copy_packages(self, producer, destination, keep_existing,
+                      scheduler=None, journal=None, passthrough=False):
+        """Copies packages to specified directory.
+
+        :param producer: the sequence of packages
+        :param destination: the destination folder
+        :param keep_existing: keep packages that are not in producer
+        :param scheduler: the Scheduler to order downloads
+        :param journal: the Journal to record progress
+        :param passthrough: publish the upstream indexes as is,
+            if producer contains all packages from origin
+        """
+
+        if scheduler is None:
+            scheduler = Scheduler()
+
+        index_writer = self.driver.create_index(destination, passthrough)
+        existing = inventory.scan(destination, self.context.async_section())
+        tasks = []
+        planned = []
+        checksums = dict()
+        for package in producer:
+            index_writer.add(package)
+            dst_path = self.driver.get_path(destination, package)
+            if not self._is_first_occurrence(checksums, package, dst_path):
+                continue
+            planned.append((dst_path, package.size, package.checksum))
+            offset = self._get_offset(package, dst_path, existing, journal)
+            if offset is not None:
+                tasks.append((package, offset))
 
-        index_writer = self.driver.create_index(destination)
+        if journal is not None:
+            journal.plan(planned)
+
+        with self.context.async_section() as scope:
+            for package, offset in scheduler.plan(tasks):
+                scope.execute(
+                    self._copy_scheduled,
+                    scheduler, journal, package, destination, offset
+                )
+        self._complete_copy(scheduler, index_writer, destination,
+                            keep_existing)
+
+    def copy_packages_streaming(self, producer, destination, keep_existing,
+                                scheduler=None, journal=None,
+                                passthrough=False):
+        """Copies packages as soon as they are produced.
+
+        Unlike copy_packages, the downloads are started while
+        producer is being consumed, so they are not ordered and
+        the plan is not recorded to journal, only the transfers.
+
+        :param producer: the sequence of packages
+        :param destination: the destination folder
+        :param keep_existing: keep packages that are not in producer
+        :param scheduler: the Scheduler to track progress
+        :param journal: the Journal to record transfers
+        :param passthrough: publish the upstream indexes as is,
+            if producer contains all packages from origin
+        :return: the number of packages
+        """
+        if scheduler is None:
+            scheduler = Scheduler()
+
+        index_writer = self.driver.create_index(destination, passthrough)
+        existing = inventory.scan(destination, self.context.async_section())
+        checksums = dict()
+        count = 0
+        scheduler.start()
+        if journal is not None:
+            journal.plan([])
         with self.context.async_section() as scope:
             for package in producer:
-                scope.execute(self._copy_package, package, destination)
+                count += 1
                 index_writer.add(package)
+                dst_path = self.driver.get_path(destination, package)
+                if not self._is_first_occurrence(checksums, package,
+                                                 dst_path):
+                    continue
+                offset = self._get_offset(
+                    package, dst_path, existing, journal
+                )
+                if offset is not None:
+                    scheduler.add((package, offset))
+                    # blocks if all workers are busy
+                    scope.execute(
+                        self._copy_scheduled,
+                        scheduler, journal, package, destination, offset
+                    )
+        self._complete_copy(scheduler, index_writer, destination,
+                            keep_existing)
+        return count
+
+    @staticmethod
+    def _is_first_occurrence(checksums, package, dst_path):
+        """Checks that file is not copied yet.
+
+        The same file can be listed in several indexes,
+        it is copied only once.
+        """
+        if dst_path in checksums:
+            if checksums[dst_path] != package.checksum:
+                logger.warning(
+                    "file %s has different checksums in indexes, "
+                    "the first one is used.", dst_path
+                )
+            return False
+        checksums[dst_path] = package.checksum
+        return True
+
+    def _complete_copy(self, scheduler, index_writer, destination,
+                       keep_existing):
+        """Flushes the copied files and updates index."""
+        scheduler.report()
+        if self.context.durability == "batch" and os.path.exists(destination):
+            logger.info("flush downloaded files to disk: %s", destination)
+            utils.syncfs(destination)
         index_writer.commit(keep_existing)
 
-    def _copy_package(self, package, destination):
-        """Synchronises remote file to local fs."""
+    def _get_offset(self, package, dst_path, existing, journal=None):
+        """Gets the offset to resume download from.
+
+        The partially downloaded data is kept in the file with PART_SUFFIX.
+
+        :return: the offset or None if file is same
+        """
+        info = existing.get(dst_path)
+        if info is not None and info.size == package.size:
+            if journal is not None and journal.is_interrupted(dst_path):
+                # the transfer was interrupted before it was recorded
+                # as completed, so the size is not trustworthy
+                if not self._is_valid(package, dst_path):
+                    return 0
+            logger.info("file %s is same.", dst_path)
+            return None
+        info = existing.get(dst_path + PART_SUFFIX)
+        if info is not None and info.size < package.size:
+            return info.size
+        return 0
+
+    def _copy_scheduled(self, scheduler, journal, package, destination,
+                        offset):
+        """Copies package, records progress and notifies scheduler."""
+        dst_path = self.driver.get_path(destination, package)
+        if journal is not None:
+            journal.start(dst_path)
+        store = self.context.store
+        if store is None or not store.link(package.checksum, dst_path):
+            self._copy_package(package, destination, offset)
+            if not self._is_valid(package, dst_path):
+                logger.warning(
+                    "the file %s is corrupted, download again.", dst_path
+                )
+                self._copy_package(package, destination, 0)
+                try:
+                    self._verify_checksum(package, dst_path)
+                except IOError:
+                    # the file of same size is not downloaded again
+                    os.remove(dst_path)
+                    raise
+            if store is not None:
+                store.add(package.checksum, dst_path)
+        if journal is not None:
+            journal.done(dst_path)
+        scheduler.on_complete(package.size - offset)
+
+    def _copy_package(self, package, destination, offset=0):
+        """Synchronises remote file to local fs.
+
+        The package is downloaded from the best of equivalent mirrors,
+        if download fails it is continued from the next mirror.
+        """
         connections = self.context.connections
-        offset = 0
+        mirrors = self.context.mirrors
         dst_path = self.driver.get_path(destination, package)
-        src_path = self.driver.get_path(package.baseurl, package)
-        try:
-            stats = os.stat(dst_path)
-            if stats.st_size == package.size:
-                logger.info("file %s is same.", dst_path)
+        segmented = self._is_segmented(package, offset)
+        candidates = mirrors.candidates(package.baseurl)
+        for idx, baseurl in enumerate(candidates, start=1):
+            src_path = self.driver.get_path(baseurl, package)
+            logger.info(
+                "download: %s - %s, offset: %d",
+                src_path, dst_path, offset
+            )
+            start_time = time.time()
+            try:
+                with connections.get(url=src_path) as connection:
+                    if segmented and get_local_path(src_path) is None:
+                        self._retrieve_segmented(
+                            connection, package, src_path, dst_path
+                        )
+                    else:
+                        connection.retrieve(
+                            src_path, dst_path, offset, package.size
+                        )
+            except RETRYABLE_ERRORS as e:
+                mirrors.on_failure(baseurl)
+                if idx == len(candidates):
+                    raise
+                if not segmented:
+                    offset = _get_file_size(dst_path + PART_SUFFIX)
+                logger.warning(
+                    "failed to download %s: %s, try next mirror.",
+                    src_path, six.text_type(e)
+                )
+            else:
+                mirrors.on_success(
+                    baseurl, package.size - offset,
+                    time.time() - start_time
+                )
                 return
 
-            if stats.st_size < package.size:
-                offset = stats.st_size
-        except OSError as e:
-            if e.errno != 2:
-                raise
+    def _is_segmented(self, package, offset):
+        """Checks that package should be downloaded by segments."""
+        if offset != 0 or self.context.segment_count < 2:
+            return False
+        return 0 < self.context.segment_threshold <= package.size
+
+    def _retrieve_segmented(self, connection, package, src_path, dst_path):
+        """Downloads the byte ranges of file via several connections.
+
+        Only the connections, that are free right now, are taken for
+        additional ranges, because waiting for connections, which are
+        held by other transfers, can deadlock.
+        """
+        extra = self._get_free_connections(
+            src_path, self.context.segment_count - 1
+        )
+        try:
+            if not extra:
+                logger.info(
+                    "there is no free connections, "
+                    "download in single stream: %s", src_path
+                )
+                connection.retrieve(src_path, dst_path, 0, package.size)
+            else:
+                self._retrieve_ranges(
+                    [connection] + [x.__enter__() for x in extra],
+                    package, src_path, dst_path
+                )
+        finally:
+            for context in extra:
+                context.__exit__(None, None, None)
+
+    def _get_free_connections(self, url, count):
+        """Takes up to count connections without waiting.
+
+        :return: the list of ConnectionContext
+        """
+        contexts = []
+        while len(contexts) < count:
+            try:
+                contexts.append(
+                    self.context.connections.get(timeout=0, url=url)
+                )
+            except six.moves.queue.Empty:
+                break
+        return contexts
+
+    def _retrieve_ranges(self, connections, package, src_path, dst_path):
+        """Downloads the ranges of file, one range per connection.
+
+        :param connections: the list of connections,
+            the first one is used to open the first range
+        """
+        connection = connections[0]
+        size = package.size
+        segment = -(-size // len(connections))
+        ranges = [
+            (x, min(x + segment, size) - 1)
+            for x in six.moves.range(0, size, segment)
+        ]
+        try:
+            stream = connection.open_stream(src_path, 0, ranges[0][1])
+        except RangeError:
+            logger.warning(
+                "Server does not support ranges, "
+                "download in single stream: %s", src_path
+            )
+            connection.retrieve(src_path, dst_path, 0, size)
+            return
 
         logger.info(
-            "download: %s - %s, offset: %d",
-            src_path, dst_path, offset
+            "download %s in %d segments.", src_path, len(ranges)
         )
-        with connections.get() as connection:
-            connection.retrieve(src_path, dst_path, offset)
+        tmp = dst_path + PART_SUFFIX
+        fd = connection.open_file(tmp, size)
+        try:
+            with self.context.async_section(0) as scope:
+                for (start, end), other in zip(ranges[1:], connections[1:]):
+                    scope.execute(
+                        other.retrieve_range, src_path, fd, start, end
+                    )
+                connection.retrieve_range(
+                    src_path, fd, ranges[0][0], ranges[0][1], stream
+                )
+        except RuntimeError as e:
+            raise IOError(six.text_type(e))
+        finally:
+            if connection.sync_files:
+                os.fsync(fd)
+            os.close(fd)
+        self._verify_checksum(package, tmp)
+        os.rename(tmp, dst_path)
+
+    def _is_valid(self, package, path):
+        """Checks that local file has same checksum as package."""
+        try:
+            self._verify_checksum(package, path)
+        except IOError as e:
+            logger.warning(six.text_type(e))
+            return False
+        return True
+
+    @staticmethod
+    def _verify_checksum(package, path):
+        """Checks that checksum of local file matches package`s one."""
+        algorithm, expected = package.checksum
+        if algorithm is None:
+            return
+        with open(path, "rb") as stream:
+            actual = checksum.get(algorithm)(stream)
+        if actual != expected:
+            raise IOError(
+                "Checksum mismatch for {0}: expected {1}, actual {2}"
+                .format(path, expected, actual)
+            )
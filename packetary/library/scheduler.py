@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from collections import OrderedDict
+import logging
+import six
+import six.moves.urllib.parse as urlparse
+import time
+
+
+logger = logging.getLogger(__package__)
+
+
+def _get_size(task):
+    package, offset = task
+    return package.size - offset
+
+
+def _index_order(tasks, _):
+    """Keeps the order of index."""
+    return tasks
+
+
+def _largest_first(tasks, _):
+    """The biggest files are started first to minimize the tail."""
+    return sorted(tasks, key=_get_size, reverse=True)
+
+
+def _priority_first(tasks, priority):
+    """The packages from priority list are started first."""
+    first = []
+    last = []
+    for task in tasks:
+        if task[0].name in priority:
+            first.append(task)
+        else:
+            last.append(task)
+    return first + last
+
+
+def _round_robin(tasks, _):
+    """Interleaves the packages from different hosts."""
+    hosts = OrderedDict()
+    for task in tasks:
+        host = urlparse.urlparse(task[0].baseurl).netloc
+        hosts.setdefault(host, []).append(task)
+
+    result = []
+    for group in six.moves.zip_longest(*six.itervalues(hosts)):
+        result.extend(x for x in group if x is not None)
+    return result
+
+
+class Scheduler(object):
+    """Orders downloads and tracks progress."""
+
+    policies = {
+        "index": _index_order,
+        "largest-first": _largest_first,
+        "bootstrap-first": _priority_first,
+        "round-robin": _round_robin,
+    }
+
+    DEFAULT_POLICY = "index"
+
+    # the part of work, that should be done to predict completion time
+    PREDICTION_THRESHOLD = 0.1
+
+    def __init__(self, policy=None, priority=None):
+        """Initialises.
+
+        :param policy: the name of ordering policy
+        :param priority: the names of packages, that should be copied first
+        """
+        policy = policy or self.DEFAULT_POLICY
+        try:
+            self.policy = self.policies[policy]
+        except KeyError:
+            raise ValueError(
+                "Unsupported download order: {0}".format(policy)
+            )
+        self.priority = frozenset(priority or ())
+        self.total = 0
+        self.done = 0
+        self.start_time = None
+        self.predicted = None
+
+    def prioritize(self, names):
+        """Sets the packages, that should be copied first.
+
+        :param names: the names of packages
+        """
+        self.priority = frozenset(names)
+
+    def plan(self, tasks):
+        """Orders the tasks according to policy.
+
+        :param tasks: the list of tuples(package, offset)
+        :return: the ordered list of tasks
+        """
+        self._reset(sum(six.moves.map(_get_size, tasks)))
+        logger.info(
+            "scheduled %d files, %d bytes to download.",
+            len(tasks), self.total
+        )
+        return self.policy(tasks, self.priority)
+
+    def start(self):
+        """Starts tracking progress without plan.
+
+        The tasks are not ordered, they are added via add
+        as soon as they are produced.
+        """
+        self._reset(0)
+        logger.info("the files are scheduled as soon as they are listed.")
+
+    def add(self, task):
+        """Adds the task, that is started without plan.
+
+        :param task: the tuple(package, offset)
+        """
+        self.total += _get_size(task)
+
+    def _reset(self, total):
+        self.total = total
+        self.done = 0
+        self.predicted = None
+        self.start_time = time.time()
+
+    def on_complete(self, size):
+        """Updates progress, when download is completed.
+
+        :param size: the number of downloaded bytes
+        """
+        self.done += size
+        if self.predicted is None and \
+                self.done >= self.total * self.PREDICTION_THRESHOLD > 0:
+            elapsed = time.time() - self.start_time
+            self.predicted = elapsed * self.total / self.done
+            logger.info(
+                "predicted completion time: %.1f seconds.", self.predicted
+            )
+
+    def report(self):
+        """Reports predicted versus actual completion time.
+
+        :return: tuple(predicted, actual) in seconds
+        """
+        actual = time.time() - (self.start_time or time.time())
+        if self.predicted is not None:
+            logger.info(
+                "download completed in %.1f seconds, predicted: %.1f.",
+                actual, self.predicted
+            )
+        else:
+            logger.info("download completed in %.1f seconds.", actual)
+        return self.predicted, actual
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import errno
+import logging
+import os
+
+
+logger = logging.getLogger(__package__)
+
+
+class PackageStore(object):
+    """The content-addressed storage of package files.
+
+    The files are stored by checksum and hard-linked to destinations,
+    so the same file is kept on disk only once. The number of links
+    is the reference counter, the file that has only one link
+    is not used by any mirror and can be removed.
+    """
+
+    def __init__(self, root):
+        """Initialises.
+
+        :param root: the path to the storage folder
+        """
+        self.root = os.path.abspath(root)
+
+    def get_path(self, checksum):
+        """Gets the path of file in storage.
+
+        :param checksum: the tuple(algorithm, checksum)
+        :return: the path or None if checksum is unknown
+        """
+        algorithm, value = checksum
+        if not algorithm or not value:
+            return None
+        return os.path.join(self.root, algorithm.lower(), value[:2], value)
+
+    def link(self, checksum, path):
+        """Makes the link to stored file.
+
+        :param checksum: the tuple(algorithm, checksum)
+        :param path: the path of link
+        :return: True if file is linked, False if it is not stored
+        """
+        stored = self.get_path(checksum)
+        if stored is None or not os.path.exists(stored):
+            return False
+
+        tmp = path + ".tmp"
+        _ensure_dir_exists(path)
+        try:
+            _remove(tmp)
+            os.link(stored, tmp)
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                logger.warning(
+                    "The storage %s and %s are on different devices.",
+                    self.root, path
+                )
+                return False
+            raise
+        os.rename(tmp, path)
+        logger.info("file %s is linked from storage.", path)
+        return True
+
+    def add(self, checksum, path):
+        """Adds the file to storage.
+
+        :param checksum: the tuple(algorithm, checksum)
+        :param path: the path to file, that has this checksum
+        """
+        stored = self.get_path(checksum)
+        if stored is None or os.path.exists(stored):
+            return
+        _ensure_dir_exists(stored)
+        try:
+            os.link(path, stored)
+        except OSError as e:
+            if e.errno not in (errno.EEXIST, errno.EXDEV):
+                raise
+
+    def collect_garbage(self):
+        """Removes files, that are not linked to any mirror.
+
+        :return: tuple(the number of removed files, the size of them)
+        """
+        count = 0
+        size = 0
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(root, name)
+                stats = os.lstat(path)
+                if stats.st_nlink == 1:
+                    os.remove(path)
+                    count += 1
+                    size += stats.st_size
+        logger.info(
+            "%d files (%d bytes) were removed from storage %s.",
+            count, size, self.root
+        )
+        return count, size
+
+
+def _ensure_dir_exists(path):
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
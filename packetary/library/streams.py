@@ -14,6 +14,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
 import zlib
 
 
@@ -27,70 +28,118 @@ class StreamWrapper(object):
     next read.
     """
 
-    CHUNK_SIZE = 1024
+    CHUNK_SIZE = 64 * 1024
 
-    def __init__(self, stream):
+    def __init__(self, stream, chunk_size=None):
         """Initializes.
 
         :param stream: file-like object opened in binary mode.
+        :param chunk_size: the number of bytes to read from stream at once
         """
         self.stream = stream
-        self.unread_tail = b""
+        self.buffer = b""
+        # the position of first unread byte in buffer,
+        # the buffer is not copied on each read
+        self.position = 0
+        if chunk_size is not None:
+            self.CHUNK_SIZE = chunk_size
 
     def __getattr__(self, item):
         return getattr(self.stream, item)
 
-    def _read_tail(self):
-        tmp = self.unread_tail
-        self.unread_tail = b""
-        return tmp
-
-    def _align_chunk(self, chunk, size):
-        self.unread_tail = chunk[size:]
-        return chunk[:size]
+    @property
+    def unread_tail(self):
+        """The data, that has been read from stream, but not consumed."""
+        return self.buffer[self.position:]
+
+    def _buffered(self):
+        return len(self.buffer) - self.position
+
+    def _consume(self, size):
+        """Takes size bytes from the buffer."""
+        start = self.position
+        self.position += size
+        if self.position >= len(self.buffer):
+            data = self.buffer[start:] if start else self.buffer
+            self.buffer = b""
+            self.position = 0
+            return data
+        return self.buffer[start:self.position]
+
+    def _fill(self, chunk):
+        """Appends chunk to the buffer, drops the consumed data."""
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
 
     def read_chunk(self, chunksize):
         """Overrides this method to change default behaviour."""
         return self.stream.read(chunksize)
 
     def read(self, size=-1):
-        result = self._read_tail()
         if size < 0:
+            chunks = [self._consume(self._buffered())]
             while True:
                 chunk = self.read_chunk(self.CHUNK_SIZE)
                 if not chunk:
                     break
-                result += chunk
-        else:
-            if len(result) > size:
-                result = self._align_chunk(result, size)
-            size -= len(result)
-            while size > 0:
-                chunk = self.read_chunk(max(self.CHUNK_SIZE, size))
-                if not chunk:
-                    break
-                if len(chunk) > size:
-                    chunk = self._align_chunk(chunk, size)
-                size -= len(chunk)
-                result += chunk
-        return result
+                chunks.append(chunk)
+            return b"".join(chunks)
+
+        chunks = [self._consume(min(size, self._buffered()))]
+        size -= len(chunks[0])
+        while size > 0:
+            chunk = self.read_chunk(max(self.CHUNK_SIZE, size))
+            if not chunk:
+                break
+            if len(chunk) > size:
+                self._fill(chunk[size:])
+                chunk = chunk[:size]
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def readinto(self, b):
+        """Reads data into the pre-allocated writable buffer.
+
+        :param b: the bytearray or memoryview
+        :return: the number of read bytes, 0 if eof is reached
+        """
+        view = memoryview(b)
+        size = len(view)
+        if not self._buffered():
+            chunk = self.read_chunk(size)
+            if len(chunk) > size:
+                self._fill(chunk[size:])
+                chunk = chunk[:size]
+            view[:len(chunk)] = chunk
+            return len(chunk)
+
+        size = min(size, self._buffered())
+        view[:size] = memoryview(self.buffer)[
+            self.position:self.position + size
+        ]
+        self._consume(size)
+        return size
 
     def readline(self):
-        pos = self.unread_tail.find(b"\n")
+        buffer = self.buffer
+        start = self.position
+        pos = buffer.find(b"\n", start)
         if pos >= 0:
-            line = self._align_chunk(self.unread_tail, pos + 1)
-        else:
-            line = self._read_tail()
-            while True:
-                chunk = self.read_chunk(self.CHUNK_SIZE)
-                if not chunk:
-                    break
-                pos = chunk.find(b"\n")
-                if pos >= 0:
-                    line += self._align_chunk(chunk, pos + 1)
-                    break
-                line += chunk
-        return line
+            self.position = pos + 1
+            return buffer[start:self.position]
+
+        # the number of buffered bytes, that do not contain end of line
+        checked = len(buffer) - start
+        while True:
+            chunk = self.read_chunk(self.CHUNK_SIZE)
+            if not chunk:
+                return self._consume(self._buffered())
+            self._fill(chunk)
+            pos = self.buffer.find(b"\n", checked)
+            if pos >= 0:
+                return self._consume(pos + 1)
+            checked = len(self.buffer)
 
     def readlines(self):
         while True:
@@ -106,20 +155,49 @@ class StreamWrapper(object):
 class GzipDecompress(StreamWrapper):
     """The decompress stream."""
 
-    def __init__(self, stream):
-        super(GzipDecompress, self).__init__(stream)
+    def __init__(self, stream, chunk_size=None):
+        super(GzipDecompress, self).__init__(stream, chunk_size)
         # Magic parameter makes zlib module understand gzip header
         # http://stackoverflow.com/questions/1838699/how-can-i-decompress-a-gzip-stream-with-zlib
         # This works on cpython and pypy, but not jython.
         self.decompress = zlib.decompressobj(16 + zlib.MAX_WBITS)
 
     def read_chunk(self, chunksize):
-        if self.decompress.unconsumed_tail:
-            return self.decompress.decompress(
-                self.decompress.unconsumed_tail, chunksize
-            )
-
-        chunk = self.stream.read(chunksize)
-        if not chunk:
-            return self.decompress.flush()
-        return self.decompress.decompress(chunk, chunksize)
+        while True:
+            chunk = self.decompress.unconsumed_tail
+            if not chunk:
+                chunk = self.stream.read(chunksize)
+                if not chunk:
+                    return self.decompress.flush()
+            # the compressed chunk may contain only header,
+            # the empty result means end of stream for reader
+            data = self.decompress.decompress(chunk, chunksize)
+            if data:
+                return data
+
+
+class HashingWriter(object):
+    """The stream, that calculates checksums of written data."""
+
+    def __init__(self, stream, algorithms):
+        """Initializes.
+
+        :param stream: file-like object opened in binary mode.
+        :param algorithms: the names of checksum algorithms
+        """
+        self.stream = stream
+        self.hashes = [hashlib.new(x) for x in algorithms]
+        self.size = 0
+
+    def __getattr__(self, item):
+        return getattr(self.stream, item)
+
+    def write(self, data):
+        self.stream.write(data)
+        for h in self.hashes:
+            h.update(data)
+        self.size += len(data)
+
+    def hexdigest(self):
+        """Gets the checksums of written data."""
+        return [h.hexdigest() for h in self.hashes]
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import logging
+import os
+
+
+logger = logging.getLogger(__package__)
+
+
+# do not change the size of file, only reserve the space
+_FALLOC_FL_KEEP_SIZE = 1
+
+# ioctl to share the data blocks between files (reflink)
+_FICLONE = 0x40049409
+
+# the max number of bytes to copy by one system call
+_COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+# the size of buffer to copy data via userspace
+_BUFFER_SIZE = 1024 * 1024
+
+
+def _load_libc():
+    try:
+        return ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except (OSError, TypeError):
+        return None
+
+
+_libc = _load_libc()
+
+
+def _get_libc_function(names, argtypes):
+    for name in names:
+        func = getattr(_libc, name, None)
+        if func is not None:
+            func.argtypes = argtypes
+            return func
+    return None
+
+
+_fallocate = _get_libc_function(
+    ("fallocate64", "fallocate"),
+    [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+)
+
+_syncfs = _get_libc_function(("syncfs",), [ctypes.c_int])
+
+
+def preallocate(fd, offset, length):
+    """Reserves the space for file on disk.
+
+    The size of file is not changed, so the size of partially
+    downloaded file is still the number of received bytes.
+
+    :param fd: the file`s descriptor
+    :param offset: the position to reserve space from
+    :param length: the number of bytes to reserve
+    :return: True if space is reserved, otherwise False
+    """
+    if _fallocate is None or length <= 0:
+        return False
+    if _fallocate(fd, _FALLOC_FL_KEEP_SIZE, offset, length) != 0:
+        logger.debug(
+            "fallocate is not supported: %s",
+            os.strerror(ctypes.get_errno())
+        )
+        return False
+    return True
+
+
+def syncfs(path):
+    """Flushes all data of file system, that contains path, to disk.
+
+    :param path: the path on file system
+    """
+    if _syncfs is not None:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            if _syncfs(fd) == 0:
+                return
+        finally:
+            os.close(fd)
+    if hasattr(os, "sync"):
+        os.sync()
+    elif _libc is not None:
+        _libc.sync()
+
+
+def reflink(src_fd, dst_fd):
+    """Makes dst to share data blocks with src (copy-on-write).
+
+    :return: True if file is cloned, False if it is not supported
+    """
+    try:
+        fcntl.ioctl(dst_fd, _FICLONE, src_fd)
+    except (IOError, OSError) as e:
+        logger.debug("reflink is not supported: %s", e)
+        return False
+    return True
+
+
+def copy_range(src_fd, dst_fd, offset, count):
+    """Copies data between files within kernel.
+
+    :param src_fd: the source file`s descriptor
+    :param dst_fd: the destination file`s descriptor
+    :param offset: the position in both files to start from
+    :param count: the number of bytes to copy
+    :return: the number of copied bytes
+    """
+    copied = 0
+    while copied < count:
+        size = min(count - copied, _COPY_CHUNK_SIZE)
+        position = offset + copied
+        try:
+            size = _copy_chunk(src_fd, dst_fd, position, size)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EINVAL, errno.ENOSYS):
+                raise
+            # the system call is not supported for these files
+            size = _read_write(src_fd, dst_fd, position, size)
+        if size == 0:
+            break
+        copied += size
+    return copied
+
+
+def _copy_chunk(src_fd, dst_fd, position, size):
+    if hasattr(os, "copy_file_range"):
+        return os.copy_file_range(src_fd, dst_fd, size, position, position)
+    if hasattr(os, "sendfile"):
+        os.lseek(dst_fd, position, os.SEEK_SET)
+        return os.sendfile(dst_fd, src_fd, position, size)
+    return _read_write(src_fd, dst_fd, position, size)
+
+
+def _read_write(src_fd, dst_fd, position, size):
+    """Copies data via userspace buffer.
+
+    :return: the number of copied bytes, less than size on end of file
+    """
+    os.lseek(src_fd, position, os.SEEK_SET)
+    os.lseek(dst_fd, position, os.SEEK_SET)
+    copied = 0
+    while copied < size:
+        data = os.read(src_fd, min(size - copied, _BUFFER_SIZE))
+        if not data:
+            break
+        write_all(dst_fd, data)
+        copied += len(data)
+    return copied
+
+
+def write_all(fd, data):
+    """Writes all data to file.
+
+    os.write can write less than requested, so it is repeated
+    until all data is written.
+
+    :param fd: the file`s descriptor
+    :param data: the bytes or memoryview to write
+    """
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
@@ -27,5 +27,5 @@ class Connections(object):
     def __exit__(self, *_):
         return False
 
-    def get(self, timeout=None):
+    def get(self, timeout=None, url=None):
         return self
@@ -14,6 +14,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from packetary.library.mirrors import MirrorsRegistry
 from packetary.tests.stubs.connections import Connections
 from packetary.tests.stubs.executor import Executor
 
@@ -22,6 +23,14 @@ class Context(object):
     def __init__(self):
         self.executor = Executor()
         self.connections = Connections()
+        self.mirrors = MirrorsRegistry()
+        self.store = None
+        self.durability = "file"
+        self.segment_threshold = 0
+        self.segment_count = 4
+        self.compression_level = 6
+        self.pdiff_history = 0
+        self.clean_dry_run = False
 
     def __enter__(self):
         return self
@@ -14,10 +14,12 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import functools
 import mock
 import six
 
 from packetary.library import driver
+from packetary.library.mirrors import MirrorsRegistry
 from packetary.tests.stubs import package
 
 
@@ -31,6 +33,15 @@ def gen_relation(pattern, idx, version=None):
     return []
 
 
+def bind_mirrors(mock_driver, mirrors=None):
+    """Binds the failover between mirrors to the mock of driver."""
+    mock_driver.mirrors = mirrors or MirrorsRegistry()
+    for name in ("with_mirrors", "fetch_from_mirrors"):
+        method = six.get_unbound_function(getattr(driver.RepoDriver, name))
+        setattr(mock_driver, name, functools.partial(method, mock_driver))
+    return mock_driver
+
+
 def package_generator(count=1, prefix='package',
                       requires_mask=None,
                       obsoletes_mask=None,
@@ -69,7 +80,7 @@ class RepoDriver(driver.RepoDriver):
     def get_path(self, base, p):
         return "/".join((base or p.baseurl, p.filename))
 
-    def create_index(self, destination):
+    def create_index(self, destination, passthrough=False):
         return self.index_writer
 
     def load(self, baseurl, reponame, consumer):
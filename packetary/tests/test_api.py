@@ -41,6 +41,10 @@ class TestApi(base.TestCase):
         self.repo = Repository(
             self.context, "test", "x86_64", drivers=drivers
         )
+        journal_patch = mock.patch("packetary.api.Journal")
+        self.journal = journal_patch.start().return_value
+        self.journal.load.return_value = False
+        self.addCleanup(journal_patch.stop)
 
     def test_createmirror_with_deps(self, repo_class):
         repo_class.return_value = self.repo
@@ -59,6 +63,26 @@ class TestApi(base.TestCase):
         )
         self.assertEqual(2, count)
 
+    def test_createmirror_with_deps_is_streamed(self, repo_class):
+        repo_class.return_value = self.repo
+        self.repo.copy_packages = mock.MagicMock()
+        self.repo.copy_packages_streaming = mock.MagicMock(return_value=2)
+        count = api.createmirror(
+            self.context,
+            "test", "x86_64",
+            "target",
+            "file:///origin",
+            "file:///debs",
+            ["requires-1", "package-0"],
+            True
+        )
+        self.assertEqual(2, count)
+        self.assertEqual(0, self.repo.copy_packages.call_count)
+        producer = self.repo.copy_packages_streaming.call_args[0][0]
+        self.assertItemsEqual(
+            ["requires-0", "requires-1"], [x.name for x in producer]
+        )
+
     def test_createmirror_warns_unresolved(self, repo_class):
         repo_class.return_value = self.repo
         with warnings.catch_warnings(record=True) as warns:
@@ -88,6 +112,69 @@ class TestApi(base.TestCase):
         )
         self.assertEqual(3, count)
 
+    def test_createmirror_full_is_streamed(self, repo_class):
+        repo_class.return_value = self.repo
+        self.repo.copy_packages = mock.MagicMock()
+        count = api.createmirror(
+            self.context,
+            "test", "x86_64",
+            "target",
+            "file:///origin"
+        )
+        self.assertEqual(3, count)
+        self.assertEqual(0, self.repo.copy_packages.call_count)
+        self.journal.close.assert_called_once_with()
+
+    def test_createmirror_full_with_order_is_not_streamed(self, repo_class):
+        repo_class.return_value = self.repo
+        self.repo.copy_packages_streaming = mock.MagicMock()
+        count = api.createmirror(
+            self.context,
+            "test", "x86_64",
+            "target",
+            "file:///origin",
+            download_order="largest-first"
+        )
+        self.assertEqual(3, count)
+        self.assertEqual(0, self.repo.copy_packages_streaming.call_count)
+
+    def test_createmirror_bootstrap_first(self, repo_class):
+        packages = package_generator(3, prefix="requires")
+        packages.extend(package_generator(
+            1, prefix="bootstrap", requires_mask="requires-{0}"
+        ))
+        self.repo.driver.packages_gen.side_effect = [packages]
+        repo_class.return_value = self.repo
+        self.repo.copy_packages = mock.MagicMock()
+        api.createmirror(
+            self.context,
+            "test", "x86_64",
+            "target",
+            "file:///origin",
+            bootstrap=["bootstrap-0"],
+            download_order="bootstrap-first"
+        )
+        scheduler = self.repo.copy_packages.call_args[0][3]
+        self.assertEqual(
+            frozenset(["bootstrap-0", "requires-0"]), scheduler.priority
+        )
+
+    def test_createmirror_resume(self, repo_class):
+        repo_class.return_value = self.repo
+        self.repo.copy_packages = mock.MagicMock()
+        self.journal.load.return_value = True
+        self.journal.is_planned.side_effect = [False, True, False]
+        count = api.createmirror(
+            self.context,
+            "test", "x86_64",
+            "target",
+            "file:///origin"
+        )
+        self.assertEqual(1, count)
+        packages = self.repo.copy_packages.call_args[0][0]
+        self.assertEqual(["requires-1"], [x.name for x in packages])
+        self.journal.close.assert_called_once_with()
+
     def test_get_packages(self, repo_class):
         repo_class.return_value = self.repo
         packages = api.get_packages(
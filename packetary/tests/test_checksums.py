@@ -14,6 +14,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import mock
 import six
 
 from packetary.library import checksum
@@ -36,6 +37,13 @@ class TestChecksum(base.TestCase):
                     expected, algo(stream, chunksize)
                 )
 
+    def test_checksum_of_stream_without_readinto(self):
+        stream = mock.MagicMock(spec=["read"])
+        stream.read.side_effect = [b"line1\nline2\n", b"line3\n", b""]
+        self.assertEqual(
+            "cc3d5ed5fda53dfa81ea6aa951d7e1fe", checksum.md5(stream)
+        )
+
     def test_composite(self):
         stream = six.BytesIO(b"line1\nline2\nline3\n")
         result = checksum.composite('md5', 'sha1', 'sha256')(stream)
@@ -48,3 +56,17 @@ class TestChecksum(base.TestCase):
             ],
             result
         )
+
+    def test_get_by_name(self):
+        stream = six.BytesIO(b"line1\nline2\nline3\n")
+        self.assertEqual(
+            "8c84f6f36dd2230d3e9c954fa436e5fda90b1957",
+            checksum.get("sha")(stream)
+        )
+        stream.seek(0)
+        self.assertEqual(
+            "cc3d5ed5fda53dfa81ea6aa951d7e1fe",
+            checksum.get("MD5Sum")(stream)
+        )
+        with self.assertRaisesRegexp(ValueError, "Unsupported"):
+            checksum.get("unknown")
@@ -38,6 +38,12 @@ class TestCliCommands(base.TestCase):
         "--ignore-error-count=3",
         "--thread-count=8",
         "--connection-count=4",
+        "--durability=batch",
+        "--connection-host-limit=2",
+        "--bandwidth-limit=100",
+        "--host-bandwidth-limit=10",
+        "--connection-timeout=30",
+        "--min-throughput=2",
         "--retry-count=10",
         "--connection-proxy=http://proxy",
         "--connection-secure-proxy=https://proxy"
@@ -51,6 +57,7 @@ class TestCliCommands(base.TestCase):
         "-t", "deb",
         "-a", "x86_64",
         "--clean",
+        "--download-order", "largest-first",
     ]
 
     packages_argv = [
@@ -76,6 +83,12 @@ class TestCliCommands(base.TestCase):
             retries_num=10,
             proxy="http://proxy",
             secure_proxy="https://proxy",
+            host_limit=2,
+            bandwidth=102400,
+            host_bandwidth=10240,
+            sync_files=False,
+            timeout=30,
+            min_speed=2048,
         )
 
     @mock.patch("packetary.cli.commands.mirror.createmirror")
@@ -86,7 +99,8 @@ class TestCliCommands(base.TestCase):
             ["http://localhost/origin"],
             ["http://localhost/requires"],
             ["test-package"],
-            False
+            False,
+            "largest-first"
         )
         self.check_context(createmirror.call_args[0][0])
 
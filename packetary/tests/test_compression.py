@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from contextlib import closing
+import gzip
+import six
+
+from packetary.library import compression
+from packetary.library.streams import GzipDecompress
+from packetary.tests import base
+
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+DATA = b"".join(
+    ("Package: test%d\nVersion: 1.0\n\n" % i).encode() for i in range(2000)
+)
+
+
+def _compress(writer_class, chunks, **kwargs):
+    stream = six.BytesIO()
+    writer = writer_class(stream, **kwargs)
+    for chunk in chunks:
+        writer.write(chunk)
+    writer.close()
+    return stream.getvalue()
+
+
+class TestParallelGzipWriter(base.TestCase):
+    def _decompress(self, data):
+        with closing(gzip.GzipFile(fileobj=six.BytesIO(data))) as stream:
+            return stream.read()
+
+    def test_write_several_blocks(self):
+        data = _compress(
+            compression.ParallelGzipWriter,
+            [DATA[:1000], DATA[1000:5000], DATA[5000:]],
+            block_size=4096, workers=2
+        )
+        self.assertEqual(DATA, self._decompress(data))
+        # the one gzip member, that is readable by stream decompressor
+        self.assertEqual(
+            DATA, GzipDecompress(six.BytesIO(data), 1024).read()
+        )
+
+    def test_write_nothing(self):
+        data = _compress(compression.ParallelGzipWriter, [])
+        self.assertEqual(b"", self._decompress(data))
+
+    def test_compression_level(self):
+        fast = _compress(compression.ParallelGzipWriter, [DATA], level=1)
+        best = _compress(compression.ParallelGzipWriter, [DATA], level=9)
+        self.assertEqual(DATA, self._decompress(fast))
+        self.assertEqual(DATA, self._decompress(best))
+        self.assertGreater(len(fast), len(best))
+
+
+@unittest.skipIf(compression.lzma is None, "lzma is not available")
+class TestParallelXzWriter(base.TestCase):
+    def test_write_several_blocks(self):
+        data = _compress(
+            compression.ParallelXzWriter,
+            [DATA[:1000], DATA[1000:5000], DATA[5000:]],
+            block_size=4096, workers=2
+        )
+        decompressor = compression.lzma.LZMADecompressor(
+            compression.lzma.FORMAT_XZ
+        )
+        self.assertEqual(DATA, decompressor.decompress(data))
+        self.assertTrue(decompressor.eof)
+        self.assertEqual(b"", decompressor.unused_data)
+
+    def test_write_nothing(self):
+        data = _compress(compression.ParallelXzWriter, [])
+        self.assertEqual(b"", compression.lzma.decompress(data))
+
+    def test_lzma2_dict_size(self):
+        self.assertEqual((4096, 0), compression._lzma2_dict_size(1))
+        self.assertEqual((6144, 1), compression._lzma2_dict_size(5000))
+        self.assertEqual(
+            (4 << 20, 20), compression._lzma2_dict_size(4 << 20)
+        )
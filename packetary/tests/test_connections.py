@@ -19,9 +19,16 @@ import six
 import time
 
 from packetary.library import connections
+from packetary.library import streams
 from packetary.tests import base
 
 
+def _make_response(chunks):
+    stream = mock.MagicMock()
+    stream.read.side_effect = chunks
+    return streams.StreamWrapper(stream)
+
+
 class TestConnectionsPool(base.TestCase):
     def test_get_connection(self):
         pool = connections.ConnectionsPool(count=2)
@@ -60,6 +67,129 @@ class TestConnectionsPool(base.TestCase):
             else:
                 self.fail("RetryHandler should be in list of handlers.")
 
+    def test_host_limit(self):
+        pool = connections.ConnectionsPool(count=2, host_limit=1)
+        with pool.get(url="http://host1/file1"):
+            self.assertEqual(1, pool.active["host1"])
+            with pool.get(url="http://host2/file1"):
+                self.assertEqual(1, pool.active["host2"])
+                self.assertFalse(pool._is_allowed("host2"))
+            self.assertTrue(pool._is_allowed("host2"))
+        self.assertEqual(0, pool.active["host1"])
+        self.assertEqual(2, pool.free.qsize())
+
+    def test_lend_idle_connections(self):
+        pool = connections.ConnectionsPool(count=3, host_limit=1)
+        with pool.get(url="http://host1/file1"):
+            # host1 reached the limit, but there are idle connections
+            with pool.get(url="http://host1/file2"):
+                self.assertEqual(2, pool.active["host1"])
+                # the last idle connection is kept for other hosts
+                self.assertFalse(pool._is_allowed("host1"))
+                self.assertTrue(pool._is_allowed("host2"))
+            pool.pending = 1
+            self.assertFalse(pool._is_allowed("host1"))
+            pool.pending = 0
+
+    def test_limit_lent_connections(self):
+        pool = connections.ConnectionsPool(count=10, host_limit=2)
+        contexts = [pool.get(url="http://host1/file") for _ in range(4)]
+        # host1 cannot borrow more connections than own limit
+        self.assertFalse(pool._is_allowed("host1"))
+        self.assertTrue(pool._is_allowed("host2"))
+        for context in contexts:
+            context.__exit__()
+        self.assertEqual(10, pool.free.qsize())
+
+    def test_wait_host_with_timeout(self):
+        pool = connections.ConnectionsPool(count=1, host_limit=1)
+        with pool.get(url="http://host1/file1"):
+            with self.assertRaises(six.moves.queue.Empty):
+                pool.get(timeout=0.01, url="http://host1/file2")
+            self.assertEqual(1, pool.active["host1"])
+        self.assertEqual(0, pool.pending)
+
+    def test_bandwidth_limit(self):
+        pool = connections.ConnectionsPool(
+            count=1, bandwidth=100, host_bandwidth=10
+        )
+        with pool.get() as c:
+            self.assertIsNotNone(c.bandwidth)
+            request = c.make_request("http://host/file")
+            self.assertEqual("host", request.throttle.args[0])
+            self.assertIsNone(c.make_request("/file").throttle.args[0])
+
+
+@mock.patch("packetary.library.connections.time")
+class TestCircuitBreaker(base.TestCase):
+    def setUp(self):
+        super(TestCircuitBreaker, self).setUp()
+        self.breaker = connections.CircuitBreaker(2, 60)
+
+    def test_disable_host_after_failures(self, time):
+        time.time.return_value = 0
+        self.breaker.on_failure("host")
+        self.breaker.check("host")
+        self.breaker.on_failure("host")
+        with self.assertRaises(connections.CircuitOpenError):
+            self.breaker.check("host")
+        self.breaker.check("host2")
+
+    def test_probe_after_timeout(self, time):
+        time.time.return_value = 0
+        self.breaker.on_failure("host")
+        self.breaker.on_failure("host")
+        time.time.return_value = 61
+        self.breaker.check("host")
+        self.breaker.on_failure("host")
+        with self.assertRaises(connections.CircuitOpenError):
+            self.breaker.check("host")
+
+    def test_success_resets_failures(self, time):
+        time.time.return_value = 0
+        self.breaker.on_failure("host")
+        self.breaker.on_success("host")
+        self.breaker.on_failure("host")
+        self.breaker.check("host")
+
+    def test_ignore_local_files(self, _):
+        self.breaker.on_failure(None)
+        self.breaker.on_failure(None)
+        self.breaker.check(None)
+
+    @mock.patch("packetary.library.connections.random")
+    def test_backoff(self, random, time):
+        random.uniform.side_effect = lambda a, b: b
+        connections.backoff(0)
+        time.sleep.assert_called_with(connections.BACKOFF_BASE)
+        connections.backoff(3)
+        time.sleep.assert_called_with(connections.BACKOFF_BASE * 8)
+        connections.backoff(100)
+        time.sleep.assert_called_with(connections.BACKOFF_MAX)
+
+
+@mock.patch("packetary.library.connections.time")
+class TestBandwidthLimit(base.TestCase):
+    def test_token_bucket(self, time):
+        time.time.side_effect = [0, 0, 0.25, 2]
+        bucket = connections.TokenBucket(100)
+        bucket.consume(50)
+        self.assertEqual(0, time.sleep.call_count)
+        bucket.consume(100)
+        time.sleep.assert_called_once_with(0.25)
+        bucket.consume(100)
+        self.assertEqual(1, time.sleep.call_count)
+
+    def test_host_limits(self, time):
+        time.time.return_value = 0
+        limit = connections.BandwidthLimit(100, 10)
+        limit.consume("host1", 10)
+        limit.consume("host2", 10)
+        self.assertEqual(0, time.sleep.call_count)
+        limit.consume("host1", 10)
+        time.sleep.assert_called_once_with(1.0)
+        self.assertEqual(70, limit.bucket.tokens)
+
 
 class TestConnection(base.TestCase):
     def setUp(self):
@@ -83,8 +213,12 @@ class TestConnection(base.TestCase):
         self.assertIsInstance(args[0], connections.RetryableRequest)
         self.assertEqual(2, args[0].retries_left)
 
-    @mock.patch("packetary.library.connections.logger")
-    def test_retries_on_io_error(self, logger):
+    @mock.patch.multiple(
+        "packetary.library.connections",
+        logger=mock.DEFAULT,
+        backoff=mock.DEFAULT
+    )
+    def test_retries_on_io_error(self, logger, backoff):
         self.connection.opener.open.side_effect = [
             IOError("I/O error"),
             mock.MagicMock()
@@ -103,6 +237,26 @@ class TestConnection(base.TestCase):
             "Failed to open url - %s: %s. retries left - %d.",
             "/test/file", "I/O error", 0
         )
+        backoff.assert_any_call(0)
+        backoff.assert_any_call(1)
+
+    def test_open_stream_with_timeout(self):
+        self.connection.timeout = 10
+        self.connection.open_stream("/test/file")
+        self.assertEqual(
+            10, self.connection.opener.open.call_args[1]["timeout"]
+        )
+
+    @mock.patch("packetary.library.connections.backoff")
+    def test_circuit_breaker_disables_host(self, _):
+        self.connection.breaker = connections.CircuitBreaker(threshold=2)
+        self.connection.opener.open.side_effect = IOError("I/O error")
+        with self.assertRaises(connections.CircuitOpenError):
+            self.connection.open_stream("http://host/file")
+        self.assertEqual(2, self.connection.opener.open.call_count)
+        with self.assertRaises(connections.CircuitOpenError):
+            self.connection.open_stream("http://host/file2")
+        self.assertEqual(2, self.connection.opener.open.call_count)
 
     def test_raise_other_errors(self):
         self.connection.opener.open.side_effect = \
@@ -113,44 +267,140 @@ class TestConnection(base.TestCase):
 
         self.assertEqual(1, self.connection.opener.open.call_count)
 
-    @mock.patch("packetary.library.connections.os")
-    def test_retrieve_from_offset(self, os):
+    @mock.patch.multiple(
+        "packetary.library.connections",
+        os=mock.DEFAULT,
+        utils=mock.DEFAULT
+    )
+    def test_retrieve_from_offset(self, os, utils):
         os.path.mkdirs.side_effect = OSError(17, "")
         os.open.return_value = 1
-        response = mock.MagicMock()
-        self.connection.opener.open.return_value = response
-        response.read.side_effect = [b"test", b""]
-        self.connection.retrieve("/file/src", "/file/dst", 10)
+        self.connection.opener.open.return_value = _make_response(
+            [b"test", b""]
+        )
+        self.connection.retrieve("http://host/file/src", "/file/dst", 10)
+        os.open.assert_called_once_with("/file/dst.part", mock.ANY)
         os.lseek.assert_called_once_with(1, 10, os.SEEK_SET)
         os.ftruncate.assert_called_once_with(1, 10)
-        self.assertEqual(1, os.write.call_count)
+        utils.write_all.assert_called_once_with(1, mock.ANY)
         os.fsync.assert_called_once_with(1)
         os.close.assert_called_once_with(1)
+        os.rename.assert_called_once_with("/file/dst.part", "/file/dst")
+
+    @mock.patch.multiple(
+        "packetary.library.connections",
+        os=mock.DEFAULT,
+        utils=mock.DEFAULT
+    )
+    def test_retrieve_preallocated_without_sync(self, os, utils):
+        self.connection.sync_files = False
+        os.open.return_value = 1
+        os.write.side_effect = lambda _, data: len(data)
+        self.connection.opener.open.return_value = _make_response(
+            [b"test", b""]
+        )
+        self.connection.retrieve("http://host/file/src", "/file/dst", 10, 100)
+        utils.preallocate.assert_called_once_with(1, 10, 90)
+        self.assertEqual(0, os.fsync.call_count)
+        os.close.assert_called_once_with(1)
+        os.rename.assert_called_once_with("/file/dst.part", "/file/dst")
 
     @mock.patch.multiple(
         "packetary.library.connections",
         logger=mock.DEFAULT,
-        os=mock.DEFAULT
+        os=mock.DEFAULT,
+        utils=mock.DEFAULT
     )
-    def test_retrieve_from_offset_fail(self, os, logger):
+    def test_retrieve_from_offset_fail(self, os, logger, utils):
         os.path.mkdirs.side_effect = OSError(17, "")
         os.open.return_value = 1
-        response = mock.MagicMock()
         self.connection.opener.open.side_effect = [
-            connections.RangeError("error"), response
+            connections.RangeError("error"), _make_response([b"test", b""])
         ]
-        response.read.side_effect = [b"test", b""]
-        self.connection.retrieve("/file/src", "/file/dst", 10)
+        self.connection.retrieve("http://host/file/src", "/file/dst", 10)
         logger.warning.assert_called_once_with(
             "Failed to resume download, starts from begin: %s",
-            "/file/src"
+            "http://host/file/src"
         )
         os.lseek.assert_called_once_with(1, 0, os.SEEK_SET)
         os.ftruncate.assert_called_once_with(1, 0)
-        self.assertEqual(1, os.write.call_count)
+        utils.write_all.assert_called_once_with(1, mock.ANY)
         os.fsync.assert_called_once_with(1)
         os.close.assert_called_once_with(1)
 
+    def test_get_local_path(self):
+        self.assertEqual("/a/b", connections.get_local_path("/a/b"))
+        self.assertEqual(
+            "/a/b c", connections.get_local_path("file:///a/b%20c")
+        )
+        self.assertIsNone(connections.get_local_path("http://host/a/b"))
+
+    @mock.patch("packetary.library.connections.os")
+    def test_retrieve_local_file_by_link(self, os):
+        os.path.lexists.return_value = False
+        self.connection.retrieve("file:///file/src", "/file/dst")
+        os.link.assert_called_once_with("/file/src", "/file/dst.part")
+        os.rename.assert_called_once_with("/file/dst.part", "/file/dst")
+        self.assertEqual(0, os.open.call_count)
+        self.assertEqual(0, self.connection.opener.open.call_count)
+
+    @mock.patch.multiple(
+        "packetary.library.connections",
+        os=mock.DEFAULT,
+        utils=mock.DEFAULT
+    )
+    def test_retrieve_local_file_by_reflink(self, os, utils):
+        os.path.lexists.return_value = False
+        os.link.side_effect = OSError(18, "Invalid cross-device link")
+        os.open.side_effect = [1, 2]
+        os.fstat.return_value.st_size = 100
+        utils.reflink.return_value = True
+        self.connection.retrieve("/file/src", "/file/dst")
+        utils.reflink.assert_called_once_with(2, 1)
+        self.assertEqual(0, utils.copy_range.call_count)
+        os.fsync.assert_called_once_with(1)
+        os.rename.assert_called_once_with("/file/dst.part", "/file/dst")
+
+    @mock.patch.multiple(
+        "packetary.library.connections",
+        os=mock.DEFAULT,
+        utils=mock.DEFAULT
+    )
+    def test_retrieve_local_file_from_offset(self, os, utils):
+        os.open.side_effect = [1, 2]
+        os.fstat.return_value.st_size = 100
+        self.connection.retrieve("/file/src", "/file/dst", 10)
+        self.assertEqual(0, os.link.call_count)
+        self.assertEqual(0, utils.reflink.call_count)
+        os.ftruncate.assert_called_once_with(1, 10)
+        utils.preallocate.assert_called_once_with(1, 10, 90)
+        utils.copy_range.assert_called_once_with(2, 1, 10, 90)
+        os.close.assert_any_call(2)
+        os.close.assert_any_call(1)
+        os.rename.assert_called_once_with("/file/dst.part", "/file/dst")
+        self.assertEqual(0, self.connection.opener.open.call_count)
+
+    @mock.patch("packetary.library.connections.os")
+    def test_retrieve_range(self, os):
+        del os.pwrite
+        response = mock.MagicMock()
+        self.connection.opener.open.return_value = response
+        response.read.side_effect = [b"test", b"data"]
+        self.connection.retrieve_range("/file/src", 1, 10, 17)
+        request = self.connection.opener.open.call_args[0][0]
+        self.assertEqual((10, 17), (request.offset, request.end))
+        os.lseek.assert_any_call(1, 10, os.SEEK_SET)
+        os.lseek.assert_any_call(1, 14, os.SEEK_SET)
+        os.write.assert_any_call(1, b"test")
+        os.write.assert_any_call(1, b"data")
+
+    def test_retrieve_range_fails_if_stream_is_short(self):
+        response = mock.MagicMock()
+        self.connection.opener.open.return_value = response
+        response.read.side_effect = [b"test", b""]
+        with self.assertRaisesRegexp(IOError, "Unexpected end of stream"):
+            self.connection.retrieve_range("/file/src", 1, 0, 7)
+
 
 @mock.patch("packetary.library.connections.logger")
 class TestRetryHandler(base.TestCase):
@@ -162,6 +412,7 @@ class TestRetryHandler(base.TestCase):
     def test_start_request(self, logger):
         request = mock.MagicMock()
         request.offset = 0
+        request.end = None
         request.get_full_url.return_value = "/file/test"
         request = self.handler.http_request(request)
         request.start_time <= time.time()
@@ -169,10 +420,25 @@ class TestRetryHandler(base.TestCase):
         request.offset = 1
         request = self.handler.http_request(request)
         request.add_header.assert_called_once_with('Range', 'bytes=1-')
+        request.end = 10
+        request = self.handler.http_request(request)
+        request.add_header.assert_called_with('Range', 'bytes=1-10')
+
+    def test_handle_range_response(self, _):
+        request = mock.MagicMock()
+        request.offset = 0
+        request.end = 10
+        response = mock.MagicMock()
+        response.getcode.return_value = 200
+        with self.assertRaises(connections.RangeError):
+            self.handler.http_response(request, response)
+        response.getcode.return_value = 206
+        self.handler.http_response(request, response)
 
     def test_handle_response(self, logger):
         request = mock.MagicMock()
         request.offset = 0
+        request.end = None
         request.start_time.__rsub__.return_value = 0.01
         request.get_full_url.return_value = "/file/test"
         response = mock.MagicMock()
@@ -188,6 +454,7 @@ class TestRetryHandler(base.TestCase):
     def test_handle_partial_response(self, _):
         request = mock.MagicMock()
         request.offset = 1
+        request.end = None
         request.get_full_url.return_value = "/file/test"
         response = mock.MagicMock()
         response.getcode.return_value = 200
@@ -214,15 +481,17 @@ class TestRetryHandler(base.TestCase):
         self.handler.parent.open.assert_called_once_with(request)
 
 
+@mock.patch("packetary.library.connections.backoff")
 class TestResumeableResponse(base.TestCase):
     def setUp(self):
         super(TestResumeableResponse, self).setUp()
-        self.request = mock.MagicMock()
+        self.request = connections.RetryableRequest("http://host/file")
+        self.request.retries_left = 1
+        self.request.timeout = 10
         self.opener = mock.MagicMock()
         self.stream = mock.MagicMock()
 
-    def test_resume_read(self):
-        self.request.offset = 0
+    def test_resume_read(self, backoff):
         response = connections.ResumableResponse(
             self.request,
             self.stream,
@@ -231,14 +500,86 @@ class TestResumeableResponse(base.TestCase):
         self.stream.read.side_effect = [
             b"chunk1", IOError(), b"chunk2", b""
         ]
-        self.opener.error.return_value = response
+        self.opener.open.return_value.stream = self.stream
         data = response.read()
         self.assertEqual(b"chunk1chunk2", data)
         self.assertEqual(12, self.request.offset)
-        self.assertEqual(1, self.opener.error.call_count)
+        self.opener.open.assert_called_once_with(self.request, timeout=10)
+        backoff.assert_called_once_with(0)
+        self.assertEqual(0, self.request.retries_left)
+
+    def test_resume_read_fails_if_no_retries_left(self, _):
+        response = connections.ResumableResponse(
+            self.request,
+            self.stream,
+            self.opener
+        )
+        self.stream.read.side_effect = IOError("I/O error")
+        self.opener.open.return_value.stream = self.stream
+        with self.assertRaisesRegexp(IOError, "I/O error"):
+            response.read()
+        self.assertEqual(1, self.opener.open.call_count)
+
+    @mock.patch("packetary.library.connections.time")
+    def test_resume_stalled_transfer(self, time, _):
+        time.time.side_effect = [0, 10, 31, 31, 32]
+        self.request.min_speed = 1024
+        response = connections.ResumableResponse(
+            self.request,
+            self.stream,
+            self.opener
+        )
+        self.stream.read.side_effect = [b"chunk1"]
+        new_stream = mock.MagicMock()
+        new_stream.read.return_value = b"chunk2"
+        self.opener.open.return_value.stream = new_stream
+        self.assertEqual(b"chunk1", response.read_chunk(6))
+        self.assertEqual(b"chunk2", response.read_chunk(6))
+        self.stream.close.assert_called_once_with()
+        self.assertEqual(12, self.request.offset)
+
+    @mock.patch("packetary.library.connections.time")
+    def test_throttling_is_not_stall(self, time, _):
+        # the throttle waits 40 seconds for each chunk
+        time.time.side_effect = [0, 0, 0, 40, 40, 40, 80]
+        self.request.min_speed = 1024
+        self.request.throttle = mock.MagicMock()
+        response = connections.ResumableResponse(
+            self.request,
+            self.stream,
+            self.opener
+        )
+        self.stream.read.side_effect = [b"chunk1", b"chunk2"]
+        self.assertEqual(b"chunk1", response.read_chunk(6))
+        self.assertEqual(b"chunk2", response.read_chunk(6))
+        self.assertEqual(0, self.opener.open.call_count)
+        self.assertEqual(80, response.window_start)
+
+    def test_resume_clears_failures_of_host(self, _):
+        self.request.breaker = connections.CircuitBreaker(threshold=2)
+        response = connections.ResumableResponse(
+            self.request,
+            self.stream,
+            self.opener
+        )
+        self.stream.read.side_effect = [IOError(), b"chunk"]
+        self.opener.open.return_value.stream = self.stream
+        self.assertEqual(b"chunk", response.read_chunk(5))
+        self.assertNotIn("host", self.request.breaker.failures)
+
+    def test_resume_does_not_retry_if_host_is_disabled(self, _):
+        self.request.breaker = connections.CircuitBreaker(threshold=1)
+        response = connections.ResumableResponse(
+            self.request,
+            self.stream,
+            self.opener
+        )
+        self.stream.read.side_effect = IOError()
+        with self.assertRaises(connections.CircuitOpenError):
+            response.read()
+        self.assertEqual(0, self.opener.open.call_count)
 
-    def test_read(self):
-        self.request.offset = 0
+    def test_read(self, _):
         response = connections.ResumableResponse(
             self.request,
             six.BytesIO(b"line1\nline2\nline3\n"),
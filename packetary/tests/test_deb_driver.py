@@ -16,15 +16,28 @@
 
 from __future__ import with_statement
 
+from contextlib import closing
+from debian import deb822
+import errno
+import eventlet
+import gzip
+import hashlib
 import mock
+import os
 import os.path as path
+import shutil
 import six
+import tempfile
+import time
 
 
+from packetary.library import compression
 from packetary.library.drivers import deb_driver
+from packetary.library.manifest import Manifest
 from packetary.library.package import Relation
 from packetary.tests import base
 from packetary.tests.stubs.context import Context
+from packetary.tests.stubs.driver import bind_mirrors
 
 
 PACKAGES_GZ = path.join(path.dirname(__file__), "data", "packages.gz")
@@ -87,6 +100,25 @@ class TestDebDriver(base.TestCase):
             [Relation("test-old")], package.obsoletes
         )
 
+    def test_load_from_next_mirror(self):
+        driver = deb_driver.Driver(Context(), "x86_64")
+        baseurl = driver.mirrors.register(["http://host1", "http://host2"])
+        connection = driver.connections.connection
+        packages = []
+        with open(PACKAGES_GZ, "rb") as stream:
+            connection.open_stream.side_effect = [IOError("dead"), stream]
+            driver.load(baseurl, ("trusty", "main"), packages.append)
+        connection.open_stream.assert_called_with(
+            "http://host2/dists/trusty/main/binary-amd64/Packages.gz",
+        )
+        self.assertEqual(1, len(packages))
+        # the package is downloaded from the best of mirrors later
+        self.assertEqual("http://host1", packages[0].baseurl)
+        self.assertEqual(
+            ["http://host2", "http://host1"],
+            driver.mirrors.candidates(baseurl)
+        )
+
     def test_parse_urls(self):
         self.assertItemsEqual(
             [
@@ -122,6 +154,18 @@ class TestDebDriver(base.TestCase):
             )
         )
 
+    def test_parse_urls_with_mirrors(self):
+        self.assertEqual(
+            [("http://host1", ("trusty", "main"))],
+            list(self.driver.parse_urls(
+                ["http://host1/dists/|http://host2/ trusty main"]
+            ))
+        )
+        self.assertEqual(
+            ["http://host1", "http://host2"],
+            self.driver.mirrors.candidates("http://host1")
+        )
+
     def test_parse_urls_fail_if_invalid(self):
         with self.assertRaisesRegexp(ValueError, "Invalid url:"):
             next(self.driver.parse_urls(["http://host/dists/trusty main"]))
@@ -132,19 +176,26 @@ class TestDebDriver(base.TestCase):
 @mock.patch.multiple(
     "packetary.library.drivers.deb_driver",
     os=mock.DEFAULT,
-    gzip=mock.DEFAULT,
     open=mock.DEFAULT,
     fcntl=mock.DEFAULT,
+    Manifest=mock.MagicMock(**{"return_value.load.return_value": None}),
+    _replace_file=mock.MagicMock(),
+    _expire_by_hash=mock.MagicMock(),
 )
 class TestDebIndexWriter(base.TestCase):
     def setUp(self):
         super(TestDebIndexWriter, self).setUp()
         driver = mock.MagicMock()
         driver.arch = "x86_64"
+        driver.compression_level = 6
+        driver.pdiff_history = 0
         self.writer = deb_driver.DebIndexWriter(
             driver,
             "/root"
         )
+        self.writer._load_digests_cache = mock.MagicMock(return_value={})
+        self.writer._save_digests_cache = mock.MagicMock()
+        self.writer._update_pdiffs = mock.MagicMock(return_value=None)
 
     def test_add(self, **_):
         package = mock.MagicMock(suite="trusty", comp="main")
@@ -159,7 +210,7 @@ class TestDebIndexWriter(base.TestCase):
             self.writer.index[(package.suite, package.comp)][package]
         )
 
-    def test_commit(self, gzip, open, os, fcntl):
+    def test_commit(self, open, os, fcntl):
         package = mock.MagicMock(suite="trusty", comp="main")
         package.dpkg.get.return_value = "Test"
         self.writer.add(package)
@@ -169,20 +220,44 @@ class TestDebIndexWriter(base.TestCase):
             lambda *x: x[-1](package)
         self.writer.commit(True)
         open.assert_any_call(
-            "/root/dists/trusty/main/binary-x86_64/Packages", "wb"
+            "/root/dists/trusty/main/binary-x86_64/Packages.tmp", "wb"
         )
         open.assert_any_call(
-            "/root/dists/trusty/main/binary-x86_64/Release", "w"
+            "/root/dists/trusty/main/binary-x86_64/Release.tmp", "w"
         )
         open.assert_any_call(
-            "/root/dists/trusty/Release", "w"
+            "/root/dists/trusty/Release.tmp", "w"
         )
-        gzip.open.assert_any_call(
-            "/root/dists/trusty/main/binary-x86_64/Packages.gz", "wb"
+        open.assert_any_call(
+            "/root/dists/trusty/main/binary-x86_64/Packages.gz.tmp", "wb"
         )
         fcntl.flock.assert_any_call(mock.ANY, fcntl.LOCK_EX)
         fcntl.flock.assert_any_call(mock.ANY, fcntl.LOCK_UN)
 
+    def test_commit_rebuilds_components_concurrently(self, **_):
+        started = []
+        finished = []
+
+        def rebuild_index(repo, *_):
+            started.append(repo)
+            # switches to other green threads
+            eventlet.sleep(0)
+            finished.append((repo, list(started)))
+
+        for comp in ("main", "restricted"):
+            package = mock.MagicMock(suite="trusty", comp=comp)
+            package.dpkg.get.return_value = "Test"
+            self.writer.add(package)
+        with mock.patch.multiple(self.writer, _rebuild_index=rebuild_index,
+                                 _updates_global_releases=mock.DEFAULT):
+            self.writer.commit(True)
+            self.writer._updates_global_releases.assert_called_once_with(
+                {"trusty"}
+            )
+        self.assertEqual(2, len(finished))
+        for _, started_before in finished:
+            self.assertEqual(2, len(started_before))
+
     def test_commit_with_cleanup(self, os, **_):
         self.writer.driver.load = \
             lambda *x: x[-1](mock.MagicMock(filename="test.pkg"))
@@ -193,9 +268,15 @@ class TestDebIndexWriter(base.TestCase):
         package = mock.MagicMock(suite="trusty", comp="main")
         package.dpkg.get.return_value = "Test"
         self.writer.add(package)
+        self.writer._collect_garbage = mock.MagicMock()
         self.writer.commit(False)
 
-        os.remove.assert_called_once_with("/root/test.pkg")
+        # the dirty files are removed by garbage collector
+        self.writer._collect_garbage.assert_called_once_with()
+        # the signatures of previous Release
+        os.remove.assert_any_call("/root/dists/trusty/InRelease")
+        os.remove.assert_any_call("/root/dists/trusty/Release.gpg")
+        self.assertEqual(2, os.remove.call_count)
 
     def test_updates_global_releases(self, os, open, **_):
         os.path.join = path.join
@@ -222,6 +303,7 @@ class TestDebIndexWriter(base.TestCase):
         meta_stream = six.StringIO()
         open.return_value = mock.MagicMock(write=meta_stream.write)
         open.return_value.read.side_effect = [b"data", ""] * 6
+        del open.return_value.readinto
         self.writer.origin = "test"
         self.writer._updates_global_releases(["trusty"])
 
@@ -256,3 +338,702 @@ class TestDebIndexWriter(base.TestCase):
                         content[start:end].endswith(expected)
                     )
                     start = end + 1
+
+
+class TestDebIndexWriterDigests(base.TestCase):
+    def setUp(self):
+        super(TestDebIndexWriterDigests, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        driver = mock.MagicMock(
+            arch="amd64", compression_level=1, pdiff_history=0
+        )
+        self.writer = deb_driver.DebIndexWriter(driver, self.root)
+        self.writer.origin = "Test"
+
+    def test_rebuild_index_writes_files_once(self):
+        packages = []
+        for i in range(3):
+            package = mock.MagicMock(
+                filename="test%d.deb" % i, version="1.0", size=1,
+                checksum=("md5", "1234")
+            )
+            package.name = "test%d" % i
+            package.dpkg.dump.side_effect = \
+                lambda fd, i=i: fd.write(b"Package: test" + str(i).encode())
+            packages.append(package)
+        tree = mock.MagicMock()
+        tree.keys.return_value = packages
+        self.writer._rebuild_index(("trusty", "main"), tree, False)
+        for p in packages:
+            p.dpkg.dump.assert_called_once_with(fd=mock.ANY)
+
+        path_ = path.join(self.root, "dists/trusty/main/binary-amd64")
+        with open(path.join(path_, "Packages"), "rb") as stream:
+            content = stream.read()
+        self.assertEqual(
+            b"Package: test0\nPackage: test1\nPackage: test2\n", content
+        )
+        with closing(gzip.open(path.join(path_, "Packages.gz"))) as stream:
+            self.assertEqual(content, stream.read())
+        if compression.lzma is not None:
+            with open(path.join(path_, "Packages.xz"), "rb") as stream:
+                self.assertEqual(
+                    content, compression.lzma.decompress(stream.read())
+                )
+
+        with mock.patch.object(deb_driver, "open", create=True) as open_:
+            self.writer._dump_files(
+                six.StringIO(), path.join(self.root, "dists/trusty"),
+                ["main"]
+            )
+            self.assertEqual(0, open_.call_count)
+
+        for name in os.listdir(path_):
+            if name not in deb_driver._INDEX_FILES_ORDER:
+                continue
+            with open(path.join(path_, name), "rb") as stream:
+                data = stream.read()
+            size, checksums = self.writer.digests[path.join(path_, name)]
+            self.assertEqual(len(data), size)
+            self.assertEqual(hashlib.sha256(data).hexdigest(), checksums[2])
+
+
+class TestDebIndexWriterRelease(base.TestCase):
+    def setUp(self):
+        super(TestDebIndexWriterRelease, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def _commit(self, components):
+        driver = mock.MagicMock(
+            arch="amd64", compression_level=1, pdiff_history=0
+        )
+        writer = deb_driver.DebIndexWriter(driver, self.root)
+        for comp in components:
+            writer.add(deb_driver.DebPackage(
+                deb822.Packages({
+                    "Package": "test", "Version": "1.0", "Size": "1",
+                    "Filename": "pool/{0}/test.deb".format(comp),
+                }),
+                self.root, "trusty", comp
+            ))
+        collector = mock.MagicMock(wraps=deb_driver._checksum_collector)
+        with mock.patch.object(deb_driver, "_checksum_collector", collector):
+            writer.commit(True)
+        return collector
+
+    def _read_release(self):
+        with open(path.join(self.root, "dists/trusty/Release")) as stream:
+            return stream.read()
+
+    def test_reuse_digests_of_untouched_components(self):
+        self._commit(["main", "universe"])
+        release = self._read_release()
+        # only the component Release is hashed in memory
+        collector = self._commit(["main"])
+        self.assertEqual(1, collector.call_count)
+        self.assertEqual(
+            release[release.find("MD5Sum:"):],
+            self._read_release()[release.find("MD5Sum:"):]
+        )
+
+    def test_read_changed_files(self):
+        self._commit(["main", "universe"])
+        changed = path.join(
+            self.root, "dists/trusty/universe/binary-amd64/Packages"
+        )
+        with open(changed, "ab") as stream:
+            stream.write(b"\n")
+        collector = self._commit(["main"])
+        self.assertEqual(2, collector.call_count)
+        with open(changed, "rb") as stream:
+            data = stream.read()
+        self.assertIn(
+            [hashlib.sha256(data).hexdigest(), str(len(data)),
+             "universe/binary-amd64/Packages"],
+            [x.split() for x in self._read_release().splitlines()]
+        )
+
+
+class TestDebIndexWriterByHash(base.TestCase):
+    def setUp(self):
+        super(TestDebIndexWriterByHash, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.path = path.join(self.root, "dists/trusty/main/binary-amd64")
+        self.by_hash = path.join(self.path, "by-hash", "SHA256")
+
+    def _commit(self, version):
+        driver = mock.MagicMock(
+            arch="amd64", compression_level=1, pdiff_history=0
+        )
+        writer = deb_driver.DebIndexWriter(driver, self.root)
+        writer.add(deb_driver.DebPackage(
+            deb822.Packages({
+                "Package": "test", "Version": version, "Size": "1",
+                "Filename": "pool/test_{0}.deb".format(version),
+            }),
+            self.root, "trusty", "main"
+        ))
+        writer.commit(True)
+
+    def _get_digests(self):
+        digests = dict()
+        for name in os.listdir(self.path):
+            filepath = path.join(self.path, name)
+            if path.isfile(filepath) and name.startswith("Packages"):
+                with open(filepath, "rb") as stream:
+                    digests[name] = hashlib.sha256(stream.read()).hexdigest()
+        return digests
+
+    def test_publish_by_hash(self):
+        self._commit("1.0")
+        digests = self._get_digests()
+        self.assertEqual(
+            sorted(digests.values()), sorted(os.listdir(self.by_hash))
+        )
+        with open(path.join(self.root, "dists/trusty/Release")) as stream:
+            release = stream.read()
+        self.assertIn("Acquire-By-Hash: yes\n", release)
+        self.assertFalse(path.exists(
+            path.join(self.root, "dists/trusty/Release.tmp")
+        ))
+
+    def test_keep_replaced_files_during_grace_period(self):
+        self._commit("1.0")
+        old_digests = self._get_digests()
+        self._commit("2.0")
+        new_digests = self._get_digests()
+        self.assertEqual(
+            sorted(list(old_digests.values()) + list(new_digests.values())),
+            sorted(os.listdir(self.by_hash))
+        )
+        for digest in old_digests.values():
+            entry = path.join(self.by_hash, digest)
+            expired = time.time() - deb_driver._BY_HASH_GRACE_PERIOD - 1
+            os.utime(entry, (expired, expired))
+        self._commit("2.0")
+        self.assertEqual(
+            sorted(new_digests.values()), sorted(os.listdir(self.by_hash))
+        )
+
+    def test_keep_replaced_files_after_republish(self):
+        self._commit("1.0")
+        old_digests = self._get_digests()
+        expired = time.time() - deb_driver._BY_HASH_GRACE_PERIOD - 1
+        for digest in old_digests.values():
+            entry = path.join(self.by_hash, digest)
+            os.utime(entry, (expired, expired))
+        # the index is not changed, but the by-hash entries are refreshed
+        self._commit("1.0")
+        self._commit("2.0")
+        for digest in old_digests.values():
+            self.assertTrue(path.exists(path.join(self.by_hash, digest)))
+
+    def test_keep_replaced_files_without_by_hash_entries(self):
+        self._commit("1.0")
+        old_digests = self._get_digests()
+        shutil.rmtree(self.by_hash)
+        self._commit("2.0")
+        for digest in old_digests.values():
+            self.assertTrue(path.exists(path.join(self.by_hash, digest)))
+
+    def test_remove_outdated_signatures(self):
+        signature = path.join(self.root, "dists/trusty/InRelease")
+        os.makedirs(path.dirname(signature))
+        with open(signature, "w"):
+            pass
+        self._commit("1.0")
+        self.assertFalse(path.exists(signature))
+
+
+class TestDebIndexWriterPDiffs(base.TestCase):
+    def setUp(self):
+        super(TestDebIndexWriterPDiffs, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.path = path.join(self.root, "dists/trusty/main/binary-amd64")
+        self.pdiff_dir = path.join(self.path, "Packages.diff")
+
+    def _commit(self, version, history):
+        driver = mock.MagicMock(
+            arch="amd64", compression_level=1, pdiff_history=history
+        )
+        writer = deb_driver.DebIndexWriter(driver, self.root)
+        writer.add(deb_driver.DebPackage(
+            deb822.Packages({
+                "Package": "test", "Version": version, "Size": "1",
+                "Filename": "pool/test_{0}.deb".format(version),
+            }),
+            self.root, "trusty", "main"
+        ))
+        writer.commit(True)
+
+    def test_publish_patches(self):
+        self._commit("1.0", 2)
+        self._commit("2.0", 2)
+        patches = [x for x in os.listdir(self.pdiff_dir) if x.endswith(".gz")]
+        self.assertEqual(1, len(patches))
+        with open(path.join(self.pdiff_dir, "Index"), "rb") as stream:
+            content = stream.read()
+        self.assertIn(
+            hashlib.sha256(content).hexdigest(),
+            os.listdir(path.join(self.pdiff_dir, "by-hash", "SHA256"))
+        )
+        with open(path.join(self.root, "dists/trusty/Release")) as stream:
+            release = stream.read()
+        self.assertIn(
+            "\n{0} {1} main/binary-amd64/Packages.diff/Index\n".format(
+                hashlib.sha256(content).hexdigest(),
+                deb_driver._format_size(len(content))
+            ),
+            release
+        )
+
+    def test_remove_patches_if_disabled(self):
+        self._commit("1.0", 2)
+        self._commit("2.0", 2)
+        self._commit("3.0", 0)
+        self.assertFalse(path.exists(self.pdiff_dir))
+        with open(path.join(self.root, "dists/trusty/Release")) as stream:
+            self.assertNotIn("Packages.diff", stream.read())
+
+
+class TestDebIndexWriterManifest(base.TestCase):
+    def setUp(self):
+        super(TestDebIndexWriterManifest, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.path = path.join(self.root, "dists/trusty/main/binary-amd64")
+
+    def _make_package(self, name, version, comp="main"):
+        return deb_driver.DebPackage(
+            deb822.Packages({
+                "Package": name,
+                "Version": version,
+                "Filename": "pool/{0}_{1}.deb".format(name, version),
+                "Size": "1",
+                "SHA1": "1234",
+            }),
+            self.root, "trusty", comp
+        )
+
+    def _commit(self, packages, keep_existing):
+        driver = mock.MagicMock(
+            arch="amd64", compression_level=1, pdiff_history=0,
+            clean_dry_run=False, async_section=Context().async_section
+        )
+        writer = deb_driver.DebIndexWriter(driver, self.root)
+        for p in packages:
+            writer.add(p)
+        writer.commit(keep_existing)
+        return writer
+
+    def _read_index(self):
+        with open(path.join(self.path, "Packages"), "rb") as stream:
+            return stream.read()
+
+    def test_save_manifest(self):
+        self._commit(
+            [self._make_package("b", "1.0"), self._make_package("a", "1.0")],
+            True
+        )
+        entries = Manifest(
+            self.path, path.join(self.path, "Packages")
+        ).load()
+        self.assertEqual(
+            [("a", "1.0", "pool/a_1.0.deb", 1, ("sha1", "1234")),
+             ("b", "1.0", "pool/b_1.0.deb", 1, ("sha1", "1234"))],
+            [x[:5] for x in entries]
+        )
+        content = self._read_index()
+        for entry in entries:
+            self.assertTrue(
+                content[entry.offset:entry.offset + entry.length]
+                .startswith(b"Package: " + entry.name.encode())
+            )
+
+    def test_rebuild_several_components(self):
+        self._commit(
+            [self._make_package("a", "1.0"),
+             self._make_package("b", "1.0", "restricted")],
+            True
+        )
+        for name, comp in (("a", "main"), ("b", "restricted")):
+            index = path.join(
+                self.root, "dists/trusty", comp, "binary-amd64/Packages"
+            )
+            with open(index, "rb") as stream:
+                self.assertEqual(
+                    [b"Package: " + name.encode()],
+                    [x.split(b"\n")[0]
+                     for x in stream.read().strip().split(b"\n\n")]
+                )
+        with open(path.join(self.root, "dists/trusty/Release")) as stream:
+            release = stream.read().splitlines()
+        self.assertIn(
+            ["Components:", "main", "restricted"],
+            [sorted(x.split()) for x in release]
+        )
+        for comp in ("main", "restricted"):
+            name = comp + "/binary-amd64/Packages.gz"
+            with open(path.join(self.root, "dists/trusty", name),
+                      "rb") as stream:
+                digest = hashlib.sha256(stream.read()).hexdigest()
+            self.assertIn([digest, name], [x.split()[::2] for x in release])
+
+    @mock.patch("packetary.library.executor.logger")
+    def test_propagate_error_of_component(self, _):
+        rebuild_index = deb_driver.DebIndexWriter._rebuild_index
+
+        def fail_restricted(writer, repo, *args):
+            if repo[1] == "restricted":
+                raise IOError(28, "No space left on device")
+            return rebuild_index(writer, repo, *args)
+
+        with mock.patch.object(deb_driver.DebIndexWriter, "_rebuild_index",
+                               fail_restricted):
+            with self.assertRaisesRegexp(IOError, "No space left on device"):
+                self._commit(
+                    [self._make_package("a", "1.0"),
+                     self._make_package("b", "1.0", "restricted")],
+                    True
+                )
+        self.assertFalse(
+            path.exists(path.join(self.root, "dists/trusty/Release"))
+        )
+
+    def test_merge_existing_packages_from_manifest(self):
+        self._commit(
+            [self._make_package("a", "1.0"), self._make_package("c", "1.0")],
+            True
+        )
+        content = self._read_index()
+        writer = self._commit([self._make_package("b", "1.0")], True)
+        self.assertEqual(0, writer.driver.load.call_count)
+        merged = self._read_index()
+        self.assertEqual(
+            [b"a", b"b", b"c"],
+            [x.split(b"\n")[0][9:] for x in merged.strip().split(b"\n\n")]
+        )
+        first, last = content.strip().split(b"\n\n")
+        self.assertTrue(merged.startswith(first + b"\n\n"))
+        self.assertTrue(merged.endswith(last + b"\n\n"))
+
+    def test_remove_dirty_files_from_manifest(self):
+        self._commit([self._make_package("a", "1.0")], True)
+        filepath = path.join(self.root, "pool/a_1.0.deb")
+        os.makedirs(path.dirname(filepath))
+        with open(filepath, "wb"):
+            pass
+        writer = self._commit([self._make_package("b", "1.0")], False)
+        self.assertEqual(0, writer.driver.load.call_count)
+        self.assertFalse(path.exists(filepath))
+
+    def test_parse_index_if_manifest_is_out_of_date(self):
+        self._commit([self._make_package("a", "1.0")], True)
+        with open(path.join(self.path, "Packages"), "ab") as stream:
+            stream.write(b"\n")
+        writer = self._commit([self._make_package("b", "1.0")], True)
+        self.assertEqual(1, writer.driver.load.call_count)
+
+
+class TestDebIndexWriterGarbageCollector(base.TestCase):
+    def setUp(self):
+        super(TestDebIndexWriterGarbageCollector, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def _create_file(self, name, size=1):
+        filepath = path.join(self.root, name)
+        if not path.exists(path.dirname(filepath)):
+            os.makedirs(path.dirname(filepath))
+        with open(filepath, "wb") as stream:
+            stream.write(b"0" * size)
+        return filepath
+
+    def _commit(self, suite, names, dry_run=False):
+        driver = mock.MagicMock(
+            arch="amd64", compression_level=1, pdiff_history=0,
+            clean_dry_run=dry_run, async_section=Context().async_section
+        )
+        writer = deb_driver.DebIndexWriter(driver, self.root)
+        for name in names:
+            writer.add(deb_driver.DebPackage(
+                deb822.Packages({
+                    "Package": name, "Version": "1.0", "Size": "1",
+                    "Filename": "pool/main/{0}.deb".format(name),
+                }),
+                self.root, suite, "main"
+            ))
+        with mock.patch.object(writer, "_collect_garbage") as gc:
+            writer.commit(False)
+        gc.assert_called_once_with()
+        return writer
+
+    def _list_pool(self):
+        return sorted(os.listdir(path.join(self.root, "pool", "main")))
+
+    def test_keep_files_shared_between_suites(self):
+        self._create_file("pool/main/a.deb")
+        self._create_file("pool/main/b.deb")
+        self._commit("xenial", ["a"])
+        writer = self._commit("trusty", ["b"])
+        self.assertEqual((0, 0), writer._collect_garbage())
+        self.assertEqual(["a.deb", "b.deb"], self._list_pool())
+
+    def test_remove_orphaned_files(self):
+        self._create_file("pool/main/a.deb")
+        self._create_file("pool/main/orphan.deb", 10)
+        self._create_file("pool/main/orphan.dsc")
+        writer = self._commit("trusty", ["a"])
+        self.assertEqual((1, 10), writer._collect_garbage())
+        self.assertEqual(["a.deb", "orphan.dsc"], self._list_pool())
+
+    def test_read_index_if_manifest_is_out_of_date(self):
+        self._create_file("pool/main/a.deb")
+        self._create_file("pool/main/b.deb")
+        self._commit("xenial", ["a"])
+        packages = path.join(
+            self.root, "dists/xenial/main/binary-amd64/Packages"
+        )
+        with open(packages, "ab") as stream:
+            stream.write(b"Package: b\nFilename: pool/main/b.deb\n\n")
+        writer = self._commit("trusty", ["a"])
+        self.assertEqual((0, 0), writer._collect_garbage())
+        self.assertEqual(["a.deb", "b.deb"], self._list_pool())
+
+    def test_use_only_indexes_listed_in_release(self):
+        self._create_file("pool/main/a.deb")
+        self._create_file("pool/main/b.deb")
+        self._commit("xenial", ["a"])
+        # the upstream index is published as is, the generated Packages
+        # and its manifest are not listed in Release
+        suite_dir = path.join(self.root, "dists/xenial")
+        index = path.join(suite_dir, "main/binary-amd64/Packages.gz")
+        with closing(gzip.open(index, "wb")) as stream:
+            stream.write(
+                b"Package: a\nFilename: pool/main/a.deb\n\n"
+                b"Package: b\nFilename: pool/main/b.deb\n\n"
+            )
+        with open(path.join(suite_dir, "Release"), "w") as stream:
+            stream.write(
+                "Suite: xenial\nSHA256:\n"
+                " 0 0 main/binary-amd64/Packages.gz\n"
+            )
+        writer = self._commit("trusty", ["a"])
+        self.assertEqual((0, 0), writer._collect_garbage())
+        self.assertEqual(["a.deb", "b.deb"], self._list_pool())
+
+    def test_ignore_indexes_of_not_mirrored_architectures(self):
+        self._create_file("pool/main/a.deb")
+        self._create_file("pool/main/orphan.deb", 10)
+        self._commit("xenial", ["a"])
+        suite_dir = path.join(self.root, "dists/xenial")
+        with open(path.join(suite_dir, "Release"), "w") as stream:
+            stream.write(
+                "Suite: xenial\nSHA256:\n"
+                " 0 0 main/binary-amd64/Packages.gz\n"
+                " 0 0 main/binary-i386/Packages.gz\n"
+                " 0 0 main/binary-i386/Packages.xz\n"
+            )
+        writer = self._commit("trusty", [])
+        self.assertEqual((1, 10), writer._collect_garbage())
+        self.assertEqual(["a.deb"], self._list_pool())
+
+    def test_skip_if_listed_index_is_missing(self):
+        self._create_file("pool/main/a.deb")
+        self._create_file("pool/main/orphan.deb")
+        writer = self._commit("trusty", ["a"])
+        index_dir = path.join(self.root, "dists/trusty/main/binary-amd64")
+        for name in os.listdir(index_dir):
+            if name.startswith("Packages"):
+                os.remove(path.join(index_dir, name))
+        self.assertEqual((0, 0), writer._collect_garbage())
+        self.assertEqual(["a.deb", "orphan.deb"], self._list_pool())
+
+    def test_dry_run(self):
+        orphan = self._create_file("pool/main/orphan.deb", 10)
+        writer = self._commit("trusty", [], dry_run=True)
+        self.assertEqual((1, 10), writer._collect_garbage())
+        self.assertTrue(path.exists(orphan))
+
+
+class TestDebIndexWriterPassthrough(base.TestCase):
+    def setUp(self):
+        super(TestDebIndexWriterPassthrough, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.upstream = path.join(self.root, "upstream")
+        self.destination = path.join(self.root, "mirror")
+        driver = mock.MagicMock(
+            arch="amd64", clean_dry_run=False,
+            async_section=Context().async_section
+        )
+        driver.fetch.side_effect = self._fetch
+        bind_mirrors(driver)
+        self.writer = deb_driver.DebIndexWriter(
+            driver, self.destination, True
+        )
+        index = self._gzip(
+            b"Package: test\nFilename: pool/main/t/test.deb\n\n"
+        )
+        self._create_file(
+            self.upstream, "dists/trusty/main/binary-amd64/Packages.gz",
+            index
+        )
+        self._create_release(hashlib.sha256(index).hexdigest(), len(index))
+        self.package = mock.MagicMock(
+            suite="trusty", comp="main", baseurl=self.upstream,
+            filename="pool/main/t/test.deb"
+        )
+        self.package.dpkg.get.return_value = "Test"
+
+    @staticmethod
+    def _gzip(data):
+        stream = six.BytesIO()
+        with closing(gzip.GzipFile(fileobj=stream, mode="wb", mtime=0)) \
+                as gz:
+            gz.write(data)
+        return stream.getvalue()
+
+    @staticmethod
+    def _create_file(base, name, data=b"data"):
+        filepath = path.join(base, name)
+        if not path.exists(path.dirname(filepath)):
+            os.makedirs(path.dirname(filepath))
+        with open(filepath, "wb") as stream:
+            stream.write(data)
+
+    def _create_release(self, sha256, size):
+        self._create_file(
+            self.upstream, "dists/trusty/Release",
+            "Origin: Test\nSuite: trusty\nSHA256:\n"
+            " {0} {1} main/binary-amd64/Packages.gz\n"
+            " {0} {1} main/binary-amd64/Packages\n".format(sha256, size)
+            .encode()
+        )
+
+    def _list_files(self, name):
+        base = path.join(self.destination, name)
+        return sorted(
+            path.relpath(path.join(root, f), base)
+            for root, _, files in os.walk(base) for f in files
+        )
+
+    def _fetch(self, url, filepath, optional=False):
+        if url.startswith("http://dead"):
+            raise IOError(errno.ECONNREFUSED, "Connection refused", url)
+        if not path.exists(url):
+            if optional:
+                return False
+            raise IOError(2, "No such file", url)
+        if not path.exists(path.dirname(filepath)):
+            os.makedirs(path.dirname(filepath))
+        shutil.copy(url, filepath)
+        return True
+
+    def test_publish_upstream(self):
+        self._create_file(self.destination, "pool/main/t/test.deb")
+        self._create_file(self.destination, "pool/main/o/orphan.deb")
+        self.writer.add(self.package)
+        with mock.patch.object(self.writer, "_rebuild_index") as rebuild:
+            self.writer.commit(False)
+        self.assertEqual(0, rebuild.call_count)
+        self.assertEqual(["main/t/test.deb"], self._list_files("pool"))
+        for name in ("Release", "main/binary-amd64/Packages.gz"):
+            with open(path.join(self.upstream, "dists/trusty", name),
+                      "rb") as s1:
+                with open(path.join(self.destination, "dists/trusty", name),
+                          "rb") as s2:
+                    self.assertEqual(s1.read(), s2.read())
+        with open(path.join(self.destination, "dists/trusty",
+                            "main/binary-amd64/Packages.gz"), "rb") as s:
+            digest = hashlib.sha256(s.read()).hexdigest()
+        self.assertEqual(
+            ["Release", "main/binary-amd64/Packages.gz",
+             "main/binary-amd64/by-hash/SHA256/" + digest],
+            self._list_files("dists/trusty")
+        )
+
+    def test_publish_upstream_with_not_mirrored_architectures(self):
+        self._create_file(self.destination, "pool/main/t/test.deb")
+        self._create_file(self.destination, "pool/main/o/orphan.deb")
+        index = self._gzip(
+            b"Package: other\nFilename: pool/main/o/orphan.deb\n\n"
+        )
+        self._create_file(
+            self.upstream, "dists/trusty/main/binary-i386/Packages.gz", index
+        )
+        with open(path.join(self.upstream, "dists/trusty/Release"),
+                  "ab") as stream:
+            stream.write(
+                " {0} {1} main/binary-i386/Packages.gz\n".format(
+                    hashlib.sha256(index).hexdigest(), len(index)
+                ).encode()
+            )
+        self.writer.add(self.package)
+        with mock.patch.object(self.writer, "_rebuild_index") as rebuild:
+            self.writer.commit(False)
+        self.assertEqual(0, rebuild.call_count)
+        self.assertEqual(["main/t/test.deb"], self._list_files("pool"))
+        self.assertFalse(path.exists(
+            path.join(self.destination, "dists/trusty/main/binary-i386")
+        ))
+
+    def test_publish_upstream_from_next_mirror(self):
+        self._create_file(self.destination, "pool/main/t/test.deb")
+        dead = "http://dead"
+        self.writer.driver.mirrors.register([dead, self.upstream])
+        self.package.baseurl = dead
+        self.writer.add(self.package)
+        with mock.patch.object(self.writer, "_rebuild_index") as rebuild:
+            self.writer.commit(True)
+        self.assertEqual(0, rebuild.call_count)
+        self.assertIn(
+            "main/binary-amd64/Packages.gz", self._list_files("dists/trusty")
+        )
+
+    def test_remove_stale_generated_files(self):
+        self._create_file(self.destination, "pool/main/t/test.deb")
+        for name in ("Packages", "Packages.xz", ".packetary-manifest",
+                     "Packages.diff/Index"):
+            self._create_file(
+                self.destination, "dists/trusty/main/binary-amd64/" + name
+            )
+        self.writer.add(self.package)
+        self.writer.commit(True)
+        self.assertEqual(
+            ["Packages.gz"],
+            [x for x in self._list_files("dists/trusty/main/binary-amd64")
+             if not x.startswith("by-hash")]
+        )
+
+    def test_regenerate_if_package_is_missing(self):
+        self.writer.add(self.package)
+        with mock.patch.multiple(self.writer, _rebuild_index=mock.DEFAULT,
+                                 _updates_global_releases=mock.DEFAULT):
+            self.writer.commit(False)
+            self.writer._rebuild_index.assert_called_once_with(
+                ("trusty", "main"), mock.ANY, False
+            )
+        self.assertEqual([], self._list_files("dists/trusty"))
+
+    def test_regenerate_if_checksum_mismatch(self):
+        self._create_file(self.destination, "pool/main/t/test.deb")
+        self._create_release("0" * 64, 10)
+        self.writer.add(self.package)
+        with mock.patch.multiple(self.writer, _rebuild_index=mock.DEFAULT,
+                                 _updates_global_releases=mock.DEFAULT):
+            self.writer.commit(False)
+            self.assertEqual(1, self.writer._rebuild_index.call_count)
+
+    def test_regenerate_if_suite_is_merged(self):
+        self.writer.add(self.package)
+        self.writer.upstreams["trusty"].add("http://other")
+        with mock.patch.multiple(self.writer, _rebuild_index=mock.DEFAULT,
+                                 _updates_global_releases=mock.DEFAULT):
+            self.writer.commit(False)
+            self.assertEqual(1, self.writer._rebuild_index.call_count)
+        self.assertEqual(0, self.writer.driver.fetch.call_count)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import gzip
+import hashlib
+import os
+import os.path as path
+import shutil
+import tempfile
+
+from packetary.library.drivers import deb_pdiff
+from packetary.tests import base
+
+
+def _paragraph(name, version):
+    return b"".join((
+        b"Package: ", name, b"\nVersion: ", version,
+        b"\nArchitecture: amd64\n\n"
+    ))
+
+
+def _apply(lines, script):
+    """Applies the ed script as apt does."""
+    lines = list(lines)
+    script = deb_pdiff._split_lines(script)
+    while script:
+        command = script.pop(0)[:-1]
+        address, action = command[:-1], command[-1:]
+        start, _, end = address.partition(b",")
+        start = int(start)
+        end = int(end or start)
+        new = []
+        if action != b"d":
+            while script[0] != b".\n":
+                new.append(script.pop(0))
+            script.pop(0)
+        if action == b"a":
+            lines[start:start] = new
+        else:
+            lines[start - 1:end] = new
+    return lines
+
+
+class TestEdDiff(base.TestCase):
+    def setUp(self):
+        super(TestEdDiff, self).setUp()
+        self.old = deb_pdiff._split_lines(b"".join(
+            _paragraph(("package%d" % i).encode(), b"1.0")
+            for i in range(10)
+        ))
+
+    def _check(self, new):
+        script = deb_pdiff.ed_diff(self.old, new)
+        self.assertEqual(new, _apply(self.old, script))
+        return script
+
+    def test_change_line(self):
+        new = list(self.old)
+        new[5] = b"Version: 2.0\n"
+        self.assertEqual(b"6c\nVersion: 2.0\n.\n", self._check(new))
+
+    def test_insert_and_delete(self):
+        new = self.old[4:20] + \
+            deb_pdiff._split_lines(_paragraph(b"package50", b"1.0")) + \
+            self.old[20:36]
+        self._check(new)
+
+    def test_append_to_empty(self):
+        self.old = []
+        self._check(deb_pdiff._split_lines(_paragraph(b"package", b"1.0")))
+
+    def test_not_changed(self):
+        self.assertEqual(b"", self._check(list(self.old)))
+
+    def test_line_with_dot(self):
+        with self.assertRaises(ValueError):
+            deb_pdiff.ed_diff(self.old, self.old + [b".\n"])
+
+
+class TestPDiffs(base.TestCase):
+    def setUp(self):
+        super(TestPDiffs, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.path = path.join(self.root, "Packages.diff")
+        self.index = path.join(self.root, "Packages")
+        self.versions = []
+
+    def _update(self, version, depth=2):
+        """Publishes the new version of index."""
+        data = _paragraph(b"package", version)
+        self.versions.append(data)
+        with open(self.index + ".tmp", "wb") as stream:
+            stream.write(data)
+        content = deb_pdiff.PDiffs(self.path, depth).update(
+            self.index, self.index + ".tmp"
+        )
+        os.rename(self.index + ".tmp", self.index)
+        if content is not None:
+            with open(path.join(self.path, "Index"), "w") as stream:
+                stream.write(content)
+        return content
+
+    def _get_patches(self):
+        return sorted(x for x in os.listdir(self.path) if x.endswith(".gz"))
+
+    def test_start_history(self):
+        content = self._update(b"1.0")
+        self.assertIn(
+            "SHA256-Current: {0} {1}\n".format(
+                hashlib.sha256(self.versions[0]).hexdigest(),
+                len(self.versions[0])
+            ),
+            content
+        )
+        self.assertIn("SHA256-History:\nSHA256-Patches:\n", content)
+        self.assertEqual([], self._get_patches())
+
+    def test_add_patch(self):
+        self._update(b"1.0")
+        content = self._update(b"2.0")
+        patches = self._get_patches()
+        self.assertEqual(1, len(patches))
+        self.assertIn(
+            " {0} {1:>8} {2}\n".format(
+                hashlib.sha1(self.versions[0]).hexdigest(),
+                len(self.versions[0]), patches[0][:-3]
+            ),
+            content
+        )
+        with open(path.join(self.path, patches[0]), "rb") as stream:
+            script = gzip.GzipFile(fileobj=stream).read()
+        self.assertEqual(
+            deb_pdiff._split_lines(self.versions[1]),
+            _apply(deb_pdiff._split_lines(self.versions[0]), script)
+        )
+
+    def test_keep_index_if_not_changed(self):
+        self._update(b"1.0")
+        self._update(b"2.0")
+        self.assertIsNone(self._update(b"2.0"))
+
+    def test_limit_history(self):
+        self._update(b"1.0")
+        self._update(b"2.0")
+        first = self._get_patches()
+        self._update(b"3.0", depth=1)
+        patches = self._get_patches()
+        self.assertEqual(1, len(patches))
+        self.assertNotEqual(first, patches)
+        self.assertEqual(
+            1, len(deb_pdiff.PDiffs(self.path, 1)._load()[1])
+        )
+
+    def test_start_history_again_if_patch_is_missing(self):
+        self._update(b"1.0")
+        self._update(b"2.0")
+        self._update(b"3.0")
+        first = self._get_patches()[0]
+        os.remove(path.join(self.path, first))
+        content = self._update(b"4.0")
+        self.assertNotIn(first[:-3], content)
+        current, patches = deb_pdiff.PDiffs(self.path, 2)._load()
+        self.assertEqual(1, len(patches))
+        self.assertEqual([patches[0].name + ".gz"], self._get_patches())
+        self.assertEqual(
+            (len(self.versions[2]),
+             [hashlib.sha1(self.versions[2]).hexdigest(),
+              hashlib.sha256(self.versions[2]).hexdigest()]),
+            patches[0].history
+        )
+
+    def test_start_history_again_if_index_changed(self):
+        self._update(b"1.0")
+        self._update(b"2.0")
+        with open(self.index, "wb") as stream:
+            stream.write(_paragraph(b"other", b"1.0"))
+        self._update(b"3.0")
+        current, patches = deb_pdiff.PDiffs(self.path, 2)._load()
+        self.assertEqual(1, len(patches))
+        self.assertEqual(patches[0].name + ".gz", self._get_patches()[0])
+        self.assertEqual(len(self.versions[2]), current[0])
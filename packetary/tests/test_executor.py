@@ -52,6 +52,14 @@ class TestAsynchronousSection(base.TestCase):
             "Task failed: %s", "error"
         )
 
+    def test_keep_first_failure(self, _):
+        section = executor.AsynchronousSection(ignore_errors_num=1)
+        section.execute(_raise_value_error)
+        section.execute(time.sleep, 0)
+        section.wait(ignore_errors=True)
+        self.assertIs(ValueError, section.failure[0])
+        self.assertEqual("error", str(section.failure[1]))
+
     def test_fail_if_too_many_errors(self, _):
         section = executor.AsynchronousSection(ignore_errors_num=0)
         section.execute(_raise_value_error)
@@ -156,6 +156,38 @@ class TestIndex(base.TestCase):
         self.assertEqual(1, len(unresolved))
         self.assertEqual("requires-0", unresolved.pop().name)
 
+    def test_iter_resolve_yields_before_traversal_is_completed(self):
+        index = Index()
+        index.add(package_generator(
+            prefix="test1", requires_mask="requires-{0}")[0]
+        )
+        index.add(package_generator(
+            prefix="test2", requires_mask="test1-{0}")[0]
+        )
+        unresolved = set()
+        unresolved.add(Relation("test2-0"))
+        resolved = index.iter_resolve(unresolved)
+        self.assertEqual("test2-0", next(resolved).name)
+        self.assertEqual(0, len(unresolved))
+        self.assertEqual(["test1-0"], [x.name for x in resolved])
+        self.assertEqual(1, len(unresolved))
+        self.assertEqual("requires-0", unresolved.pop().name)
+
+    def test_iter_resolve_yields_package_once(self):
+        index = Index()
+        index.add(package_generator(prefix="test1")[0])
+        index.add(package_generator(
+            prefix="test2", requires_mask="test1-{0}")[0]
+        )
+        unresolved = set()
+        unresolved.add(Relation("test1-0"))
+        unresolved.add(Relation("test2-0"))
+        resolved = list(index.iter_resolve(unresolved))
+        self.assertItemsEqual(
+            ["test1-0", "test2-0"], (x.name for x in resolved)
+        )
+        self.assertEqual(0, len(unresolved))
+
     def test_get_unresolved(self):
         index = Index()
         index.add(
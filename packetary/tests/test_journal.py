@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os.path as path
+import shutil
+import tempfile
+
+from packetary.library import journal
+from packetary.tests import base
+
+
+class TestJournal(base.TestCase):
+    def setUp(self):
+        super(TestJournal, self).setUp()
+        self.destination = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.destination)
+
+    def _create_journal(self, key=("deb", "x86_64")):
+        return journal.Journal(self.destination, key)
+
+    def test_resume_interrupted_run(self):
+        j = self._create_journal()
+        self.assertFalse(j.load())
+        j.plan([("a.deb", 10, ("md5", "1")), ("b.deb", 20, (None, None))])
+        j.start("a.deb")
+        j.done("a.deb")
+        j.start("b.deb")
+        # crash in the middle of record
+        j.stream.write('{"op": "do')
+        j.stream.close()
+
+        j = self._create_journal()
+        self.assertTrue(j.load())
+        self.assertTrue(j.is_planned("b.deb"))
+        self.assertTrue(j.is_completed("a.deb"))
+        self.assertFalse(j.is_interrupted("a.deb"))
+        self.assertTrue(j.is_interrupted("b.deb"))
+        j.plan([])
+        j.done("b.deb")
+        j.close()
+        self.assertFalse(path.exists(j.path))
+
+    def test_keep_transfers_of_run_without_plan(self):
+        j = self._create_journal()
+        j.plan([])
+        j.start("a.deb")
+        j.stream.close()
+
+        j = self._create_journal()
+        self.assertFalse(j.load())
+        self.assertTrue(j.is_interrupted("a.deb"))
+        j.plan([])
+        j.stream.close()
+
+        j = self._create_journal()
+        j.load()
+        self.assertTrue(j.is_interrupted("a.deb"))
+        j.close()
+
+    def test_plan_after_transfers_without_plan(self):
+        j = self._create_journal()
+        j.plan([])
+        j.start("a.deb")
+        j.stream.close()
+
+        j = self._create_journal()
+        self.assertFalse(j.load())
+        j.plan([("a.deb", 10, ("md5", "1")), ("b.deb", 20, (None, None))])
+        j.stream.close()
+
+        j = self._create_journal()
+        self.assertTrue(j.load())
+        self.assertTrue(j.is_planned("b.deb"))
+        self.assertTrue(j.is_interrupted("a.deb"))
+        j.close()
+
+    def test_ignore_journal_of_other_run(self):
+        j = self._create_journal()
+        j.plan([("a.deb", 10, ("md5", "1"))])
+        j.stream.close()
+        j = self._create_journal(("yum", "x86_64"))
+        self.assertFalse(j.load())
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+
+from packetary.library import manifest
+from packetary.tests import base
+from packetary.tests.stubs.package import Package
+
+
+class TestManifest(base.TestCase):
+    def setUp(self):
+        super(TestManifest, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.index = os.path.join(self.root, "Packages")
+        self._write_index(b"Package: test\n")
+        self.manifest = manifest.Manifest(self.root, self.index)
+        self.entries = [
+            manifest.ManifestEntry(
+                "test", "1.0", "test.deb", 10, ("sha1", "1234"), 0, 13
+            )
+        ]
+
+    def _write_index(self, data):
+        with open(self.index, "wb") as stream:
+            stream.write(data)
+
+    def test_save_and_load(self):
+        self.manifest.save(self.entries)
+        self.assertEqual(self.entries, self.manifest.load())
+
+    def test_load_if_does_not_exist(self):
+        self.assertIsNone(self.manifest.load())
+
+    def test_load_if_index_is_changed(self):
+        self.manifest.save(self.entries)
+        self._write_index(b"Package: test\n\nPackage: test2\n")
+        self.assertIsNone(self.manifest.load())
+
+    def test_load_if_index_is_removed(self):
+        self.manifest.save(self.entries)
+        os.remove(self.index)
+        self.assertIsNone(self.manifest.load())
+
+    def test_load_if_malformed(self):
+        self.manifest.save(self.entries)
+        with open(self.manifest.path, "a") as stream:
+            stream.write("[\n")
+        self.assertIsNone(self.manifest.load())
+
+    def test_entry_from_package(self):
+        package = Package(size=10, checksum=("sha1", "1234"))
+        entry = manifest.ManifestEntry.from_package(package, 10, 20)
+        self.assertEqual(package.name, entry.name)
+        self.assertEqual(str(package.version), entry.version)
+        self.assertEqual(package.filename, entry.filename)
+        self.assertEqual(package.size, entry.size)
+        self.assertEqual(tuple(package.checksum), entry.checksum)
+        self.assertEqual((10, 20), (entry.offset, entry.length))
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from packetary.library import mirrors
+from packetary.tests import base
+
+
+class TestMirrorsRegistry(base.TestCase):
+    def setUp(self):
+        super(TestMirrorsRegistry, self).setUp()
+        self.registry = mirrors.MirrorsRegistry()
+        self.baseurl = self.registry.register(
+            self.registry.split("http://host1 | http://host2|http://host3")
+        )
+
+    def test_register(self):
+        self.assertEqual("http://host1", self.baseurl)
+        self.assertEqual(
+            ["http://host1", "http://host2", "http://host3"],
+            self.registry.candidates(self.baseurl)
+        )
+        self.assertEqual(
+            ["http://host4"], self.registry.candidates("http://host4")
+        )
+
+    def test_order_by_throughput(self):
+        self.registry.on_success("http://host1", 100, 10)
+        self.assertEqual(
+            ["http://host2", "http://host3", "http://host1"],
+            self.registry.candidates(self.baseurl)
+        )
+        self.registry.on_success("http://host2", 100, 1)
+        self.registry.on_success("http://host3", 100, 2)
+        self.assertEqual(
+            ["http://host2", "http://host3", "http://host1"],
+            self.registry.candidates(self.baseurl)
+        )
+
+    def test_failures_decrease_score(self):
+        self.registry.on_failure("http://host1")
+        self.assertEqual(
+            ["http://host2", "http://host3", "http://host1"],
+            self.registry.candidates(self.baseurl)
+        )
+        self.registry.on_success("http://host2", 100, 1)
+        self.registry.on_success("http://host3", 200, 1)
+        self.registry.on_failure("http://host3")
+        self.registry.on_failure("http://host3")
+        self.assertEqual(
+            ["http://host2", "http://host3", "http://host1"],
+            self.registry.candidates(self.baseurl)
+        )
+
+    def test_average_throughput(self):
+        mirror = mirrors.Mirror("http://host")
+        mirror.on_success(100, 1)
+        mirror.on_success(200, 1)
+        self.assertAlmostEqual(130, mirror.throughput)
+
+    def test_success_of_unknown_size_resets_failures(self):
+        mirror = mirrors.Mirror("http://host")
+        mirror.on_failure()
+        mirror.on_success(None, 1)
+        self.assertEqual(0, mirror.failures)
+        self.assertEqual(0.0, mirror.throughput)
@@ -14,10 +14,19 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import copy
 import mock
+import os
+import shutil
 import six
+import tempfile
 
+from packetary.library.connections import Connection
+from packetary.library.connections import ConnectionsPool
+from packetary.library.connections import RangeError
+from packetary.library import inventory
 from packetary.library.repository import Repository
+from packetary.library.scheduler import Scheduler
 from packetary.tests import base
 from packetary.tests.stubs.context import Context
 from packetary.tests.stubs.driver import package_generator
@@ -28,6 +37,8 @@ class TestRepository(base.TestCase):
     def setUp(self):
         super(TestRepository, self).setUp()
         self.packages = package_generator(4, size=10)
+        for p in self.packages:
+            p.props["filename"] = p.name + ".pkg"
         self.repo = Repository(
             Context(),
             "stub",
@@ -41,15 +52,20 @@ class TestRepository(base.TestCase):
         self.repo.load_packages(url, packages.append)
         self.assertEqual(packages, self.packages)
 
-    @mock.patch("packetary.library.repository.os")
-    def test_copy_packages(self, os):
+    @mock.patch("packetary.library.repository.inventory.scan")
+    def test_copy_packages(self, scan):
         packages = self.packages
-        os.stat.side_effect = [
-            mock.MagicMock(st_size=packages[0].size),
-            mock.MagicMock(st_size=packages[1].size + 1),
-            mock.MagicMock(st_size=packages[2].size - 1),
-            OSError(2, "error")
-        ]
+        get_path = self.repo.driver.get_path
+        scan.return_value = inventory.Inventory({
+            get_path("target", packages[0]):
+                inventory.FileInfo(packages[0].size, 0),
+            get_path("target", packages[1]):
+                inventory.FileInfo(packages[1].size + 1, 0),
+            get_path("target", packages[2]) + ".part":
+                inventory.FileInfo(packages[2].size - 1, 0),
+            get_path("target", packages[3]):
+                inventory.FileInfo(packages[3].size - 1, 0),
+        })
 
         self.repo.copy_packages(packages, "target", True)
         index_writer = self.repo.driver.create_index(".")
@@ -59,18 +75,348 @@ class TestRepository(base.TestCase):
         index_writer.commit.assert_called_once_with(True)
 
         retrieve = self.repo.context.connections.get().__enter__().retrieve
-        call_args = retrieve.call_args_list
-        self.assertEqual(3, retrieve.call_count)
-        packages[1].props['size'] = 0
-        packages[2].props['size'] -= 1
-        packages[3].props['size'] = 0
-
-        for i in six.moves.range(3):
-            self.assertItemsEqual(
-                [
-                    self.repo.driver.get_path(".", packages[i + 1]),
-                    self.repo.driver.get_path("target", packages[i + 1]),
-                    packages[i + 1].size,
-                ],
-                call_args[i][0]
+        self.assertEqual(
+            [
+                mock.call(
+                    get_path(".", packages[1]),
+                    get_path("target", packages[1]), 0, 10
+                ),
+                mock.call(
+                    get_path(".", packages[2]),
+                    get_path("target", packages[2]), 9, 10
+                ),
+                mock.call(
+                    get_path(".", packages[3]),
+                    get_path("target", packages[3]), 0, 10
+                ),
+            ],
+            retrieve.call_args_list
+        )
+
+    def test_iter_packages(self):
+        self.repo.STREAM_QUEUE_SIZE = 1
+        self.assertEqual(
+            self.packages, list(self.repo.iter_packages("url1"))
+        )
+
+    def test_iter_packages_raises_error_of_loader(self):
+        self.repo.driver.load = mock.MagicMock(
+            side_effect=ValueError("invalid index")
+        )
+        with self.assertRaisesRegexp(ValueError, "invalid index"):
+            list(self.repo.iter_packages("url1"))
+
+    @mock.patch("packetary.library.repository.inventory.scan")
+    def test_copy_packages_streaming(self, scan):
+        packages = self.packages
+        get_path = self.repo.driver.get_path
+        scan.return_value = inventory.Inventory({
+            get_path("target", packages[0]):
+                inventory.FileInfo(packages[0].size, 0),
+        })
+        scheduler = Scheduler()
+        count = self.repo.copy_packages_streaming(
+            iter(packages + packages[:1]), "target", False, scheduler
+        )
+        self.assertEqual(5, count)
+        self.assertEqual(30, scheduler.total)
+        self.assertEqual(30, scheduler.done)
+        index_writer = self.repo.driver.create_index(".")
+        self.assertEqual(5, index_writer.add.call_count)
+        index_writer.commit.assert_called_once_with(False)
+        retrieve = self.repo.context.connections.get().__enter__().retrieve
+        self.assertEqual(
+            [
+                mock.call(
+                    get_path(".", p), get_path("target", p), 0, 10
+                )
+                for p in packages[1:]
+            ],
+            retrieve.call_args_list
+        )
+
+    @mock.patch("packetary.library.repository.inventory.scan")
+    def test_copy_packages_once_for_same_file(self, scan):
+        scan.return_value = inventory.Inventory({})
+        duplicate = copy.deepcopy(self.packages[0])
+        conflict = copy.deepcopy(self.packages[0])
+        conflict.props["checksum"] = ("sha1", "conflict")
+        packages = [self.packages[0], duplicate, conflict]
+        journal = mock.MagicMock()
+        self.repo.copy_packages(packages, "target", True, journal=journal)
+        index_writer = self.repo.driver.create_index(".")
+        self.assertEqual(3, index_writer.add.call_count)
+        retrieve = self.repo.context.connections.get().__enter__().retrieve
+        retrieve.assert_called_once_with(
+            "./package-0.pkg", "target/package-0.pkg", 0, 10
+        )
+        journal.plan.assert_called_once_with([
+            ("target/package-0.pkg", 10, self.packages[0].checksum)
+        ])
+
+    @mock.patch.multiple(
+        "packetary.library.repository",
+        utils=mock.DEFAULT,
+        os=mock.DEFAULT,
+    )
+    def test_copy_packages_with_batch_durability(self, utils, os):
+        self.repo.context.durability = "batch"
+        os.path.exists.return_value = True
+        self.repo.copy_packages(self.packages, "target", True)
+        utils.syncfs.assert_called_once_with("target")
+
+    @mock.patch("packetary.library.repository.inventory.scan")
+    def test_copy_packages_with_journal(self, scan):
+        packages = self.packages[:3]
+        get_path = self.repo.driver.get_path
+        scan.return_value = inventory.Inventory({
+            get_path("target", packages[0]):
+                inventory.FileInfo(packages[0].size, 0),
+            get_path("target", packages[1]):
+                inventory.FileInfo(packages[1].size, 0),
+            get_path("target", packages[2]) + ".part":
+                inventory.FileInfo(packages[2].size - 1, 0),
+        })
+        journal = mock.MagicMock()
+        journal.is_interrupted.side_effect = [False, True]
+        self.repo._is_valid = mock.MagicMock(
+            side_effect=[False, True, True, True]
+        )
+        self.repo.copy_packages(packages, "target", True, journal=journal)
+        journal.plan.assert_called_once_with([
+            (get_path("target", p), p.size, p.checksum) for p in packages
+        ])
+        retrieve = self.repo.context.connections.get().__enter__().retrieve
+        self.assertEqual(
+            [
+                mock.call("./package-1.pkg", "target/package-1.pkg", 0, 10),
+                mock.call("./package-2.pkg", "target/package-2.pkg", 9, 10),
+            ],
+            retrieve.call_args_list
+        )
+        self.assertEqual(
+            [mock.call("target/package-1.pkg"),
+             mock.call("target/package-2.pkg")],
+            journal.done.call_args_list
+        )
+
+    def test_copy_packages_with_store(self):
+        store = self.repo.context.store = mock.MagicMock()
+        store.link.side_effect = [True, False]
+        self.repo._is_valid = mock.MagicMock(return_value=True)
+        self.repo.copy_packages(self.packages[:2], "target", True)
+        retrieve = self.repo.context.connections.get().__enter__().retrieve
+        retrieve.assert_called_once_with(
+            "./package-1.pkg", "target/package-1.pkg", 0, 10
+        )
+        store.add.assert_called_once_with(
+            self.packages[1].checksum, "target/package-1.pkg"
+        )
+
+    def test_download_again_if_file_is_corrupted(self):
+        store = self.repo.context.store = mock.MagicMock()
+        store.link.return_value = False
+        self.repo._is_valid = mock.MagicMock(return_value=False)
+        self.repo._verify_checksum = mock.MagicMock()
+        self.repo.copy_packages(self.packages[:1], "target", True)
+        retrieve = self.repo.context.connections.get().__enter__().retrieve
+        self.assertEqual(2, retrieve.call_count)
+        self.repo._verify_checksum.assert_called_once_with(
+            self.packages[0], "target/package-0.pkg"
+        )
+        store.add.assert_called_once_with(
+            self.packages[0].checksum, "target/package-0.pkg"
+        )
+
+    @mock.patch("packetary.library.repository.os")
+    def test_remove_file_if_it_is_corrupted_again(self, os):
+        store = self.repo.context.store = mock.MagicMock()
+        store.link.return_value = False
+        self.repo._is_valid = mock.MagicMock(return_value=False)
+        self.repo._verify_checksum = mock.MagicMock(
+            side_effect=IOError("Checksum mismatch")
+        )
+        with self.assertRaisesRegexp(IOError, "Checksum mismatch"):
+            self.repo._copy_scheduled(
+                Scheduler(), None, self.packages[0], "target", 0
+            )
+        os.remove.assert_called_once_with("target/package-0.pkg")
+        self.assertEqual(0, store.add.call_count)
+
+    @mock.patch("packetary.library.repository.os")
+    def test_copy_package_from_next_mirror(self, os):
+        package = self.packages[0]
+        mirrors = self.repo.context.mirrors
+        mirrors.register(["mirror1", "mirror2"])
+        package.props["baseurl"] = "mirror1"
+        os.path.getsize.return_value = 5
+        retrieve = self.repo.context.connections.get().__enter__().retrieve
+        retrieve.side_effect = [IOError("error"), None]
+        self.repo._copy_package(package, "target", 0)
+        self.assertEqual(
+            [
+                mock.call(
+                    "mirror1/package-0.pkg", "target/package-0.pkg", 0, 10
+                ),
+                mock.call(
+                    "mirror2/package-0.pkg", "target/package-0.pkg", 5, 10
+                ),
+            ],
+            retrieve.call_args_list
+        )
+        os.path.getsize.assert_called_once_with("target/package-0.pkg.part")
+        self.assertEqual(1, mirrors.mirrors["mirror1"].failures)
+        self.assertIsNotNone(mirrors.mirrors["mirror2"].throughput)
+
+    def test_copy_package_fails_if_all_mirrors_fail(self):
+        package = self.packages[0]
+        self.repo.context.mirrors.register(["mirror1", "mirror2"])
+        package.props["baseurl"] = "mirror1"
+        retrieve = self.repo.context.connections.get().__enter__().retrieve
+        retrieve.side_effect = IOError("error")
+        with self.assertRaises(IOError):
+            self.repo._copy_package(package, "target", 0)
+        self.assertEqual(2, retrieve.call_count)
+
+    @mock.patch.multiple(
+        "packetary.library.repository",
+        os=mock.DEFAULT,
+        open=mock.DEFAULT,
+        create=True,
+    )
+    def test_copy_package_by_segments(self, os, open):
+        self.repo.context.segment_threshold = 10
+        self.repo.context.segment_count = 3
+        package = self.packages[0]
+        package.props["checksum"] = ("md5", "098f6bcd4621d373cade4e832627b4f6")
+        open.return_value = six.BytesIO(b"test")
+        connection = self.repo.context.connections.get().__enter__()
+        connection.open_file.return_value = 1
+        self.repo._copy_package(package, "target", 0)
+        connection.open_stream.assert_called_once_with(
+            "./package-0.pkg", 0, 3
+        )
+        connection.open_file.assert_called_once_with(
+            "target/package-0.pkg.part", 10
+        )
+        self.assertEqual(
+            [
+                mock.call("./package-0.pkg", 1, 4, 7),
+                mock.call("./package-0.pkg", 1, 8, 9),
+                mock.call(
+                    "./package-0.pkg", 1, 0, 3,
+                    connection.open_stream.return_value
+                ),
+            ],
+            connection.retrieve_range.call_args_list
+        )
+        os.fsync.assert_called_once_with(1)
+        os.close.assert_called_once_with(1)
+        os.rename.assert_called_once_with(
+            "target/package-0.pkg.part", "target/package-0.pkg"
+        )
+
+        open.return_value = six.BytesIO(b"corrupted")
+        with self.assertRaisesRegexp(IOError, "Checksum mismatch"):
+            self.repo._copy_package(package, "target", 0)
+
+    @mock.patch.multiple(
+        Connection,
+        retrieve=mock.DEFAULT,
+        open_stream=mock.DEFAULT,
+    )
+    def test_copy_package_by_segments_without_free_connections(
+            self, retrieve, open_stream):
+        self.repo.context.segment_threshold = 10
+        self.repo.context.connections = ConnectionsPool(count=1)
+        self.repo._copy_package(self.packages[0], "target", 0)
+        retrieve.assert_called_once_with(
+            "./package-0.pkg", "target/package-0.pkg", 0, 10
+        )
+        self.assertEqual(0, open_stream.call_count)
+        self.assertEqual(1, self.repo.context.connections.free.qsize())
+
+    @mock.patch.multiple(
+        Connection,
+        open_stream=mock.DEFAULT,
+        open_file=mock.DEFAULT,
+        retrieve_range=mock.DEFAULT,
+    )
+    @mock.patch("packetary.library.repository.os")
+    def test_copy_package_by_free_connections_only(self, os, **kwargs):
+        self.repo.context.segment_threshold = 10
+        self.repo.context.connections = ConnectionsPool(count=2)
+        self.repo._verify_checksum = mock.MagicMock()
+        self.repo._copy_package(self.packages[0], "target", 0)
+        # the segments are limited by number of free connections
+        kwargs["open_stream"].assert_called_once_with(
+            "./package-0.pkg", 0, 4
+        )
+        self.assertEqual(2, kwargs["retrieve_range"].call_count)
+        self.assertEqual(2, self.repo.context.connections.free.qsize())
+
+    def test_copy_package_by_segments_if_ranges_not_supported(self):
+        self.repo.context.segment_threshold = 10
+        connection = self.repo.context.connections.get().__enter__()
+        connection.open_stream.side_effect = RangeError("error")
+        self.repo._copy_package(self.packages[0], "target", 0)
+        connection.retrieve.assert_called_once_with(
+            "./package-0.pkg", "target/package-0.pkg", 0, 10
+        )
+        self.assertEqual(0, connection.open_file.call_count)
+
+
+class TestInventory(base.TestCase):
+    @mock.patch("packetary.library.inventory.tpool")
+    @mock.patch("packetary.library.inventory._listdir")
+    def test_scan(self, listdir, tpool):
+        tpool.execute.side_effect = lambda f, *args: f(*args)
+        listdir.side_effect = [
+            [
+                ("pool", "/root/pool", True, None),
+                ("Release", "/root/Release", False,
+                 mock.MagicMock(st_size=1, st_mtime=2)),
+            ],
+            [
+                ("main", "/root/pool/main", True, None),
+                ("a.deb", "/root/pool/a.deb", False,
+                 mock.MagicMock(st_size=10, st_mtime=20)),
+            ],
+            OSError(2, "error"),
+        ]
+        files = inventory.scan("/root", Context().async_section())
+        self.assertEqual(2, len(files))
+        self.assertEqual((1, 2), files.get("/root/Release"))
+        self.assertEqual((10, 20), files.get("/root/./pool/a.deb"))
+        self.assertIsNone(files.get("/root/pool/main"))
+
+    def test_scan_missing_directory(self):
+        files = inventory.scan("/non-existing", Context().async_section())
+        self.assertEqual(0, len(files))
+
+    def test_remove(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        files = dict()
+        for i in range(5):
+            filepath = os.path.join(root, "{0}.deb".format(i))
+            with open(filepath, "wb") as stream:
+                stream.write(b"0" * i)
+            files[filepath] = inventory.FileInfo(i, 0)
+        files[os.path.join(root, "missing.deb")] = inventory.FileInfo(0, 0)
+        with mock.patch.object(inventory, "REMOVE_BATCH_SIZE", 2):
+            self.assertEqual(
+                (6, 10), inventory.remove(files, Context().async_section())
             )
+        self.assertEqual([], os.listdir(root))
+
+    @mock.patch("packetary.library.inventory.os")
+    def test_remove_dry_run(self, os):
+        files = {
+            "/root/a.deb": inventory.FileInfo(1, 0),
+            "/root/b.deb": inventory.FileInfo(2, 0),
+        }
+        self.assertEqual(
+            (2, 3), inventory.remove(files, Context().async_section(), True)
+        )
+        self.assertEqual(0, os.remove.call_count)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from packetary.library import scheduler
+from packetary.tests import base
+from packetary.tests.stubs.package import Package
+
+
+class TestScheduler(base.TestCase):
+    def setUp(self):
+        super(TestScheduler, self).setUp()
+        self.tasks = [
+            (Package(name="small", size=1, baseurl="http://host1"), 0),
+            (Package(name="big", size=100, baseurl="http://host1"), 0),
+            (Package(name="middle", size=50, baseurl="http://host2"), 0),
+            (Package(name="resumed", size=200, baseurl="http://host1"), 190),
+        ]
+
+    def _get_names(self, tasks):
+        return [x[0].name for x in tasks]
+
+    def test_index_order(self):
+        s = scheduler.Scheduler()
+        self.assertEqual(self.tasks, s.plan(self.tasks))
+        self.assertEqual(161, s.total)
+
+    def test_largest_first(self):
+        s = scheduler.Scheduler("largest-first")
+        self.assertEqual(
+            ["big", "middle", "resumed", "small"],
+            self._get_names(s.plan(self.tasks))
+        )
+
+    def test_bootstrap_first(self):
+        s = scheduler.Scheduler("bootstrap-first", ["middle", "resumed"])
+        self.assertEqual(
+            ["middle", "resumed", "small", "big"],
+            self._get_names(s.plan(self.tasks))
+        )
+
+    def test_prioritize(self):
+        s = scheduler.Scheduler("bootstrap-first")
+        s.prioritize(["big"])
+        self.assertEqual(
+            ["big", "small", "middle", "resumed"],
+            self._get_names(s.plan(self.tasks))
+        )
+
+    def test_round_robin(self):
+        s = scheduler.Scheduler("round-robin")
+        self.assertEqual(
+            ["small", "middle", "big", "resumed"],
+            self._get_names(s.plan(self.tasks))
+        )
+
+    @mock.patch("packetary.library.scheduler.time")
+    def test_predict_completion_without_plan(self, time):
+        time.time.side_effect = [10, 20]
+        s = scheduler.Scheduler()
+        s.start()
+        for task in self.tasks:
+            s.add(task)
+        self.assertEqual(161, s.total)
+        s.on_complete(100)
+        self.assertAlmostEqual(16.1, s.predicted)
+
+    def test_unsupported_policy(self):
+        with self.assertRaisesRegexp(ValueError, "Unsupported"):
+            scheduler.Scheduler("unknown")
+
+    @mock.patch("packetary.library.scheduler.time")
+    def test_predict_completion(self, time):
+        time.time.side_effect = [10, 20, 50]
+        s = scheduler.Scheduler()
+        s.plan(self.tasks)
+        s.on_complete(1)
+        self.assertIsNone(s.predicted)
+        s.on_complete(160)
+        self.assertEqual(10, s.predicted)
+        self.assertEqual((10, 40), s.report())
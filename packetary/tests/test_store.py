@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+
+from packetary.library import store
+from packetary.tests import base
+
+
+class TestPackageStore(base.TestCase):
+    def setUp(self):
+        super(TestPackageStore, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.store = store.PackageStore(os.path.join(self.root, "store"))
+        self.checksum = ("SHA256", "abcdef")
+
+    def _create_file(self, path, data=b"data"):
+        path = os.path.join(self.root, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as stream:
+            stream.write(data)
+        return path
+
+    def test_get_path(self):
+        self.assertEqual(
+            os.path.join(self.root, "store", "sha256", "ab", "abcdef"),
+            self.store.get_path(self.checksum)
+        )
+        self.assertIsNone(self.store.get_path((None, None)))
+
+    def test_add_and_link(self):
+        src = self._create_file("mirror1/pool/a.deb")
+        dst = os.path.join(self.root, "mirror2", "pool", "a.deb")
+        self.assertFalse(self.store.link(self.checksum, dst))
+        self.store.add(self.checksum, src)
+        self.store.add(self.checksum, src)
+        self.assertTrue(self.store.link(self.checksum, dst))
+        self.assertEqual(3, os.stat(dst).st_nlink)
+        self.assertEqual(os.stat(src).st_ino, os.stat(dst).st_ino)
+        self.assertFalse(os.path.exists(dst + ".tmp"))
+
+    def test_link_replaces_partial_file(self):
+        src = self._create_file("mirror1/pool/a.deb")
+        dst = self._create_file("mirror2/pool/a.deb", b"da")
+        self.store.add(self.checksum, src)
+        self.assertTrue(self.store.link(self.checksum, dst))
+        with open(dst, "rb") as stream:
+            self.assertEqual(b"data", stream.read())
+
+    def test_collect_garbage(self):
+        src1 = self._create_file("mirror1/pool/a.deb")
+        src2 = self._create_file("mirror1/pool/b.deb", b"other")
+        self.store.add(self.checksum, src1)
+        self.store.add(("md5", "123456"), src2)
+        os.remove(src2)
+        self.assertEqual((1, 5), self.store.collect_garbage())
+        self.assertTrue(os.path.exists(self.store.get_path(self.checksum)))
+        self.assertFalse(
+            os.path.exists(self.store.get_path(("md5", "123456")))
+        )
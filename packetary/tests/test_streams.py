@@ -15,6 +15,7 @@
 #    under the License.
 
 import gzip
+import hashlib
 import six
 
 from packetary.library import streams
@@ -53,6 +54,33 @@ class TestBufferedStream(base.TestCase):
             [b"line1\n", b"line2\n", b"line3\n"],
             lines)
 
+    def test_read_all(self):
+        self.stream.CHUNK_SIZE = 4
+        self.stream.readline()
+        self.assertEqual(b"line2\nline3\n", self.stream.read())
+        self.assertEqual(b"", self.stream.read())
+
+    def test_readinto(self):
+        self.stream.CHUNK_SIZE = 4
+        buf = bytearray(8)
+        self.assertEqual(8, self.stream.readinto(buf))
+        self.assertEqual(b"line1\nli", bytes(buf))
+        self.assertEqual(b"", self.stream.unread_tail)
+        self.assertEqual(b"ne", self.stream.read(2))
+        self.assertEqual(b"2\n", self.stream.unread_tail)
+        view = memoryview(buf)
+        self.assertEqual(2, self.stream.readinto(view[:4]))
+        self.assertEqual(b"2\n", bytes(buf[:2]))
+        self.assertEqual(6, self.stream.readinto(buf))
+        self.assertEqual(b"line3\n", bytes(buf[:6]))
+        self.assertEqual(0, self.stream.readinto(buf))
+
+    def test_readline_without_end_of_line(self):
+        stream = streams.StreamWrapper(six.BytesIO(b"line1\nline2"), 3)
+        self.assertEqual(
+            [b"line1\n", b"line2"], list(stream.readlines())
+        )
+
 
 class TestGzipDecompress(base.TestCase):
     @classmethod
@@ -91,3 +119,24 @@ class TestGzipDecompress(base.TestCase):
         self.assertEqual(
             [b"line1\n", b"line2\n", b"line3\n"],
             lines)
+
+    def test_read_with_small_chunks(self):
+        stream = streams.GzipDecompress(self.gzipped, chunk_size=2)
+        self.assertEqual(
+            [b"line1\n", b"line2\n", b"line3\n"], list(stream.readlines())
+        )
+
+
+class TestHashingWriter(base.TestCase):
+    def test_write(self):
+        stream = six.BytesIO()
+        writer = streams.HashingWriter(stream, ["md5", "sha256"])
+        writer.write(b"line1\n")
+        writer.write(b"line2\n")
+        self.assertEqual(b"line1\nline2\n", stream.getvalue())
+        self.assertEqual(12, writer.size)
+        self.assertEqual(
+            [hashlib.md5(b"line1\nline2\n").hexdigest(),
+             hashlib.sha256(b"line1\nline2\n").hexdigest()],
+            writer.hexdigest()
+        )
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import os
+import tempfile
+
+from packetary.library import utils
+from packetary.tests import base
+
+
+class TestUtils(base.TestCase):
+    def test_preallocate_keeps_size(self):
+        with tempfile.NamedTemporaryFile() as stream:
+            stream.write(b"data")
+            stream.flush()
+            utils.preallocate(stream.fileno(), 4, 1024 * 1024)
+            self.assertEqual(4, os.fstat(stream.fileno()).st_size)
+
+    @mock.patch("packetary.library.utils._fallocate", None)
+    def test_preallocate_not_supported(self):
+        self.assertFalse(utils.preallocate(0, 0, 100))
+
+    @mock.patch("packetary.library.utils._syncfs")
+    def test_syncfs(self, syncfs):
+        syncfs.return_value = 0
+        utils.syncfs(tempfile.gettempdir())
+        self.assertEqual(1, syncfs.call_count)
+
+    def test_copy_range(self):
+        with tempfile.NamedTemporaryFile() as src:
+            with tempfile.NamedTemporaryFile() as dst:
+                src.write(b"0123456789")
+                src.flush()
+                dst.write(b"012")
+                dst.flush()
+                copied = utils.copy_range(src.fileno(), dst.fileno(), 3, 7)
+                self.assertEqual(7, copied)
+                dst.seek(0)
+                self.assertEqual(b"0123456789", dst.read())
+
+    @mock.patch("packetary.library.utils._copy_chunk")
+    def test_copy_range_falls_back_to_read_write(self, copy_chunk):
+        copy_chunk.side_effect = OSError(18, "Invalid cross-device link")
+        with tempfile.NamedTemporaryFile() as src:
+            with tempfile.NamedTemporaryFile() as dst:
+                src.write(b"data")
+                src.flush()
+                utils.copy_range(src.fileno(), dst.fileno(), 0, 4)
+                dst.seek(0)
+                self.assertEqual(b"data", dst.read())
+
+    @mock.patch("packetary.library.utils._BUFFER_SIZE", 3)
+    @mock.patch("packetary.library.utils.os.write")
+    def test_read_write_handles_short_writes(self, write):
+        written = []
+
+        def short_write(fd, data):
+            written.append(bytes(data[:2]))
+            return len(written[-1])
+
+        write.side_effect = short_write
+        with tempfile.NamedTemporaryFile() as src:
+            src.write(b"0123456789")
+            src.flush()
+            self.assertEqual(
+                8, utils._read_write(src.fileno(), 1, 2, 100)
+            )
+        self.assertEqual(b"23456789", b"".join(written))
+
+    @mock.patch("packetary.library.utils.fcntl")
+    def test_reflink_not_supported(self, fcntl):
+        fcntl.ioctl.side_effect = IOError(95, "Operation not supported")
+        self.assertFalse(utils.reflink(1, 2))
+        fcntl.ioctl.assert_called_once_with(2, utils._FICLONE, 1)
@@ -16,21 +16,39 @@
 
 from __future__ import with_statement
 
+import gzip
+import hashlib
+import lxml.etree as etree
 import mock
+import os
 import os.path as path
+import shutil
+import tempfile
 
-
+from packetary.library import inventory
 from packetary.library.drivers import yum_driver
 from packetary.library.drivers import yum_package
+from packetary.library.manifest import Manifest
+from packetary.library.manifest import ManifestEntry
 from packetary.library.package import Relation
 from packetary.tests import base
 from packetary.tests.stubs.context import Context
+from packetary.tests.stubs.driver import bind_mirrors
 
 
 REPOMD = path.join(path.dirname(__file__), "data", "repomd.xml")
 PRIMARY_DB = path.join(path.dirname(__file__), "data", "primary.xml.gz")
 
 
+def _load_records():
+    with open(PRIMARY_DB, "rb") as stream:
+        tree = etree.parse(gzip.GzipFile(fileobj=stream))
+    return [
+        yum_package.YumPackage(x, "/root", "os").record
+        for x in tree.iterfind("./main:package", yum_driver._namespaces)
+    ]
+
+
 class TestYumDriver(base.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -53,6 +71,25 @@ class TestYumDriver(base.TestCase):
             self.driver.get_path(None, package)
         )
 
+    def test_load_from_next_mirror(self):
+        driver = yum_driver.Driver(Context(), "x86_64")
+        baseurl = driver.mirrors.register(
+            ["http://host1/centos", "http://host2/centos"]
+        )
+        connection = driver.connections.connection
+        packages = []
+        with open(REPOMD, "rb") as repomd:
+            with open(PRIMARY_DB, "rb") as primary:
+                connection.open_stream.side_effect = [
+                    IOError("dead"), repomd, primary
+                ]
+                driver.load(baseurl, "os", packages.append)
+        connection.open_stream.assert_any_call(
+            "http://host2/centos/os/x86_64/repodata/primary.xml.gz"
+        )
+        self.assertEqual(1, len(packages))
+        self.assertEqual("http://host1/centos", packages[0].baseurl)
+
     def test_load(self):
         packages = []
         connection = self.driver.connections.connection
@@ -115,12 +152,28 @@ class TestYumDriver(base.TestCase):
             ])
         )
 
+    def test_parse_urls_with_mirrors(self):
+        self.assertEqual(
+            [["http://host1/centos", "os"]],
+            list(self.driver.parse_urls([
+                "http://host1/centos/os|http://host2/centos/os/",
+            ]))
+        )
+        self.assertEqual(
+            ["http://host1/centos", "http://host2/centos"],
+            self.driver.mirrors.candidates("http://host1/centos")
+        )
+        with self.assertRaisesRegexp(ValueError, "Invalid url:"):
+            next(self.driver.parse_urls([
+                "http://host1/centos/os|http://host2/centos/updates"
+            ]))
+
 
 @mock.patch.multiple(
     "packetary.library.drivers.yum_driver",
     os=mock.DEFAULT,
-    subprocess=mock.DEFAULT,
-    createrepo="createrepo"
+    RepodataWriter=mock.DEFAULT,
+    Manifest=mock.MagicMock(**{"return_value.load.return_value": None}),
 )
 class TestYumIndexWriter(base.TestCase):
     def setUp(self):
@@ -142,31 +195,201 @@ class TestYumIndexWriter(base.TestCase):
             self.writer.repos[package.reponame]
         )
 
-    def test_commit(self, os, subprocess, **_):
+    def test_commit(self, os, RepodataWriter, **_):
         package = mock.MagicMock(reponame="os", filename="test.rpm")
         self.writer.add(package)
         os.path.join = path.join
         os.path.exists.return_value = True
         self.writer.commit(True)
 
-        subprocess.check_call.assert_called_once_with(
-            ["createrepo", "/root/os/x86_64", "--update"]
+        RepodataWriter.assert_called_once_with(
+            self.writer.driver, "/root/os/x86_64", "os",
+            self.writer.driver.compression_level
+        )
+        self.assertEqual(
+            [package],
+            list(RepodataWriter.return_value.write.call_args[0][0])
         )
         self.assertEqual(0, os.remove.call_count)
 
-    def test_commit_with_cleanup(self, os, subprocess, **_):
+    @mock.patch("packetary.library.drivers.yum_driver.inventory")
+    def test_commit_with_cleanup(self, inventory_, os, RepodataWriter, **_):
         package = mock.MagicMock(reponame="os", filename="test.rpm")
         self.writer.add(package)
         os.path.join = path.join
-        os.path.exists.return_value = True
-        self.writer.driver.load = \
-            lambda *x: x[-1](
-                mock.MagicMock(reponame="os", filename="test2.rpm")
-            )
-        self.writer.driver.get_path.return_value = "/root/os/x86_64/test2.rpm"
+        os.path.normpath = path.normpath
+        inventory_.scan.return_value = inventory.Inventory({
+            "/root/os/x86_64/test.rpm": inventory.FileInfo(1, 0),
+            "/root/os/x86_64/test2.rpm": inventory.FileInfo(2, 0),
+            "/root/os/x86_64/repodata/repomd.xml": inventory.FileInfo(3, 0),
+        })
+        self.writer.commit(False)
+
+        driver = self.writer.driver
+        inventory_.scan.assert_called_once_with(
+            "/root/os/x86_64", driver.async_section.return_value
+        )
+        inventory_.remove.assert_called_once_with(
+            {"/root/os/x86_64/test2.rpm": inventory.FileInfo(2, 0)},
+            driver.async_section.return_value, driver.clean_dry_run
+        )
+        # the existing metadata is not required to clean repository
+        self.assertEqual(0, driver.load.call_count)
+        RepodataWriter.return_value.write.assert_called_once_with(
+            mock.ANY, []
+        )
+
+
+class TestYumIndexWriterPassthrough(base.TestCase):
+    def setUp(self):
+        super(TestYumIndexWriterPassthrough, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.upstream = path.join(self.root, "upstream")
+        self.destination = path.join(self.root, "mirror")
+        driver = mock.MagicMock(
+            arch="x86_64", compression_level=1, clean_dry_run=False,
+            async_section=Context().async_section
+        )
+        driver.fetch.side_effect = self._fetch
+        bind_mirrors(driver)
+        self.writer = yum_driver.YumIndexWriter(
+            driver, self.destination, True
+        )
+        repodata = path.join(self.upstream, "os", "x86_64", "repodata")
+        os.makedirs(repodata)
+        shutil.copy(PRIMARY_DB, repodata)
+        with open(PRIMARY_DB, "rb") as stream:
+            self._create_repomd(hashlib.sha256(stream.read()).hexdigest())
+        self.package = mock.MagicMock(
+            reponame="os", filename="Packages/test.rpm",
+            baseurl=self.upstream, version="0:1.0-1", size=100,
+            checksum=("sha256", "1234")
+        )
+        self.package.name = "test"
+        self.package.record = _load_records()[0]
+
+    def _create_repomd(self, sha256):
+        with open(REPOMD, "rb") as stream:
+            content = stream.read()
+        content = content.replace(
+            b"1386c5af55bda40669bb5ed91e0a22796c3ed7325367506"
+            b"109b09ea2657f22bd",
+            sha256.encode()
+        )
+        filepath = path.join(
+            self.upstream, "os", "x86_64", "repodata", "repomd.xml"
+        )
+        with open(filepath, "wb") as stream:
+            stream.write(content)
+
+    def _create_file(self, name):
+        filepath = path.join(self.destination, "os", "x86_64", name)
+        if not path.exists(path.dirname(filepath)):
+            os.makedirs(path.dirname(filepath))
+        with open(filepath, "wb") as stream:
+            stream.write(b"data")
+        return filepath
+
+    def _fetch(self, url, filepath, optional=False):
+        if not path.exists(path.dirname(filepath)):
+            os.makedirs(path.dirname(filepath))
+        shutil.copy(url, filepath)
+        return True
+
+    @mock.patch("packetary.library.drivers.yum_driver.RepodataWriter")
+    def test_publish_upstream(self, RepodataWriter):
+        self._create_file("Packages/test.rpm")
+        dirty = self._create_file("Packages/dirty.rpm")
+        outdated = self._create_file("repodata/outdated-primary.xml.gz")
+        self.writer.add(self.package)
         self.writer.commit(False)
+        self.assertEqual(0, RepodataWriter.call_count)
+        self.assertFalse(path.exists(dirty))
+        repodata = path.join(self.destination, "os", "x86_64", "repodata")
+        self.assertEqual(
+            ["primary.xml.gz", "repomd.xml"], sorted(os.listdir(repodata))
+        )
+        self.assertFalse(path.exists(outdated))
+
+    def _get_primary(self):
+        repomd = path.join(
+            self.destination, "os", "x86_64", "repodata", "repomd.xml"
+        )
+        tree = etree.parse(repomd)
+        href = tree.find(
+            "./md:data[@type='primary']/md:location", yum_driver._namespaces
+        ).attrib["href"]
+        return href
 
-        subprocess.check_call.assert_called_once_with(
-            ["createrepo", "/root/os/x86_64", "--update"]
+    def test_regenerate_if_package_is_missing(self):
+        self.writer.add(self.package)
+        self.writer.commit(False)
+        self.assertNotEqual("repodata/primary.xml.gz", self._get_primary())
+
+    def test_regenerate_if_checksum_mismatch(self):
+        self._create_file("Packages/test.rpm")
+        self._create_repomd("0" * 64)
+        self.writer.add(self.package)
+        self.writer.commit(False)
+        self.assertNotEqual("repodata/primary.xml.gz", self._get_primary())
+
+
+class TestYumIndexWriterManifest(base.TestCase):
+    def setUp(self):
+        super(TestYumIndexWriterManifest, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.path = path.join(self.root, "os", "x86_64")
+        os.makedirs(path.join(self.path, "repodata"))
+        self.repomd = path.join(self.path, "repodata", "repomd.xml")
+        with open(self.repomd, "wb"):
+            pass
+        self.driver = mock.MagicMock(
+            arch="x86_64", clean_dry_run=False,
+            async_section=Context().async_section
+        )
+
+    def _make_package(self, name):
+        package = mock.MagicMock(
+            reponame="os", filename="Packages/{0}.rpm".format(name),
+            version="0:1.0-1", size=1, checksum=("sha256", "1234")
+        )
+        package.name = name
+        filepath = path.join(self.path, package.filename)
+        if not path.exists(path.dirname(filepath)):
+            os.makedirs(path.dirname(filepath))
+        with open(filepath, "wb"):
+            pass
+        return package
+
+    def _commit(self, packages, keep_existing):
+        writer = yum_driver.YumIndexWriter(self.driver, self.root)
+        for p in packages:
+            writer.add(p)
+        with mock.patch.object(yum_driver, "RepodataWriter") as repodata:
+            repodata.return_value.write.side_effect = lambda x, y: [
+                ManifestEntry.from_package(p) for p in x
+            ] + y
+            writer.commit(keep_existing)
+
+    def _load_manifest(self):
+        return Manifest(self.path, self.repomd).load()
+
+    def test_save_manifest_with_kept_packages(self):
+        self._commit([self._make_package("a")], True)
+        self._commit([self._make_package("b")], True)
+        self.assertEqual(1, self.driver.load.call_count)
+        self.assertEqual(
+            ["Packages/a.rpm", "Packages/b.rpm"],
+            sorted(x.filename for x in self._load_manifest())
+        )
+
+    def test_remove_dirty_files_from_manifest(self):
+        self._commit([self._make_package("a")], False)
+        self._commit([self._make_package("b")], False)
+        self.assertEqual(0, self.driver.load.call_count)
+        self.assertFalse(path.exists(path.join(self.path, "Packages/a.rpm")))
+        self.assertEqual(
+            ["Packages/b.rpm"], [x.filename for x in self._load_manifest()]
         )
-        os.remove.assert_called_with("/root/os/x86_64/test2.rpm")
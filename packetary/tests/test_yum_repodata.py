@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import gzip
+import hashlib
+import lxml.etree as etree
+import mock
+import os
+import os.path as path
+import shutil
+import tempfile
+
+from packetary.library.drivers import yum_package
+from packetary.library.drivers import yum_repodata
+from packetary.library.manifest import ManifestEntry
+from packetary.tests import base
+from packetary.tests.stubs.driver import bind_mirrors
+
+
+PRIMARY_DB = path.join(path.dirname(__file__), "data", "primary.xml.gz")
+
+PKGID = "e8ed9e0612e813491ed5e7c10502a39e43ec665afd1321541dea211202707a65"
+
+FILELISTS = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<filelists xmlns="http://linux.duke.edu/metadata/filelists" '
+    'packages="2">\n'
+    '<package pkgid="other" name="other" arch="x86_64">'
+    '<version epoch="0" ver="1" rel="1"/><file>/usr/bin/other</file>'
+    '</package>\n'
+    '<package pkgid="{0}" name="test" arch="x86_64">'
+    '<version epoch="0" ver="1.1.1.1" rel="1.el7"/>'
+    '<file>/usr/bin/test</file><file type="dir">/usr/share/test</file>'
+    '</package>\n'
+    '</filelists>\n'
+).format(PKGID)
+
+REPOMD = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<repomd xmlns="http://linux.duke.edu/metadata/repo">\n'
+    '<data type="primary"><location href="repodata/primary.xml.gz"/></data>'
+    '<data type="filelists">'
+    '<location href="repodata/filelists.xml.gz"/></data>'
+    '</repomd>\n'
+)
+
+_namespaces = dict(yum_repodata._namespaces)
+
+
+def _read_gzip(filepath):
+    with open(filepath, "rb") as stream:
+        return gzip.GzipFile(fileobj=stream).read()
+
+
+class TestRepodataWriter(base.TestCase):
+    def setUp(self):
+        super(TestRepodataWriter, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.upstream = path.join(self.root, "upstream")
+        self.path = path.join(self.root, "mirror", "os", "x86_64")
+        repodata = path.join(self.upstream, "os", "x86_64", "repodata")
+        os.makedirs(repodata)
+        shutil.copy(PRIMARY_DB, repodata)
+        with open(path.join(repodata, "repomd.xml"), "w") as stream:
+            stream.write(REPOMD)
+        with open(path.join(repodata, "filelists.xml.gz"), "wb") as stream:
+            with gzip.GzipFile(fileobj=stream, mode="wb") as gz:
+                gz.write(FILELISTS.encode("utf-8"))
+        self.driver = mock.MagicMock(arch="x86_64")
+        self.driver.fetch.side_effect = self._fetch
+        bind_mirrors(self.driver)
+        with open(PRIMARY_DB, "rb") as stream:
+            tree = etree.parse(gzip.GzipFile(fileobj=stream))
+        self.package = yum_package.YumPackage(
+            tree.find("./main:package", _namespaces), self.upstream, "os"
+        )
+
+    @staticmethod
+    def _fetch(url, filepath, optional=False):
+        shutil.copy(url, filepath)
+        return True
+
+    def _write(self, packages, published=None):
+        writer = yum_repodata.RepodataWriter(
+            self.driver, self.path, "os", level=1
+        )
+        return writer.write(packages, published)
+
+    def _get_metadata(self):
+        """Gets the content of metadata files listed in repomd.xml."""
+        tree = etree.parse(path.join(self.path, "repodata", "repomd.xml"))
+        metadata = dict()
+        for node in tree.iterfind("./md:data", _namespaces):
+            href = node.find("./md:location", _namespaces).attrib["href"]
+            filepath = path.join(self.path, href)
+            with open(filepath, "rb") as stream:
+                data = stream.read()
+            self.assertEqual(
+                hashlib.sha256(data).hexdigest(),
+                node.findtext("./md:checksum", namespaces=_namespaces)
+            )
+            self.assertEqual(
+                str(len(data)),
+                node.findtext("./md:size", namespaces=_namespaces)
+            )
+            content = _read_gzip(filepath)
+            self.assertEqual(
+                hashlib.sha256(content).hexdigest(),
+                node.findtext("./md:open-checksum", namespaces=_namespaces)
+            )
+            metadata[node.attrib["type"]] = etree.fromstring(content)
+        return metadata
+
+    def test_write_metadata(self):
+        entries = self._write([self.package])
+        self.assertEqual(
+            [ManifestEntry.from_package(self.package)], entries
+        )
+        metadata = self._get_metadata()
+        self.assertItemsEqual(
+            ["primary", "filelists", "other"], metadata
+        )
+        for kind in metadata:
+            self.assertEqual("1", metadata[kind].attrib["packages"])
+        self.assertEqual(
+            PKGID,
+            metadata["primary"].findtext(
+                "./main:package/main:checksum", namespaces=_namespaces
+            )
+        )
+        # the record is copied from upstream
+        self.assertEqual(
+            ["/usr/bin/test", "/usr/share/test"],
+            [x.text for x in metadata["filelists"].iterfind(
+                "./filelists:package/filelists:file", _namespaces
+            )]
+        )
+        # the other metadata is missing in upstream
+        self.assertEqual(
+            PKGID,
+            metadata["other"].find(
+                "./other:package", _namespaces
+            ).attrib["pkgid"]
+        )
+
+    def test_copy_records_from_next_mirror(self):
+        baseurl = self.driver.mirrors.register(["/dead", self.upstream])
+        with open(PRIMARY_DB, "rb") as stream:
+            tree = etree.parse(gzip.GzipFile(fileobj=stream))
+        package = yum_package.YumPackage(
+            tree.find("./main:package", _namespaces), baseurl, "os"
+        )
+        self._write([package])
+        self.assertEqual(
+            ["/usr/bin/test", "/usr/share/test"],
+            [x.text for x in self._get_metadata()["filelists"].iterfind(
+                "./filelists:package/filelists:file", _namespaces
+            )]
+        )
+
+    def test_copy_records_from_published_metadata(self):
+        self._write([self.package])
+        self.driver.fetch.reset_mock()
+        self._write([self.package])
+        self.assertEqual(0, self.driver.fetch.call_count)
+        self.assertEqual(
+            ["/usr/bin/test", "/usr/share/test"],
+            [x.text for x in self._get_metadata()["filelists"].iterfind(
+                "./filelists:package/filelists:file", _namespaces
+            )]
+        )
+        self.assertEqual(
+            4, len(os.listdir(path.join(self.path, "repodata")))
+        )
+
+    def test_keep_published_packages(self):
+        entries = self._write([self.package])
+        self.driver.fetch.reset_mock()
+        self.assertEqual(entries, self._write([], entries))
+        self.assertEqual(0, self.driver.fetch.call_count)
+        primary = self._get_metadata()["primary"]
+        self.assertEqual("1", primary.attrib["packages"])
+        self.assertEqual(
+            "test",
+            primary.findtext("./main:package/main:name",
+                             namespaces=_namespaces)
+        )
+
+    def test_make_record_from_primary(self):
+        os.remove(path.join(
+            self.upstream, "os", "x86_64", "repodata", "filelists.xml.gz"
+        ))
+        self._write([self.package])
+        record = self._get_metadata()["filelists"].find(
+            "./filelists:package", _namespaces
+        )
+        self.assertEqual("test", record.attrib["name"])
+        self.assertEqual(
+            "1.1.1.1",
+            record.find("./filelists:version", _namespaces).attrib["ver"]
+        )
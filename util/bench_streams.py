@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Micro-benchmarks for stream wrappers.
+
+Measures the throughput of read, readline, readinto, gzip decompression
+and checksum calculation on the synthetic Packages-like index.
+
+Usage: python util/bench_streams.py [--size MB] [--chunk-size KB]
+"""
+
+import argparse
+import gzip
+import io
+import time
+
+from packetary.library import checksum
+from packetary.library import streams
+
+
+PARAGRAPH = (
+    b"Package: package-%d\n"
+    b"Version: 1.0-%d\n"
+    b"Architecture: amd64\n"
+    b"Filename: pool/main/p/package/package_1.0-%d_amd64.deb\n"
+    b"Size: 123456\n"
+    b"MD5sum: cc3d5ed5fda53dfa81ea6aa951d7e1fe\n"
+    b"Description: the test package\n"
+    b"\n"
+)
+
+
+def make_index(size):
+    chunks = []
+    total = 0
+    i = 0
+    while total < size:
+        chunk = PARAGRAPH % (i, i, i)
+        chunks.append(chunk)
+        total += len(chunk)
+        i += 1
+    return b"".join(chunks)
+
+
+def compress(data):
+    output = io.BytesIO()
+    with gzip.GzipFile(fileobj=output, mode="wb") as gz:
+        gz.write(data)
+    return output.getvalue()
+
+
+def bench_read(data, chunk_size):
+    stream = streams.StreamWrapper(io.BytesIO(data), chunk_size)
+    return len(stream.read())
+
+
+def bench_readline(data, chunk_size):
+    stream = streams.StreamWrapper(io.BytesIO(data), chunk_size)
+    return sum(len(x) for x in stream)
+
+
+def bench_readinto(data, chunk_size):
+    stream = streams.StreamWrapper(io.BytesIO(data), chunk_size)
+    view = memoryview(bytearray(chunk_size))
+    total = 0
+    while True:
+        size = stream.readinto(view)
+        if not size:
+            break
+        total += size
+    return total
+
+
+def bench_gzip(data, chunk_size):
+    stream = streams.GzipDecompress(io.BytesIO(data), chunk_size)
+    return sum(len(x) for x in stream)
+
+
+def bench_checksum(data, chunk_size):
+    checksum.sha256(io.BytesIO(data), chunk_size)
+    return len(data)
+
+
+def measure(name, func, data, chunk_size, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.time()
+        size = func(data, chunk_size)
+        elapsed = time.time() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    print("{0:<10} {1:>10.1f} MB/s".format(
+        name, size / max(best, 1e-9) / (1 << 20)
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=64, metavar="MB")
+    parser.add_argument("--chunk-size", type=int, default=64, metavar="KB")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    data = make_index(args.size << 20)
+    gzipped = compress(data)
+    chunk_size = args.chunk_size << 10
+    measure("read", bench_read, data, chunk_size, args.repeat)
+    measure("readline", bench_readline, data, chunk_size, args.repeat)
+    measure("readinto", bench_readinto, data, chunk_size, args.repeat)
+    measure("gzip", bench_gzip, gzipped, chunk_size, args.repeat)
+    measure("sha256", bench_checksum, data, chunk_size, args.repeat)
+
+
+if __name__ == "__main__":
+    main()